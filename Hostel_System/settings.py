@@ -101,6 +101,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'hms.context_processors.unread_counts',
             ],
         },
     },
@@ -140,6 +141,35 @@ else:
             }
         }
 
+# ============================================
+# CACHE
+# ============================================
+# CACHE_BACKEND picks a backend that needs no extra service: 'locmem' (per
+# process), 'file' or 'db' (shared by all workers; run `createcachetable`).
+# Version bumps must reach every worker, so production defaults to 'db'.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem' if DEBUG else 'db')
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'hms',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / 'cache')),
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', 'hms_cache'),
+    },
+}
+CACHES = {
+    'default': {
+        **CACHE_BACKENDS[CACHE_BACKEND],
+        'TIMEOUT': int(os.getenv('CACHE_TIMEOUT', 600)),
+        'KEY_PREFIX': 'hms',
+    }
+}
+
 # ============================================
 # PASSWORD VALIDATION
 # ============================================
@@ -197,6 +227,7 @@ ACCOUNT_USERNAME_REQUIRED = True
 ACCOUNT_AUTHENTICATION_METHOD = 'email'
 ACCOUNT_EMAIL_VERIFICATION = 'optional'
 SOCIALACCOUNT_AUTO_SIGNUP = True
+ACCOUNT_ADAPTER = 'hms.adapters.AccountAdapter'  # adds hms.ratelimit login throttling
 
 SOCIALACCOUNT_PROVIDERS = {
     'google': {
@@ -226,6 +257,95 @@ else:
     EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
     EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 
+# Messages sent per SMTP connection by NotificationService.send_bulk_email
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 50))
+
+# ============================================
+# NOTIFICATION QUEUE
+# ============================================
+# Drained by `python manage.py process_notifications`
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', 5))
+NOTIFICATION_RETRY_BASE_SECONDS = int(os.getenv('NOTIFICATION_RETRY_BASE_SECONDS', 60))
+NOTIFICATION_RETRY_MAX_SECONDS = int(os.getenv('NOTIFICATION_RETRY_MAX_SECONDS', 3600))
+NOTIFICATION_RATE_LIMITS = {  # messages per second; SMS limits are per provider below
+    'email': float(os.getenv('EMAIL_RATE_LIMIT', 5)),
+}
+
+# ============================================
+# AUDIT LOG
+# ============================================
+# Models whose saves and deletes are written to AuditLog. High-volume tables
+# (meals, notifications, outbox, counters) are deliberately left out.
+AUDIT_LOG_MODELS = [
+    'auth.User',
+    'hms.Student', 'hms.Room', 'hms.RoomAssignment', 'hms.RoomChangeRequest',
+    'hms.AwayPeriod', 'hms.LeaveRequest', 'hms.Visitor', 'hms.MaintenanceRequest',
+    'hms.Announcement', 'hms.Activity', 'hms.Document', 'hms.Event', 'hms.EventRSVP',
+    'hms.Message', 'hms.Payment',
+]
+# Entries older than this are deleted by `python manage.py prune_audit_log`
+AUDIT_LOG_RETENTION_DAYS = int(os.getenv('AUDIT_LOG_RETENTION_DAYS', 365))
+# AuditLog and LoginActivity are stored by month (partitioned on PostgreSQL);
+# `python manage.py archive_logs` moves months past this many to gzipped JSONL
+# and prepares the coming months' partitions. render.yaml runs it daily with
+# --partitions-only, since the cron filesystem cannot hold the archives.
+# It keeps whole months besides the current one (up to ~13 months of rows), so
+# a 365-day prune_audit_log deletes the oldest of them before they are
+# archived: run only archive_logs, or keep the retention above 31 * (months + 1) days.
+LOG_ARCHIVE_KEEP_MONTHS = int(os.getenv('LOG_ARCHIVE_KEEP_MONTHS', 12))
+LOG_ARCHIVE_DIR = os.getenv('LOG_ARCHIVE_DIR', BASE_DIR / 'log_archive')
+
+# ============================================
+# LOGIN ACTIVITY
+# ============================================
+# Login and failed-login events are queued and written in batches by a
+# background thread (hms.logins); 'False' writes each one as it happens.
+LOGIN_ACTIVITY_BUFFERED = os.getenv('LOGIN_ACTIVITY_BUFFERED', 'True') == 'True'
+LOGIN_ACTIVITY_BATCH_SIZE = int(os.getenv('LOGIN_ACTIVITY_BATCH_SIZE', 100))
+LOGIN_ACTIVITY_FLUSH_SECONDS = float(os.getenv('LOGIN_ACTIVITY_FLUSH_SECONDS', 2))
+# Proxies in front of the app that append to X-Forwarded-For. Render has one
+# (set in render.yaml); without it every client shares the proxy's address.
+TRUSTED_PROXY_COUNT = int(os.getenv('TRUSTED_PROXY_COUNT', 0))
+# Directory holding GeoLite2-Country.mmdb; enables login summaries by country
+GEOIP_PATH = os.getenv('GEOIP_PATH')
+# Sliding-window login throttling (hms.ratelimit), checked before password
+# hashing: (failures, seconds) per client IP and per username
+RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', 'True') == 'True'
+# Where the counters live: 'db' (RateLimitCounter rows, shared by all workers)
+# or 'cache' (RATELIMIT_CACHE; needs an atomic incr, e.g. Redis, to be shared)
+RATELIMIT_STORE = os.getenv('RATELIMIT_STORE', 'cache' if DEBUG else 'db')
+RATELIMIT_CACHE = os.getenv('RATELIMIT_CACHE', 'default')
+LOGIN_RATE_LIMITS = {
+    'ip': (int(os.getenv('LOGIN_RATE_LIMIT_IP', 30)), 300),
+    'username': (int(os.getenv('LOGIN_RATE_LIMIT_USERNAME', 5)), 900),
+}
+
+# ============================================
+# REAL-TIME NOTIFICATIONS
+# ============================================
+# Unset, the broker follows the database: 'hms.realtime.PostgresBroker' on
+# PostgreSQL relays events between workers and commands, while
+# 'hms.realtime.InProcessBroker' (SQLite) reaches streams in the same process only.
+REALTIME_BROKER = os.getenv('REALTIME_BROKER')
+
+# ============================================
+# SMS CONFIGURATION
+# ============================================
+SMS_ENABLED = os.getenv('SMS_ENABLED', 'False') == 'True'
+SMS_PROVIDER = os.getenv('SMS_PROVIDER', '')  # 'africastalking', 'twilio' or 'fake'; inferred from credentials if empty
+SMS_MAX_WORKERS = int(os.getenv('SMS_MAX_WORKERS', 4))
+SMS_COUNTRY_CODE = os.getenv('SMS_COUNTRY_CODE', '254')  # for local numbers such as 0712...
+SMS_RATE_LIMITS = {  # provider API requests per second
+    'africastalking': float(os.getenv('AFRICASTALKING_RATE_LIMIT', 5)),
+    'twilio': float(os.getenv('TWILIO_RATE_LIMIT', 1)),
+}
+AFRICASTALKING_USERNAME = os.getenv('AFRICASTALKING_USERNAME')
+AFRICASTALKING_API_KEY = os.getenv('AFRICASTALKING_API_KEY')
+AFRICASTALKING_BATCH_SIZE = int(os.getenv('AFRICASTALKING_BATCH_SIZE', 100))
+TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
+TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
+TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
+
 # ============================================
 # MPESA CONFIGURATION
 # ============================================
@@ -0,0 +1,19 @@
+"""
+Allauth Adapters for HMS
+Hooks into django-allauth's account flow
+"""
+from allauth.account.adapter import DefaultAccountAdapter
+
+from . import ratelimit
+
+
+class AccountAdapter(DefaultAccountAdapter):
+    """Applies the hms.ratelimit login limits to allauth logins"""
+
+    def pre_authenticate(self, request, **credentials):
+        super().pre_authenticate(request, **credentials)
+        username = credentials.get('email') or credentials.get('username') or ''
+        try:
+            ratelimit.check_login(request, username)
+        except ratelimit.RateLimited:
+            raise self.validation_error('too_many_login_attempts')
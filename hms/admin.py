@@ -1,7 +1,12 @@
 from django.contrib import admin
-from .models import (Student, Meal, Activity, AwayPeriod, Announcement, 
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.utils import timezone
+import datetime
+from . import partitions
+from .models import (Student, Meal, DailyMealSummary, Activity, AwayPeriod, Announcement, 
                      MaintenanceRequest, Room, RoomAssignment, RoomChangeRequest, LeaveRequest,
-                     Event, EventRSVP, LoginActivity, AuditLog, Notification, Payment)
+                     Event, EventRSVP, LoginActivity, AuditLog, Notification, Payment,
+                     OutboundNotification)
 
 @admin.register(Student)
 class StudentAdmin(admin.ModelAdmin):
@@ -14,6 +19,15 @@ class MealAdmin(admin.ModelAdmin):
     list_filter = ('date', 'breakfast', 'supper', 'away')
     search_fields = ('student__user__username', 'student__university_id')
 
+@admin.register(DailyMealSummary)
+class DailyMealSummaryAdmin(admin.ModelAdmin):
+    list_display = ('date', 'confirmed', 'breakfast', 'early', 'supper', 'away', 'updated_at')
+    date_hierarchy = 'date'
+    readonly_fields = ('date', 'confirmed', 'breakfast', 'early', 'supper', 'away', 'updated_at')
+
+    def has_add_permission(self, request):
+        return False
+
 @admin.register(Activity)
 class ActivityAdmin(admin.ModelAdmin):
     list_display = ('display_name', 'weekday', 'time', 'active')
@@ -73,22 +87,65 @@ class EventRSVPAdmin(admin.ModelAdmin):
     list_filter = ('status', 'attended', 'event')
     search_fields = ('event__title', 'student__user__username', 'student__university_id')
 
+class MonthListFilter(admin.SimpleListFilter):
+    """Show one month at a time, the current one by default
+
+    AuditLog and LoginActivity are stored by month, so a bounded month
+    reads a single partition instead of every year of history.
+    """
+    title = 'month'
+    parameter_name = 'month'
+    months_shown = 12
+    ALL = 'all'
+
+    def lookups(self, request, model_admin):
+        month = partitions.month_start(timezone.localdate())
+        choices = []
+        for _ in range(self.months_shown):
+            choices.append((month.strftime('%Y-%m'), month.strftime('%B %Y')))
+            month = partitions.add_months(month, -1)
+        return choices + [(self.ALL, 'All months')]
+
+    def value(self):
+        return super().value() or timezone.localdate().strftime('%Y-%m')
+
+    def choices(self, changelist):
+        # No implicit "All" entry: leaving the filter off means this month
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': self.value() == lookup,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        if self.value() == self.ALL:
+            return queryset
+        try:
+            month = datetime.date.fromisoformat(f'{self.value()}-01')
+        except ValueError:
+            raise IncorrectLookupParameters(f'Invalid month: {self.value()}')
+        start, end = partitions.month_bounds(month, tz=timezone.get_current_timezone())
+        return queryset.filter(timestamp__gte=start, timestamp__lt=end)
+
 @admin.register(LoginActivity)
 class LoginActivityAdmin(admin.ModelAdmin):
-    list_display = ('user', 'ip_address', 'timestamp', 'status')
-    list_filter = ('timestamp', 'status')
-    search_fields = ('user__username', 'ip_address')
-    readonly_fields = ('user', 'ip_address', 'user_agent', 'timestamp', 'status')
+    list_display = ('user', 'username', 'ip_address', 'timestamp', 'status')
+    list_filter = (MonthListFilter, 'status')
+    show_full_result_count = False  # no COUNT(*) over every partition
+    search_fields = ('user__username', 'username', 'ip_address')
+    readonly_fields = ('user', 'username', 'ip_address', 'user_agent', 'timestamp', 'status')
 
     def has_add_permission(self, request):
         return False
 
 @admin.register(AuditLog)
 class AuditLogAdmin(admin.ModelAdmin):
-    list_display = ('action', 'model_name', 'object_repr', 'user', 'timestamp')
-    list_filter = ('action', 'model_name', 'timestamp')
-    search_fields = ('object_repr', 'changes', 'user__username')
-    readonly_fields = ('user', 'model_name', 'object_id', 'object_repr', 'action', 'changes', 'timestamp')
+    list_display = ('action', 'model_name', 'object_repr', 'user', 'actor', 'timestamp')
+    list_filter = (MonthListFilter, 'action', 'model_name')
+    show_full_result_count = False
+    search_fields = ('object_repr', 'changes', 'user__username', 'actor')
+    readonly_fields = ('user', 'actor', 'model_name', 'object_id', 'object_repr', 'action', 'changes', 'diff', 'timestamp')
 
     def has_add_permission(self, request):
         return False
@@ -105,3 +162,21 @@ class PaymentAdmin(admin.ModelAdmin):
     list_filter = ('status', 'created_at')
     search_fields = ('student__user__username', 'transaction_id', 'phone_number')
     readonly_fields = ('transaction_id', 'checkout_request_id', 'created_at')
+
+@admin.register(OutboundNotification)
+class OutboundNotificationAdmin(admin.ModelAdmin):
+    list_display = ('channel', 'recipient', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status', 'channel', 'created_at')
+    search_fields = ('recipient', 'subject', 'source')
+    readonly_fields = ('channel', 'recipient', 'subject', 'body', 'html_body', 'source', 'attempts',
+                       'last_error', 'created_at', 'sent_at')
+    actions = ['retry_now']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='Retry selected messages now')
+    def retry_now(self, request, queryset):
+        from django.utils import timezone
+        updated = queryset.exclude(status='sent').update(status='pending', attempts=0, next_attempt_at=timezone.now())
+        self.message_user(request, f'{updated} message(s) queued for retry.')
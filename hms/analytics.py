@@ -0,0 +1,136 @@
+"""
+Analytics Time-Series for HMS
+Grouped, zero-filled series for the analytics dashboard
+"""
+from datetime import date, datetime, timedelta
+from django.db.models import Count
+
+from . import meal_stats
+
+DEFAULT_RANGE_DAYS = 30
+MAX_RANGE_DAYS = 366
+
+
+def parse_date_range(params, default_days=DEFAULT_RANGE_DAYS, max_days=MAX_RANGE_DAYS):
+    """Resolve the reporting window from request parameters
+
+    Accepts either ``start``/``end`` (YYYY-MM-DD) or ``days`` (ending today).
+    Invalid values fall back to the default window and the range is capped
+    at max_days.
+
+    Returns:
+        tuple: (start_date, end_date)
+    """
+    end_date = date.today()
+    try:
+        if params.get('end'):
+            end_date = datetime.strptime(params['end'], '%Y-%m-%d').date()
+        if params.get('start'):
+            start_date = datetime.strptime(params['start'], '%Y-%m-%d').date()
+        else:
+            # Clamped first, so a huge value cannot overflow timedelta
+            days = min(max(int(params.get('days', default_days)), 1), max_days)
+            start_date = end_date - timedelta(days=days - 1)
+    except (TypeError, ValueError, OverflowError):
+        end_date = date.today()
+        start_date = end_date - timedelta(days=default_days - 1)
+
+    if start_date > end_date:
+        start_date, end_date = end_date, start_date
+    if (end_date - start_date).days >= max_days:
+        start_date = end_date - timedelta(days=max_days - 1)
+
+    return start_date, end_date
+
+
+def meal_series(start_date, end_date, label_format='%m/%d', stats=None):
+    """Per-day meal counters as parallel chart series
+
+    Args:
+        start_date: First day of the series
+        end_date: Last day of the series (inclusive)
+        label_format: strftime format for the x-axis labels
+        stats: Optional precomputed daily_meal_stats covering the range
+
+    Returns:
+        dict: {'labels': [...], 'breakfast': [...], 'early': [...], ...}
+    """
+    if stats is None:
+        stats = meal_stats.daily_meal_stats(start_date, end_date)
+
+    series = {'labels': []}
+    for counter in meal_stats.MEAL_COUNTERS + ('confirmed',):
+        series[counter] = []
+
+    for day in meal_stats.date_range(start_date, end_date):
+        series['labels'].append(day.strftime(label_format))
+        for counter, value in stats[day].items():
+            series[counter].append(value)
+
+    return series
+
+
+def grouped_counts(queryset, *fields):
+    """Count rows for every combination of fields in one GROUP BY query
+
+    Returns:
+        list: dicts holding the field values and a 'total' key
+    """
+    return list(queryset.order_by().values(*fields).annotate(total=Count('pk')))
+
+
+def count_by(rows, field, choices):
+    """Fold grouped rows into zero-filled totals for one field
+
+    Args:
+        rows: Output of grouped_counts
+        field: Field to total by
+        choices: Django choices list; every code gets an entry
+
+    Returns:
+        dict: choice code -> total
+    """
+    totals = {code: 0 for code, _ in choices}
+    for row in rows:
+        totals[row[field]] = totals.get(row[field], 0) + row['total']
+    return totals
+
+
+def maintenance_breakdown():
+    """Maintenance requests by status and by priority (one query)"""
+    from .models import MaintenanceRequest
+
+    rows = grouped_counts(MaintenanceRequest.objects.all(), 'status', 'priority')
+    return {
+        'status': count_by(rows, 'status', MaintenanceRequest.STATUS_CHOICES),
+        'priority': count_by(rows, 'priority', MaintenanceRequest.PRIORITY_CHOICES),
+    }
+
+
+def leave_breakdown():
+    """Leave requests by status and by type (one query)"""
+    from .models import LeaveRequest
+
+    rows = grouped_counts(LeaveRequest.objects.all(), 'status', 'leave_type')
+    return {
+        'status': count_by(rows, 'status', LeaveRequest.STATUS_CHOICES),
+        'type': count_by(rows, 'leave_type', LeaveRequest.LEAVE_TYPES),
+    }
+
+
+def room_breakdown():
+    """Rooms by type and availability (one query)"""
+    from .models import Room
+
+    rows = grouped_counts(Room.objects.all(), 'room_type', 'is_available')
+    total = sum(row['total'] for row in rows)
+    available = sum(row['total'] for row in rows if row['is_available'])
+    return {
+        'occupancy': {
+            'total': total,
+            'available': available,
+            'occupied': total - available,
+            'occupancy_rate': round((total - available) / total * 100, 1) if total > 0 else 0,
+        },
+        'type': count_by(rows, 'room_type', Room.ROOM_TYPES),
+    }
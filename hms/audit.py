@@ -0,0 +1,198 @@
+"""
+Audit Log Writer for HMS
+Field-level change tracking and buffered, transaction-aware AuditLog writes
+
+Models using ChangeTrackingMixin remember their field values as loaded, so
+the diff for an audit entry is computed in memory without re-reading the
+row. Entries are kept only if the transaction that made the change commits.
+Inside an audit buffer (every request opens one in AuditMiddleware) they
+are collected and written with a single bulk_create when the buffer
+closes; outside one they are written as soon as their transaction commits.
+Only models listed in settings.AUDIT_LOG_MODELS are audited.
+"""
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.fields.files import FieldFile
+import contextvars
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+_buffer = contextvars.ContextVar('hms_audit_buffer', default=None)
+
+
+@functools.lru_cache(maxsize=None)
+def _audited_labels(labels):
+    return frozenset(label.lower() for label in labels)
+
+
+# ==================== CHANGE TRACKING ====================
+
+# Never copied into audit entries
+UNTRACKED_FIELDS = {'password'}
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, FieldFile):
+        return value.name or None
+    return str(value)
+
+
+class ChangeTrackingMixin:
+    """Snapshot field values when a row is loaded so saves can be diffed in memory"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    @classmethod
+    def _tracked_fields(cls):
+        return [
+            field for field in cls._meta.concrete_fields
+            if not getattr(field, 'auto_now', False) and field.name not in UNTRACKED_FIELDS
+        ]
+
+    def field_values(self, update_fields=None):
+        """Tracked field values keyed by attname (loaded fields only)"""
+        deferred = self.get_deferred_fields()
+        return {
+            field.attname: getattr(self, field.attname)
+            for field in self._tracked_fields()
+            if field.attname not in deferred
+            and (update_fields is None or field.name in update_fields or field.attname in update_fields)
+        }
+
+    def field_changes(self, update_fields=None):
+        """{attname: [old, new]} for fields changed since load; None if never loaded"""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        return {
+            name: [_json_value(loaded[name]), _json_value(value)]
+            for name, value in self.field_values(update_fields).items()
+            if name in loaded and loaded[name] != value
+        }
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Later saves diff against what is now in the database
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self._loaded_values = self.field_values()
+        else:
+            self._loaded_values = {**getattr(self, '_loaded_values', {}), **self.field_values(update_fields)}
+
+
+def audit_diff(instance, action, update_fields=None):
+    """JSON-ready field diff for an audit entry, or None for untracked models
+
+    CREATE records every field as [None, value], DELETE as [value, None];
+    UPDATE records only the fields that changed since the row was loaded.
+    """
+    if not isinstance(instance, ChangeTrackingMixin):
+        return None
+    if action == 'UPDATE':
+        return instance.field_changes(update_fields)
+    values = {name: _json_value(value) for name, value in instance.field_values().items()}
+    if action == 'CREATE':
+        return {name: [None, value] for name, value in values.items()}
+    return {name: [value, None] for name, value in values.items()}
+
+
+# ==================== WRITER ====================
+
+def is_audited(model):
+    """Whether saves and deletes of model are written to AuditLog"""
+    return model._meta.label_lower in _audited_labels(tuple(getattr(settings, 'AUDIT_LOG_MODELS', ())))
+
+
+def record(entry):
+    """Queue an unsaved AuditLog; dropped if the surrounding transaction rolls back"""
+    transaction.on_commit(functools.partial(_enqueue, entry))
+
+
+def _enqueue(entry):
+    pending = _buffer.get()
+    if pending is None:
+        write([entry])
+    else:
+        pending.append(entry)
+
+
+def write(entries):
+    """Insert audit entries in bulk, logging rather than failing the caller"""
+    from .models import AuditLog
+
+    try:
+        AuditLog.objects.bulk_create(entries, batch_size=500)
+    except Exception as e:
+        logger.error(f"Failed to write {len(entries)} audit log entries: {str(e)}")
+
+
+def open_buffer():
+    """Start collecting entries in this context
+
+    Returns:
+        tuple: (pending entries, token for close_buffer). The token is None
+        when a buffer is already open; the outer buffer writes the entries.
+    """
+    pending = _buffer.get()
+    if pending is not None:
+        return pending, None
+    pending = []
+    return pending, _buffer.set(pending)
+
+
+def close_buffer(token):
+    """Stop collecting; the caller writes the pending entries if token is not None"""
+    if token is not None:
+        _buffer.reset(token)
+
+
+@contextmanager
+def audit_buffer():
+    """Write the audit entries made inside the block with one query at the end"""
+    pending, token = open_buffer()
+    try:
+        yield pending
+    finally:
+        close_buffer(token)
+        if token is not None and pending:
+            write(pending)
+
+
+# ==================== RETENTION ====================
+
+def prune(before, batch_size=1000):
+    """Delete entries older than before in primary-key batches
+
+    Small batches keep each DELETE short, so request writes are not held up
+    behind one long lock on the table.
+
+    Returns:
+        int: Number of entries deleted
+    """
+    from .models import AuditLog
+
+    expired = AuditLog.objects.filter(timestamp__lt=before).order_by()
+    deleted = 0
+    while True:
+        ids = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        # Nothing references AuditLog, so skip the collector (and the
+        # per-row post_delete signals it would send) and DELETE directly
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {quote(AuditLog._meta.db_table)} '
+                f'WHERE {quote(AuditLog._meta.pk.column)} IN ({", ".join(["%s"] * len(ids))})',
+                ids,
+            )
+            deleted += cursor.rowcount
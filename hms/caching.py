@@ -0,0 +1,147 @@
+"""
+Read Caching for HMS
+Versioned cache entries for the lists shown on student read pages
+
+Each namespace (announcements, activities, documents, events) has a
+version number kept in the cache. Entries are stored under the current
+version, and saving or deleting a row of the namespace's model bumps the
+version once the transaction commits, so stale entries are never read
+again and simply expire. Bumps only reach other workers through a shared
+cache backend (see CACHE_BACKEND). Hits and misses are counted per
+namespace in this process for monitoring.
+"""
+from collections import Counter
+from django.core.cache import cache
+import threading
+import time
+
+_MISSING = object()
+
+
+# ==================== VERSIONS ====================
+
+def _version_key(namespace):
+    return f'hms:ns:{namespace}'
+
+
+def _new_version():
+    # Unique per bump, so a version lost to eviction is never reissued
+    return time.time_ns()
+
+
+def versions(*namespaces):
+    """{namespace: current version}, in one cache read once the versions exist"""
+    found = cache.get_many([_version_key(ns) for ns in namespaces])
+    current = {}
+    for namespace in namespaces:
+        version = found.get(_version_key(namespace))
+        if version is None:
+            # Missing (first use or evicted): start afresh rather than
+            # fall back to a version older entries may still be under
+            cache.add(_version_key(namespace), _new_version(), timeout=None)
+            version = cache.get(_version_key(namespace))
+        current[namespace] = version
+    return current
+
+
+def bump(namespace):
+    """Invalidate every entry of namespace"""
+    cache.set(_version_key(namespace), _new_version(), timeout=None)
+
+
+# ==================== STATISTICS ====================
+
+class CacheStats:
+    """Per-namespace hit and miss counts for this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def record(self, namespace, hit):
+        with self._lock:
+            self._counts[(namespace, 'hits' if hit else 'misses')] += 1
+
+    def summary(self):
+        with self._lock:
+            counts = dict(self._counts)
+        summary = {}
+        for namespace in sorted({ns for ns, _ in counts}):
+            hits, misses = counts.get((namespace, 'hits'), 0), counts.get((namespace, 'misses'), 0)
+            summary[namespace] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': round(hits / (hits + misses), 3),
+            }
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+stats = CacheStats()
+
+
+# ==================== LOOKUPS ====================
+
+def _entry_key(namespace, name, version):
+    # The version is part of the key, so entries of several namespaces
+    # can be read with one get_many
+    return f'hms:{namespace}:{name}:{version}'
+
+
+def _store(values, timeout):
+    if timeout is None:
+        cache.set_many(values)
+    else:
+        cache.set_many(values, timeout)
+
+
+def get_or_build(namespace, name, build, timeout=None, version=None):
+    """The cached value of name in namespace, building and storing it on a miss
+
+    Args:
+        build: Callable returning the value; querysets should be evaluated
+            (e.g. wrapped in list()) so the results, not the query, are cached
+        timeout: Seconds to keep the value (None for the cache default)
+        version: Namespace version if already fetched with versions()
+    """
+    if version is None:
+        version = versions(namespace)[namespace]
+    key = _entry_key(namespace, name, version)
+    value = cache.get(key, _MISSING)
+    stats.record(namespace, hit=value is not _MISSING)
+    if value is _MISSING:
+        value = build()
+        _store({key: value}, timeout)
+    return value
+
+
+def get_or_build_many(builds, timeout=None):
+    """Cached values for several (namespace, name) entries, building only the missing ones
+
+    Reads the versions and then every entry with one get_many each, so a
+    page showing several lists costs two cache reads on any backend.
+
+    Args:
+        builds: {(namespace, name): build callable}, as for get_or_build
+        timeout: Seconds to keep built values (None for the cache default)
+
+    Returns:
+        dict: {(namespace, name): value}
+    """
+    current = versions(*dict.fromkeys(namespace for namespace, _ in builds))
+    keys = {entry: _entry_key(*entry, current[entry[0]]) for entry in builds}
+    found = cache.get_many(keys.values())
+
+    values, built = {}, {}
+    for entry, key in keys.items():
+        stats.record(entry[0], hit=key in found)
+        if key in found:
+            values[entry] = found[key]
+        else:
+            values[entry] = built[key] = builds[entry]()
+    if built:
+        _store(built, timeout)
+    return values
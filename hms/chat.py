@@ -0,0 +1,124 @@
+"""
+Chat for HMS
+Student conversations with the shared staff inbox
+
+Every student has one Conversation. Messages from the student go to the
+staff inbox, where any staff member can read and reply. Each side of a
+conversation has a read cursor and an unread count on the Conversation row.
+The unread count is mirrored into UnreadCounter badges: the student's
+counter, or every staff member's counter for messages to the inbox.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import unread
+
+
+def conversation_for(student):
+    """The student's conversation, created on first use"""
+    from .models import Conversation
+
+    conversation, _ = Conversation.objects.get_or_create(student=student)
+    return conversation
+
+
+def find_conversation(student):
+    """The student's conversation, or None if nothing has been sent yet (read-only)"""
+    from .models import Conversation
+
+    return Conversation.objects.filter(student=student).first()
+
+
+def staff_ids():
+    return list(User.objects.filter(is_staff=True).values_list('pk', flat=True))
+
+
+def side_of(conversation, user):
+    """'student' or 'staff': the side of the conversation user reads"""
+    return 'student' if user.pk == conversation.student_id else 'staff'
+
+
+def _readers(conversation_student_id, side):
+    """Users whose unread badge follows the given side of a conversation"""
+    return [conversation_student_id] if side == 'student' else staff_ids()
+
+
+def record_message(message):
+    """Update the conversation and the reader's unread counts for a new message"""
+    from .models import Conversation
+
+    student_id = message.conversation.student_id
+    reader = 'staff' if message.sender_id == student_id else 'student'
+
+    with transaction.atomic(savepoint=False):
+        Conversation.objects.filter(pk=message.conversation_id).update(
+            last_message_at=message.timestamp,
+            last_message_preview=message.content[:Conversation.PREVIEW_LENGTH],
+            **{f'{reader}_unread': F(f'{reader}_unread') + 1},
+        )
+        unread.adjust_many(dict.fromkeys(_readers(student_id, reader), 1), messages=1)
+
+
+def forget_message(message):
+    """Take a deleted message out of the unread counts if its reader had not reached it"""
+    from .models import Conversation
+
+    row = Conversation.objects.filter(pk=message.conversation_id).values(
+        'student_id', 'student_read_id', 'staff_read_id'
+    ).first()
+    if row is None:
+        return
+    reader = 'staff' if message.sender_id == row['student_id'] else 'student'
+    if message.pk <= row[f'{reader}_read_id']:
+        return
+
+    with transaction.atomic(savepoint=False):
+        Conversation.objects.filter(pk=message.conversation_id).update(
+            **{f'{reader}_unread': F(f'{reader}_unread') - 1}
+        )
+        unread.adjust_many(dict.fromkeys(_readers(row['student_id'], reader), 1), messages=-1)
+
+
+def mark_read(conversation, user):
+    """Move the user's side's read cursor to the newest message
+
+    Returns:
+        int: Number of messages that were unread on that side
+    """
+    from .models import Conversation, Message
+
+    side = side_of(conversation, user)
+    with transaction.atomic(savepoint=False):
+        marked = Conversation.objects.select_for_update().filter(
+            pk=conversation.pk
+        ).values_list(f'{side}_unread', flat=True).first()
+        if not marked:
+            return 0
+        newest = Message.objects.filter(conversation=conversation.pk).order_by('-id').values('id')[:1]
+        Conversation.objects.filter(pk=conversation.pk).update(**{
+            f'{side}_read_id': Coalesce(Subquery(newest), 0),
+            f'{side}_unread': 0,
+        })
+        unread.adjust_many(dict.fromkeys(_readers(conversation.student_id, side), 1), messages=-marked)
+
+    setattr(conversation, f'{side}_unread', 0)
+    return marked
+
+
+def recount_conversations():
+    """Recompute every conversation's unread counts from its read cursors"""
+    from .models import Conversation, Message
+
+    def unread_after(cursor, from_student):
+        messages = Message.objects.filter(conversation=OuterRef('pk'), id__gt=OuterRef(cursor))
+        messages = messages.filter(sender=OuterRef('student')) if from_student else messages.exclude(sender=OuterRef('student'))
+        return Coalesce(Subquery(
+            messages.order_by().values('conversation').annotate(total=Count('id')).values('total')
+        ), 0)
+
+    Conversation.objects.update(
+        staff_unread=unread_after('staff_read_id', from_student=True),
+        student_unread=unread_after('student_read_id', from_student=False),
+    )
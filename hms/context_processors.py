@@ -0,0 +1,21 @@
+"""
+Template Context Processors for HMS
+Values every page template can use
+"""
+from django.utils.functional import SimpleLazyObject
+
+
+def unread_counts(request):
+    """Unread message and notification badges
+
+    Lazy, so the single counter lookup only runs on pages that render a badge.
+    """
+    def counts():
+        from .unread import counts_for
+
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return {'messages': 0, 'notifications': 0}
+        return counts_for(user)
+
+    return {'unread_counts': SimpleLazyObject(counts)}
@@ -0,0 +1,195 @@
+"""
+Meal Exports for HMS
+Streaming CSV and XLSX exports of meal records over date ranges
+
+Rows are read with values_list().iterator() so no model instances or
+queryset cache are built; memory stays flat whatever the size of the range.
+Under ASGI the response content is an async iterator (see
+streaming_content), since Django would otherwise read a sync iterator to
+the end before sending anything.
+"""
+from asgiref.sync import sync_to_async
+import csv
+import tempfile
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Count, Q
+
+from . import meal_stats
+
+EXPORT_CHUNK_SIZE = 2000
+
+MEAL_HEADER = ['Date', 'Name', 'University ID', 'Breakfast', 'Early', 'Supper', 'Away', 'Phone']
+STUDENT_TOTALS_HEADER = ['University ID', 'Name', 'Days Confirmed', 'Breakfast', 'Early', 'Supper', 'Away']
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def _yes_no(flag):
+    return 'Yes' if flag else 'No'
+
+
+def _full_name(first_name, last_name):
+    """Same result as User.get_full_name() without loading the user"""
+    return f'{first_name} {last_name}'.strip()
+
+
+def export_filename(start_date, end_date, extension):
+    if start_date == end_date:
+        return f'meals_{start_date}.{extension}'
+    return f'meals_{start_date}_to_{end_date}.{extension}'
+
+
+def meal_rows(start_date, end_date, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield one row per meal record in the range, ordered by date"""
+    from .models import Meal
+
+    rows = Meal.objects.filter(date__range=(start_date, end_date)).order_by(
+        'date', 'student__university_id'
+    ).values_list(
+        'date', 'student__user__first_name', 'student__user__last_name', 'student__university_id',
+        'breakfast', 'early', 'supper', 'away', 'student__phone'
+    )
+
+    for day, first_name, last_name, university_id, breakfast, early, supper, away, phone in rows.iterator(chunk_size=chunk_size):
+        yield [
+            day.isoformat(),
+            _full_name(first_name, last_name),
+            university_id,
+            _yes_no(breakfast),
+            _yes_no(early),
+            _yes_no(supper),
+            _yes_no(away),
+            phone,
+        ]
+
+
+def student_total_rows(start_date, end_date, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield per-student meal counts for the range from one grouped query"""
+    from .models import Meal
+
+    rows = Meal.objects.filter(date__range=(start_date, end_date)).order_by(
+        'student__university_id'
+    ).values(
+        'student__university_id', 'student__user__first_name', 'student__user__last_name'
+    ).annotate(
+        days=Count('id'),
+        **{counter: Count('id', filter=Q(**{counter: True})) for counter in meal_stats.MEAL_COUNTERS}
+    ).values_list(
+        'student__university_id', 'student__user__first_name', 'student__user__last_name',
+        'days', *meal_stats.MEAL_COUNTERS
+    )
+
+    for university_id, first_name, last_name, *counts in rows.iterator(chunk_size=chunk_size):
+        yield [university_id, _full_name(first_name, last_name), *counts]
+
+
+def range_totals(start_date, end_date):
+    """Counters for the whole range, summed from the daily meal summary rollup"""
+    totals = meal_stats.empty_day_stats()
+    for day_stats in meal_stats.daily_meal_stats(start_date, end_date).values():
+        for counter, value in day_stats.items():
+            totals[counter] += value
+    return totals
+
+
+def totals_row(totals):
+    return ['Totals', '', f"{totals['confirmed']} confirmed", totals['breakfast'],
+            totals['early'], totals['supper'], totals['away'], '']
+
+
+def csv_rows(start_date, end_date, chunk_size=EXPORT_CHUNK_SIZE):
+    """Every row of the CSV export: meals, per-student totals, range totals"""
+    yield MEAL_HEADER
+    yield from meal_rows(start_date, end_date, chunk_size)
+
+    yield []
+    yield ['Per-student totals']
+    yield STUDENT_TOTALS_HEADER
+    yield from student_total_rows(start_date, end_date, chunk_size)
+
+    yield []
+    yield totals_row(range_totals(start_date, end_date))
+
+
+class Echo:
+    """File-like object whose write() just returns the value, for streaming csv.writer output"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    """Encode rows as CSV lines one at a time"""
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def file_chunks(output, chunk_size=64 * 1024):
+    """Yield the rest of a file in chunks, closing it at the end"""
+    try:
+        while chunk := output.read(chunk_size):
+            yield chunk
+    finally:
+        output.close()
+
+
+def _next_batch(iterator, size):
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) >= size:
+            break
+    return batch
+
+
+async def _iterate_async(iterator, batch_size):
+    # Batches are pulled on the request's sync thread, so a database
+    # iterator keeps using the same connection between batches
+    iterator = iter(iterator)
+    next_batch = sync_to_async(_next_batch, thread_sensitive=True)
+    while batch := await next_batch(iterator, batch_size):
+        yield batch[0][:0].join(batch)
+
+
+def streaming_content(request, iterator, batch_size=500):
+    """Content for a StreamingHttpResponse that streams under WSGI and ASGI
+
+    Under ASGI, items are joined into batches of batch_size and read
+    through an async iterator, one batch in memory at a time.
+    """
+    if isinstance(request, ASGIRequest):
+        return _iterate_async(iterator, batch_size)
+    return iterator
+
+
+def build_xlsx(start_date, end_date, chunk_size=EXPORT_CHUNK_SIZE):
+    """Write the export workbook to a temporary file
+
+    xlsxwriter runs in constant_memory mode, flushing each row to disk as
+    soon as the next one is written.
+
+    Returns:
+        file: Temporary file positioned at the start of the workbook
+    """
+    import xlsxwriter
+
+    output = tempfile.TemporaryFile()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    bold = workbook.add_format({'bold': True})
+
+    meals_sheet = workbook.add_worksheet('Meals')
+    meals_sheet.write_row(0, 0, MEAL_HEADER, bold)
+    row_num = 0
+    for row_num, row in enumerate(meal_rows(start_date, end_date, chunk_size), start=1):
+        meals_sheet.write_row(row_num, 0, row)
+    meals_sheet.write_row(row_num + 2, 0, totals_row(range_totals(start_date, end_date)), bold)
+
+    totals_sheet = workbook.add_worksheet('Per Student')
+    totals_sheet.write_row(0, 0, STUDENT_TOTALS_HEADER, bold)
+    for row_num, row in enumerate(student_total_rows(start_date, end_date, chunk_size), start=1):
+        totals_sheet.write_row(row_num, 0, row)
+
+    workbook.close()
+    output.seek(0)
+    return output
@@ -0,0 +1,241 @@
+"""
+Login Activity Recorder for HMS
+Buffered, batched LoginActivity writes and recent login summaries
+
+Login signal handlers only build a LoginActivity and put it on a queue; a
+background thread writes the queue with one bulk_create per batch, when
+the batch is full or the flush interval passes, and drains it when the
+process exits. Summaries are read back from the LoginActivity rows, so
+they cover every worker (by country when settings.GEOIP_PATH points at a
+GeoLite2 database).
+"""
+from collections import Counter
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Count, Q
+from django.utils import timezone
+import atexit
+import datetime
+import functools
+import ipaddress
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== REQUEST DETAILS ====================
+
+def client_ip(request):
+    """The client address, trusting only settings.TRUSTED_PROXY_COUNT proxies
+
+    Each trusted proxy appends the address it received the request from to
+    X-Forwarded-For, so the client is the entry that many places from the
+    right; anything further left was sent by the client and can be forged.
+
+    Returns:
+        str or None if the address is missing or malformed
+    """
+    proxies = getattr(settings, 'TRUSTED_PROXY_COUNT', 0)
+    forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+    if proxies and forwarded:
+        candidate = forwarded[-min(proxies, len(forwarded))]
+    else:
+        candidate = request.META.get('REMOTE_ADDR')
+    try:
+        return str(ipaddress.ip_address(candidate))
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=1)
+def _geoip():
+    if not getattr(settings, 'GEOIP_PATH', None):
+        return None
+    try:
+        from django.contrib.gis.geoip2 import GeoIP2
+        return GeoIP2()
+    except Exception as e:
+        logger.error(f"GeoIP unavailable: {str(e)}")
+        return None
+
+
+def country_code(ip):
+    """ISO country code for ip, or None without a GeoIP database or match"""
+    geoip = _geoip()
+    if geoip is None or not ip:
+        return None
+    try:
+        return geoip.country_code(ip)
+    except Exception:
+        return None # Private and unknown addresses
+
+
+# ==================== RECORDER ====================
+
+class LoginRecorder:
+    """Writes LoginActivity rows from a background thread in batches
+
+    Args:
+        batch_size: Rows written per INSERT
+        flush_interval: Longest time (seconds) a row waits in the queue
+        max_queued: Rows held before new events are dropped
+    """
+    _STOP = object()
+
+    def __init__(self, batch_size=100, flush_interval=2.0, max_queued=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = threading.Thread(target=self._run, name='hms-login-recorder', daemon=True)
+        self._thread.start()
+
+    def record(self, activity):
+        """Queue an unsaved LoginActivity; never blocks the request"""
+        try:
+            self._queue.put_nowait(activity)
+        except queue.Full:
+            self.dropped += 1
+            logger.error(f"Login recorder queue full; dropped event ({self.dropped} so far)")
+
+    def _run(self):
+        batch = []
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is self._STOP:
+                stopping = True
+            elif item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if batch and (stopping or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch, deadline = [], None
+        connection.close()  # this thread's connection
+
+    def _flush(self, batch):
+        from .models import LoginActivity
+
+        close_old_connections()
+        try:
+            LoginActivity.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} login events: {str(e)}")
+
+    def stop(self, timeout=10):
+        """Write everything queued so far and stop the thread"""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP, timeout=timeout)
+            self._thread.join(timeout)
+
+
+class DirectRecorder:
+    """Writes each event as it happens; used when LOGIN_ACTIVITY_BUFFERED is off"""
+
+    def record(self, activity):
+        try:
+            activity.save()
+        except Exception as e:
+            logger.error(f"Failed to write login event: {str(e)}")
+
+    def stop(self, timeout=None):
+        pass
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """Process-wide recorder, created on first use"""
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                if getattr(settings, 'LOGIN_ACTIVITY_BUFFERED', True):
+                    _recorder = LoginRecorder(
+                        batch_size=getattr(settings, 'LOGIN_ACTIVITY_BATCH_SIZE', 100),
+                        flush_interval=getattr(settings, 'LOGIN_ACTIVITY_FLUSH_SECONDS', 2.0),
+                    )
+                    atexit.register(_recorder.stop)
+                else:
+                    _recorder = DirectRecorder()
+    return _recorder
+
+
+def reset_recorder():
+    """Flush and drop the cached recorder, e.g. after changing its settings"""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is not None:
+            _recorder.stop()
+        _recorder = None
+
+
+def record_login(request, user=None, username='', status=None):
+    """Record a login attempt made by request without touching the database
+
+    Args:
+        status: LoginActivity.SUCCESS (the default) or LoginActivity.FAILED
+    """
+    from .models import LoginActivity
+
+    get_recorder().record(LoginActivity(
+        user=user,
+        username=(username or getattr(user, 'username', ''))[:150],
+        ip_address=client_ip(request) if request is not None else None,
+        user_agent=request.META.get('HTTP_USER_AGENT', '') if request is not None else '',
+        timestamp=timezone.now(),
+        status=status or LoginActivity.SUCCESS,
+    ))
+
+
+# ==================== SUMMARIES ====================
+
+def login_summary(minutes=15, top=5):
+    """Logins in the last `minutes` minutes, from the LoginActivity rows
+
+    Rows still queued in a worker's recorder (at most the flush interval's
+    worth) are not counted yet.
+
+    Returns:
+        dict: success/failed totals, per-minute rates, the busiest
+        countries and the addresses with the most failures
+    """
+    from .models import LoginActivity
+
+    recent = LoginActivity.objects.filter(timestamp__gte=timezone.now() - datetime.timedelta(minutes=minutes)).order_by()
+    totals = recent.aggregate(
+        success=Count('pk', filter=Q(status=LoginActivity.SUCCESS)),
+        failed=Count('pk', filter=Q(status=LoginActivity.FAILED)),
+    )
+    # Matches the partial hms_login_failed_ip_idx index
+    top_failed_ips = recent.filter(status=LoginActivity.FAILED, ip_address__isnull=False).values_list(
+        'ip_address'
+    ).annotate(failures=Count('pk')).order_by('-failures', 'ip_address')[:top]
+
+    countries = Counter()
+    if _geoip() is not None:
+        for ip, logins in recent.exclude(ip_address=None).values_list('ip_address').annotate(logins=Count('pk')):
+            country = country_code(ip)
+            if country:
+                countries[country] += logins
+
+    return {
+        'minutes': minutes,
+        'success': totals['success'],
+        'failed': totals['failed'],
+        'success_per_minute': round(totals['success'] / minutes, 2),
+        'failed_per_minute': round(totals['failed'] / minutes, 2),
+        'countries': countries.most_common(top),
+        'top_failed_ips': list(top_failed_ips),
+    }
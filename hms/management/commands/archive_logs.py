@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from hms import partitions
+import datetime
+
+class Command(BaseCommand):
+    help = ('Move months of AuditLog and LoginActivity older than the retention period to '
+            'compressed JSONL files, and prepare the partitions for the coming months')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-months', type=int, default=settings.LOG_ARCHIVE_KEEP_MONTHS,
+                            help='Whole months kept in the database besides the current one')
+        parser.add_argument('--output-dir', default=str(settings.LOG_ARCHIVE_DIR),
+                            help='Directory the <table>_pYYYY_MM.jsonl.gz files are written to')
+        parser.add_argument('--months-ahead', type=int, default=2,
+                            help='Future months to create partitions for (PostgreSQL only)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='List the months that would be archived without moving them')
+        parser.add_argument('--partitions-only', action='store_true',
+                            help='Only create the coming months\' partitions; archive nothing')
+
+    def handle(self, *args, **options):
+        if options['keep_months'] < 0:
+            raise CommandError('--keep-months must not be negative')
+
+        if options['partitions_only']:
+            created = partitions.ensure_partitions(months_ahead=options['months_ahead'])
+            self.stdout.write(self.style.SUCCESS(f'Created {len(created)} new partitions.'))
+            return
+
+        this_month = partitions.month_start(timezone.now().astimezone(datetime.timezone.utc).date())
+        cutoff = partitions.add_months(this_month, -options['keep_months'])
+
+        for model in partitions.partitioned_models():
+            label = model._meta.verbose_name_plural
+            months = partitions.expired_months(model, cutoff)
+            if options['dry_run']:
+                names = ', '.join(month.strftime('%Y-%m') for month in months) or 'none'
+                self.stdout.write(f'{label}: would archive {names}')
+                continue
+
+            for month in months:
+                partitions.detach_month(model, month)
+            for table, rows, path in partitions.archive_month_tables(model, options['output_dir']):
+                self.stdout.write(f'{label}: archived {rows} rows from {table} to {path}')
+
+        if options['dry_run']:
+            return
+        created = partitions.ensure_partitions(months_ahead=options['months_ahead'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived log months before {cutoff:%Y-%m}; created {len(created)} new partitions.'
+        ))
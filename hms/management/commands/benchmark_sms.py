@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from hms.sms import FakeGateway, SMSDispatcher
+import time
+
+class Command(BaseCommand):
+    help = 'Measure SMS fan-out throughput against the local fake gateway'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=500)
+        parser.add_argument('--latency', type=float, default=0.01,
+                            help='Simulated provider round trip in seconds')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Recipients per provider request')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--rate', type=float, default=0,
+                            help='Provider requests per second (0 for no limit)')
+        parser.add_argument('--skip-baseline', action='store_true',
+                            help='Do not time the one-request-per-recipient baseline')
+
+    def handle(self, *args, **options):
+        phones = [f'+2547{i:08d}' for i in range(options['recipients'])]
+        message = 'HMS (Urgent): benchmark'
+
+        if not options['skip_baseline']:
+            gateway = FakeGateway(max_recipients=1, latency=options['latency'])
+            started = time.perf_counter()
+            for phone in phones:
+                gateway.send(message, [phone])
+            self._report('Sequential, one per request', len(phones), len(gateway.requests), time.perf_counter() - started)
+
+        gateway = FakeGateway(max_recipients=options['batch_size'], latency=options['latency'])
+        dispatcher = SMSDispatcher(gateway, max_workers=options['workers'], rate=options['rate'])
+        started = time.perf_counter()
+        dispatcher.send(message, phones)
+        elapsed = time.perf_counter() - started
+        dispatcher.shutdown()
+        self._report(f"Dispatcher, {options['workers']} workers", len(phones), len(gateway.requests), elapsed)
+
+    def _report(self, label, sent, requests, elapsed):
+        rate = sent / elapsed if elapsed else float('inf')
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}: {sent} SMS in {requests} request(s), {elapsed:.2f}s ({rate:.0f} SMS/s)'
+        ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from hms.middleware import audit_actor
+from hms.outbox import DEFAULT_BATCH_SIZE, process_outbox
+import time
+
+class Command(BaseCommand):
+    help = 'Deliver queued email and SMS notifications from the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Messages claimed per transaction')
+        parser.add_argument('--interval', type=float, default=10,
+                            help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue once and exit instead of polling')
+
+    def handle(self, *args, **options):
+        # Changes made by the worker are audited as the worker
+        with audit_actor('process_notifications'):
+            while True:
+                totals = process_outbox(batch_size=options['batch_size'])
+                if any(totals.values()) or options['once']:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"Sent {totals['sent']}, retrying {totals['retrying']}, failed {totals['failed']}."
+                    ))
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from hms import partitions
+from hms.audit import prune
+from hms.models import AuditLog
+import datetime
+
+class Command(BaseCommand):
+    help = ('Delete AuditLog entries older than the retention period. Where archive_logs is '
+            'scheduled, it retires old months itself; prune only with a retention longer than '
+            'the archive keeps, or entries are deleted before they are archived')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Keep this many days of history (default: AUDIT_LOG_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Entries deleted per query')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Count the expired entries without deleting them')
+
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else settings.AUDIT_LOG_RETENTION_DAYS
+        if days < 0:
+            raise CommandError('--days must not be negative')
+
+        cutoff = timezone.now() - datetime.timedelta(days=days)
+        # archive_logs keeps LOG_ARCHIVE_KEEP_MONTHS whole months besides the current one;
+        # entries pruned from within them are deleted without ever being archived
+        this_month = partitions.month_start(timezone.now().astimezone(datetime.timezone.utc).date())
+        archive_cutoff = partitions.add_months(this_month, -settings.LOG_ARCHIVE_KEEP_MONTHS)
+        if cutoff.date() > archive_cutoff:
+            self.stderr.write(self.style.WARNING(
+                f'Entries from {archive_cutoff} to {cutoff.date()} are not archived yet by archive_logs '
+                f'(LOG_ARCHIVE_KEEP_MONTHS={settings.LOG_ARCHIVE_KEEP_MONTHS}); pruning deletes them for good.'
+            ))
+
+        if options['dry_run']:
+            count = AuditLog.objects.between(end=cutoff).count()
+            self.stdout.write(self.style.SUCCESS(f'{count} audit log entries older than {days} days would be deleted.'))
+            return
+
+        count = prune(cutoff, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} audit log entries older than {days} days.'))
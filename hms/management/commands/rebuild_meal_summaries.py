@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from hms.meal_stats import rebuild_daily_summaries
+from hms.middleware import audit_actor
+import datetime
+
+class Command(BaseCommand):
+    help = 'Rebuild the DailyMealSummary rollup from raw meal records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First date to rebuild (YYYY-MM-DD). Defaults to all history.')
+        parser.add_argument('--end', help='Last date to rebuild (YYYY-MM-DD). Defaults to all history.')
+
+    def handle(self, *args, **options):
+        try:
+            start = datetime.date.fromisoformat(options['start']) if options['start'] else None
+            end = datetime.date.fromisoformat(options['end']) if options['end'] else None
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        with audit_actor('rebuild_meal_summaries'):
+            count = rebuild_daily_summaries(start, end)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} daily meal summaries.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from hms.unread import reconcile
+
+class Command(BaseCommand):
+    help = 'Recount unread messages and notifications and repair drifted UnreadCounter rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Counter rows written per query')
+
+    def handle(self, *args, **options):
+        fixed = reconcile(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Repaired unread counters for {fixed} users.'))
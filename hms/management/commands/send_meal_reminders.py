@@ -1,46 +1,110 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
 from django.contrib.auth.models import User
-from hms.models import Notification
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from hms.models import Notification, Student
+from hms.realtime import publish_bulk_notifications
+from hms.unread import adjust_many
 import datetime
+import time
+
+MEAL_SLOTS = ('Breakfast', 'Lunch', 'Dinner')
+
+
+def meal_slot(current_time):
+    """Meal being served at the given time, or None"""
+    # Define ranges (adjust as per hostel rules)
+    # Breakfast: 6:00 AM - 9:00 AM
+    if datetime.time(6, 0) <= current_time <= datetime.time(9, 0):
+        return 'Breakfast'
+    # Lunch: 11:00 AM - 2:00 PM
+    if datetime.time(11, 0) <= current_time <= datetime.time(14, 0):
+        return 'Lunch'
+    # Dinner: 5:00 PM - 8:00 PM
+    if datetime.time(17, 0) <= current_time <= datetime.time(20, 0):
+        return 'Dinner'
+    return None
+
 
 class Command(BaseCommand):
-    help = 'Send meal reminders to students based on current time'
+    help = 'Send meal reminders to students based on current time (safe to run from cron repeatedly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Notifications inserted per query')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be sent without writing anything')
+        parser.add_argument('--meal', choices=MEAL_SLOTS,
+                            help='Send for this meal instead of the one being served now')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
 
-    def handle(self, *args, **kwargs):
         now = timezone.localtime(timezone.now())
-        current_time = now.time()
-        
-        meal_type = None
-        
-        # Define ranges (adjust as per hostel rules)
-        # Breakfast: 6:00 AM - 9:00 AM
-        if datetime.time(6, 0) <= current_time <= datetime.time(9, 0):
-            meal_type = 'Breakfast'
-        # Lunch: 11:00 AM - 2:00 PM
-        elif datetime.time(11, 0) <= current_time <= datetime.time(14, 0):
-            meal_type = 'Lunch'
-        # Dinner: 5:00 PM - 8:00 PM
-        elif datetime.time(17, 0) <= current_time <= datetime.time(20, 0):
-            meal_type = 'Dinner'
-            
+        meal_type = options['meal'] or meal_slot(now.time())
+
         if not meal_type:
-            self.stdout.write(self.style.WARNING(f'No active meal time found at {current_time}.'))
+            self.stdout.write(self.style.WARNING(f'No active meal time found at {now.time()}.'))
             return
 
-        # Get all students
-        users = User.objects.filter(student_profile__isnull=False)
-        count = 0
-        
-        for user in users:
-            # Prevent duplicate notifications for same meal on same day could be added here
-            # For now, we assume this command runs once per meal slot
-            Notification.objects.create(
-                user=user,
-                title=f"🍽️ {meal_type} is Ready!",
-                message=f"Don't forget to have your {meal_type}. The mess hall is open.",
-                link="/student/dashboard/"
-            )
-            count += 1
-            
-        self.stdout.write(self.style.SUCCESS(f'Successfully sent {count} {meal_type} reminders.'))
+        # Students away or on approved leave today are skipped
+        user_ids = Student.objects.present_on(now.date()).order_by('pk').values_list('user_id', flat=True)
+
+        created = already_sent = 0
+        batch = []
+        for user_id in user_ids.iterator(chunk_size=batch_size):
+            batch.append(user_id)
+            if len(batch) == batch_size:
+                new, existing = self.dispatch(batch, meal_type, now.date(), options['dry_run'])
+                created, already_sent = created + new, already_sent + existing
+                batch = []
+        if batch:
+            new, existing = self.dispatch(batch, meal_type, now.date(), options['dry_run'])
+            created, already_sent = created + new, already_sent + existing
+
+        elapsed = time.perf_counter() - started
+        verb = 'Would send' if options['dry_run'] else 'Successfully sent'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {created} {meal_type} reminders '
+            f'({already_sent} already sent) in {elapsed:.2f}s.'
+        ))
+
+    def dispatch(self, user_ids, meal_type, day, dry_run):
+        """Insert one batch of reminders, skipping users already reminded for this slot
+
+        Returns:
+            tuple: (new reminders, reminders that already existed)
+        """
+        keys = {user_id: f'meal-reminder:{day}:{meal_type.lower()}:{user_id}' for user_id in user_ids}
+        if dry_run:
+            existing = set(Notification.objects.filter(dedupe_key__in=keys.values()).values_list('dedupe_key', flat=True))
+            return len(keys) - len(existing), len(existing)
+
+        title = f"🍽️ {meal_type} is Ready!"
+        message = f"Don't forget to have your {meal_type}. The mess hall is open."
+        with transaction.atomic(savepoint=False):
+            # A concurrent run holding these users waits here until it commits, so the
+            # keys found next include all of its reminders and the insert skips none
+            list(User.objects.select_for_update().filter(pk__in=user_ids).order_by('pk').values_list('pk', flat=True))
+            existing = set(Notification.objects.filter(dedupe_key__in=keys.values()).values_list('dedupe_key', flat=True))
+            inserted = [user_id for user_id, key in keys.items() if key not in existing]
+            if inserted:
+                Notification.objects.bulk_create([
+                    Notification(
+                        user_id=user_id,
+                        title=title,
+                        message=message,
+                        link="/student/dashboard/",
+                        dedupe_key=keys[user_id]
+                    )
+                    for user_id in inserted
+                ])
+                adjust_many(dict.fromkeys(inserted, 1), notifications=1)
+        if inserted:
+            # bulk_create skips post_save, so push to open streams here
+            publish_bulk_notifications(inserted, title, message, "/student/dashboard/")
+
+        return len(inserted), len(existing)
@@ -0,0 +1,193 @@
+"""
+Meal Statistics for HMS
+Per-day meal counters for the kitchen and analytics dashboards
+
+Counters are read from the DailyMealSummary rollup, which is kept in step
+with Meal changes by delta updates (see signals.update_daily_meal_summary)
+and can be rebuilt from raw Meal rows at any time.
+"""
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+MEAL_COUNTERS = ('breakfast', 'early', 'supper', 'away')
+SUMMARY_COUNTERS = MEAL_COUNTERS + ('confirmed',)
+
+
+def date_range(start_date, end_date):
+    """Yield every date from start_date to end_date (inclusive)"""
+    current = start_date
+    while current <= end_date:
+        yield current
+        current += timedelta(days=1)
+
+
+def empty_day_stats():
+    """Zeroed counters for a day without any meal records"""
+    return {counter: 0 for counter in SUMMARY_COUNTERS}
+
+
+def daily_meal_stats(start_date, end_date):
+    """Compute meal counters for every day in a date range
+
+    Reads the DailyMealSummary rollup with a single query, so the cost is
+    proportional to the number of days rather than the number of meals.
+    Days without any meal records are zero-filled.
+
+    Args:
+        start_date: First day of the range
+        end_date: Last day of the range (inclusive)
+
+    Returns:
+        dict: date -> {'breakfast', 'early', 'supper', 'away', 'confirmed'}
+    """
+    from .models import DailyMealSummary
+
+    stats = {day: empty_day_stats() for day in date_range(start_date, end_date)}
+
+    rows = DailyMealSummary.objects.filter(
+        date__range=(start_date, end_date)
+    ).values('date', *SUMMARY_COUNTERS)
+
+    for row in rows:
+        stats[row.pop('date')].update(row)
+
+    return stats
+
+
+def aggregate_meals(meals):
+    """Group a Meal queryset by date and count every summary counter
+
+    Returns:
+        dict: date -> counters, only for dates that have meal records
+    """
+    rows = meals.order_by().values('date').annotate(
+        confirmed=Count('id'),
+        **{counter: Count('id', filter=Q(**{counter: True})) for counter in MEAL_COUNTERS}
+    )
+    return {row.pop('date'): row for row in rows}
+
+
+def unconfirmed_count(meal_date):
+    """Number of students who still need to confirm meals for the given date
+
+    See Student.objects.unconfirmed_for for the cohort definition.
+    """
+    from .models import Student
+
+    return Student.objects.unconfirmed_for(meal_date).count()
+
+
+# ==================== ROLLUP MAINTENANCE ====================
+
+def apply_summary_delta(day, delta):
+    """Add counter deltas to one day's summary row
+
+    Uses F() expressions so concurrent requests never lose updates.
+
+    Args:
+        day: Date of the summary row
+        delta: dict of counter -> signed change; zero entries are ignored
+    """
+    from .models import DailyMealSummary
+
+    changes = {counter: F(counter) + value for counter, value in delta.items() if value}
+    if not changes:
+        return
+
+    DailyMealSummary.objects.bulk_create([DailyMealSummary(date=day)], ignore_conflicts=True)
+    DailyMealSummary.objects.filter(date=day).update(**changes)
+
+
+def refresh_daily_summaries(dates):
+    """Recompute the summary rows for the given dates from raw Meal rows
+
+    One grouped query plus one upsert, whatever the number of dates.
+    """
+    from .models import Meal, DailyMealSummary
+
+    dates = set(dates)
+    if not dates:
+        return
+
+    counted = aggregate_meals(Meal.objects.filter(date__in=dates))
+    summaries = [
+        DailyMealSummary(date=day, **counted.get(day, empty_day_stats()))
+        for day in dates
+    ]
+    DailyMealSummary.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=['date'],
+        update_fields=list(SUMMARY_COUNTERS) + ['updated_at'],
+    )
+
+
+def rebuild_daily_summaries(start_date=None, end_date=None, batch_size=500):
+    """Rebuild the rollup from scratch, optionally limited to a date range
+
+    Returns:
+        int: Number of summary rows written
+    """
+    from .models import Meal, DailyMealSummary
+
+    meals = Meal.objects.all()
+    summaries = DailyMealSummary.objects.all()
+    if start_date:
+        meals = meals.filter(date__gte=start_date)
+        summaries = summaries.filter(date__gte=start_date)
+    if end_date:
+        meals = meals.filter(date__lte=end_date)
+        summaries = summaries.filter(date__lte=end_date)
+
+    with transaction.atomic():
+        counted = aggregate_meals(meals)
+        summaries.delete()
+        DailyMealSummary.objects.bulk_create(
+            [DailyMealSummary(date=day, **counters) for day, counters in counted.items()],
+            batch_size=batch_size,
+        )
+    return len(counted)
+
+
+def _meal_counts(state):
+    """0/1 counter values for a Meal state dict"""
+    return {counter: int(bool(state[counter])) for counter in MEAL_COUNTERS}
+
+
+def record_meal_saved(meal, created):
+    """Apply a single Meal save to the rollup
+
+    Uses the state snapshot taken when the meal was loaded to compute a
+    delta; falls back to recounting the day when no snapshot exists.
+    """
+    from .models import SUMMARY_FIELDS
+
+    previous = getattr(meal, '_summary_state', {})
+    current = {name: getattr(meal, name) for name in SUMMARY_FIELDS}
+
+    if created:
+        apply_summary_delta(meal.date, dict(_meal_counts(current), confirmed=1))
+    elif all(name in previous for name in SUMMARY_FIELDS):
+        old, new = _meal_counts(previous), _meal_counts(current)
+        if previous['date'] == meal.date:
+            apply_summary_delta(meal.date, {counter: new[counter] - old[counter] for counter in MEAL_COUNTERS})
+        else:
+            apply_summary_delta(previous['date'], {counter: -value for counter, value in dict(old, confirmed=1).items()})
+            apply_summary_delta(meal.date, dict(new, confirmed=1))
+    else:
+        refresh_daily_summaries([meal.date])
+
+    meal.remember_summary_state()
+
+
+def record_meal_deleted(meal):
+    """Remove a deleted Meal from the rollup"""
+    from .models import SUMMARY_FIELDS
+
+    state = getattr(meal, '_summary_state', {})
+    if not all(name in state for name in SUMMARY_FIELDS):
+        state = {name: getattr(meal, name) for name in SUMMARY_FIELDS}
+
+    counts = dict(_meal_counts(state), confirmed=1)
+    apply_summary_delta(state['date'], {counter: -value for counter, value in counts.items()})
@@ -0,0 +1,117 @@
+"""
+Meal Services for HMS
+Meal state resolution and shared write paths for meal records
+"""
+from datetime import timedelta
+from django.db import transaction
+
+from .meal_stats import date_range, refresh_daily_summaries
+
+AWAY_DEFAULTS = {'away': True, 'breakfast': False, 'early': False, 'supper': False}
+
+
+def mark_away(student, start_date, end_date, batch_size=500):
+    """Flag every meal in a date range as away
+
+    Upserts the whole range with a single INSERT ... ON CONFLICT on the
+    (student, date) unique key instead of one update_or_create per day,
+    then recounts the affected days in the meal summary rollup.
+
+    Returns:
+        int: Number of days marked away
+    """
+    from .models import Meal
+
+    days = list(date_range(start_date, end_date))
+    if not days:
+        return 0
+
+    with transaction.atomic():
+        Meal.objects.bulk_create(
+            [Meal(student=student, date=day, **AWAY_DEFAULTS) for day in days],
+            update_conflicts=True,
+            unique_fields=['student', 'date'],
+            update_fields=list(AWAY_DEFAULTS) + ['submitted_at'],
+            batch_size=batch_size,
+        )
+        # bulk_create bypasses post_save, so update the rollup explicitly
+        refresh_daily_summaries(days)
+
+    return len(days)
+
+
+def create_away_period(student, start_date, end_date):
+    """Record an away period and mark the covered meals as away
+
+    Used by both the student Away Mode form and leave approval. Periods that
+    overlap or touch the new one are merged into it, so a student never has
+    overlapping periods (enforced by an exclusion constraint on PostgreSQL).
+
+    Returns:
+        AwayPeriod: The saved (possibly merged) period
+    """
+    from .models import AwayPeriod
+
+    with transaction.atomic():
+        touching = list(
+            AwayPeriod.objects.select_for_update().filter(student=student).overlapping(
+                start_date - timedelta(days=1), end_date + timedelta(days=1)
+            ).order_by('start_date', 'pk')
+        )
+
+        if touching:
+            away_period = touching[0]
+            away_period.start_date = min([start_date] + [p.start_date for p in touching])
+            away_period.end_date = max([end_date] + [p.end_date for p in touching])
+            AwayPeriod.objects.filter(pk__in=[p.pk for p in touching[1:]]).delete()
+            away_period.save(update_fields=['start_date', 'end_date'])
+        else:
+            away_period = AwayPeriod.objects.create(
+                student=student,
+                start_date=start_date,
+                end_date=end_date
+            )
+
+        mark_away(student, start_date, end_date)
+
+    return away_period
+
+
+def resolve_meal_states(student, dates):
+    """Effective meal status for a student on each date, without writing
+
+    Merges the student's existing Meal rows with AwayPeriod coverage using
+    two indexed reads. Dates without a record get an unsaved Meal with the
+    default (unconfirmed) values; dates covered by an away period are shown
+    as away with every meal off.
+
+    Args:
+        student: Student whose meals to resolve
+        dates: Iterable of dates
+
+    Returns:
+        tuple: (meals, away_dates) where meals maps each date to a Meal and
+        away_dates is the set of dates covered by an away period
+    """
+    from .models import Meal, AwayPeriod
+
+    dates = sorted(set(dates))
+    if not dates:
+        return {}, set()
+
+    existing = {
+        meal.date: meal
+        for meal in Meal.objects.filter(student=student, date__in=dates)
+    }
+    away_dates = AwayPeriod.objects.filter(student=student).away_dates(dates).get(student.pk, set())
+
+    meals = {}
+    for day in dates:
+        meal = existing.get(day) or Meal(student=student, date=day)
+        if day in away_dates and not meal.away:
+            # Display-only correction; nothing is saved on read
+            for field, value in AWAY_DEFAULTS.items():
+                setattr(meal, field, value)
+        meals[day] = meal
+
+    return meals, away_dates
@@ -1,20 +1,106 @@
+"""
+Audit Context for HMS
+Who is making the current change, for signal handlers with no request
 
-import threading
+The actor lives in a ContextVar, so it follows a request through sync and
+async code (including sync_to_async threads), is reset when the request
+ends, and never leaks into the next request or into background threads.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from contextlib import contextmanager
+import contextvars
+
+from . import audit
+
+_current_actor = contextvars.ContextVar('hms_audit_actor', default=None)
+
+
+class SystemActor:
+    """A non-user actor such as a management command or background worker"""
+    is_authenticated = False
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return f'<SystemActor: {self.name}>'
+
+
+class _RequestActor:
+    """Defers to request.user, so the lazy user is not loaded (or compared,
+    as asgiref does when restoring context) until an actor is needed"""
+    __slots__ = ('request',)
+
+    def __init__(self, request):
+        self.request = request
+
+
+def get_current_actor():
+    """The user or SystemActor responsible for the current change, or None"""
+    actor = _current_actor.get()
+    if isinstance(actor, _RequestActor):
+        return actor.request.user
+    return actor
 
-_thread_locals = threading.local()
 
 def get_current_user():
-    return getattr(_thread_locals, 'user', None)
+    """The signed-in user responsible for the current change, or None"""
+    actor = get_current_actor()
+    if actor is None or not actor.is_authenticated:
+        return None
+    return actor
+
+
+@contextmanager
+def audit_actor(actor):
+    """Attribute changes made inside the block to actor
+
+    Args:
+        actor: A User, or a name (e.g. 'process_notifications') for a system actor
+    """
+    if isinstance(actor, str):
+        actor = SystemActor(actor)
+    token = _current_actor.set(actor)
+    try:
+        yield actor
+    finally:
+        _current_actor.reset(token)
+
 
 class AuditMiddleware:
     """
-    Middleware to store the current user in thread-local storage
-    for access in signals/models where request is not available.
+    Middleware to make the current user available to signals/models where
+    the request is not, and to write the request's audit entries in one
+    batch. Runs natively in both sync and async stacks.
     """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        _thread_locals.user = request.user
-        response = self.get_response(request)
-        return response
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _current_actor.set(_RequestActor(request))
+        try:
+            with audit.audit_buffer():
+                return self.get_response(request)
+        finally:
+            _current_actor.reset(token)
+
+    async def __acall__(self, request):
+        token = _current_actor.set(_RequestActor(request))
+        pending, buffer_token = audit.open_buffer()
+        try:
+            return await self.get_response(request)
+        finally:
+            audit.close_buffer(buffer_token)
+            _current_actor.reset(token)
+            if buffer_token is not None and pending:
+                await sync_to_async(audit.write)(pending)
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:16
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_daily_summaries(apps, schema_editor):
+    """Build the rollup from the meals recorded so far"""
+    Meal = apps.get_model('hms', 'Meal')
+    DailyMealSummary = apps.get_model('hms', 'DailyMealSummary')
+
+    counters = ('breakfast', 'early', 'supper', 'away')
+    rows = Meal.objects.order_by().values('date').annotate(
+        confirmed=Count('id'),
+        **{counter: Count('id', filter=Q(**{counter: True})) for counter in counters}
+    )
+    DailyMealSummary.objects.bulk_create(
+        [DailyMealSummary(**row) for row in rows],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hms', '0013_payment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyMealSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('breakfast', models.IntegerField(default=0)),
+                ('early', models.IntegerField(default=0)),
+                ('supper', models.IntegerField(default=0)),
+                ('away', models.IntegerField(default=0)),
+                ('confirmed', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily Meal Summaries',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.RunPython(backfill_daily_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:19
+
+import datetime
+
+from django.db import migrations, models
+
+
+def merge_overlapping_periods(apps, schema_editor):
+    """Collapse overlapping or adjacent away periods per student"""
+    AwayPeriod = apps.get_model('hms', 'AwayPeriod')
+
+    current = None
+    for period in AwayPeriod.objects.order_by('student_id', 'start_date', 'end_date', 'pk'):
+        if (current and current.student_id == period.student_id
+                and period.start_date <= current.end_date + datetime.timedelta(days=1)):
+            if period.end_date > current.end_date:
+                current.end_date = period.end_date
+                current.save(update_fields=['end_date'])
+            period.delete()
+        else:
+            current = period
+
+
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+    "ALTER TABLE hms_awayperiod ADD COLUMN period daterange "
+    "GENERATED ALWAYS AS (daterange(start_date, end_date, '[]')) STORED",
+    "ALTER TABLE hms_awayperiod ADD CONSTRAINT hms_away_no_overlap "
+    "EXCLUDE USING gist (student_id WITH =, period WITH &&)",
+]
+
+POSTGRES_BACKWARD = [
+    "ALTER TABLE hms_awayperiod DROP CONSTRAINT IF EXISTS hms_away_no_overlap",
+    "ALTER TABLE hms_awayperiod DROP COLUMN IF EXISTS period",
+]
+
+
+def add_postgres_range_index(apps, schema_editor):
+    """daterange column with a GiST-backed no-overlap exclusion constraint (PostgreSQL only)"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for statement in POSTGRES_FORWARD:
+        schema_editor.execute(statement)
+
+
+def remove_postgres_range_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for statement in POSTGRES_BACKWARD:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hms', '0014_dailymealsummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='awayperiod',
+            index=models.Index(fields=['student', 'start_date', 'end_date'], name='hms_away_student_range_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='awayperiod',
+            index=models.Index(fields=['end_date', 'start_date'], name='hms_away_end_start_idx'),
+        ),
+        migrations.RunPython(merge_overlapping_periods, migrations.RunPython.noop),
+        migrations.RunPython(add_postgres_range_index, remove_postgres_range_index),
+    ]
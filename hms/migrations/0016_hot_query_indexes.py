@@ -0,0 +1,59 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hms', '0015_awayperiod_coverage_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leaverequest',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['-created_at'], name='hms_leave_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaverequest',
+            index=models.Index(condition=models.Q(('status', 'approved')), fields=['end_date', 'start_date'], name='hms_leave_approved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='maintenancerequest',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['-created_at'], name='hms_maint_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='meal',
+            index=models.Index(fields=['date', 'away'], name='hms_meal_date_away_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['recipient', 'sender'], name='hms_msg_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'recipient', 'timestamp'], name='hms_msg_thread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-created_at'], name='hms_notif_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user', '-created_at'], name='hms_notif_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['checkout_request_id'], name='hms_payment_checkout_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visitor',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-check_in_time'], name='hms_visitor_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visitor',
+            index=models.Index(condition=models.Q(('is_active', False)), fields=['-check_out_time'], name='hms_visitor_history_idx'),
+        ),
+    ]
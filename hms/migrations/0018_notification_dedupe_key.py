@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hms', '0017_outboundnotification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='dedupe_key',
+            field=models.CharField(blank=True, help_text='Set by bulk senders so a re-run never notifies twice', max_length=100, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_unread_counters(apps, schema_editor):
+    """Count the currently unread messages and notifications per user"""
+    Message = apps.get_model('hms', 'Message')
+    Notification = apps.get_model('hms', 'Notification')
+    UnreadCounter = apps.get_model('hms', 'UnreadCounter')
+
+    counts = {}
+    for row in Message.objects.filter(is_read=False).order_by().values('recipient_id').annotate(total=Count('id')):
+        counts.setdefault(row['recipient_id'], {})['messages'] = row['total']
+    for row in Notification.objects.filter(is_read=False).order_by().values('user_id').annotate(total=Count('id')):
+        counts.setdefault(row['user_id'], {})['notifications'] = row['total']
+
+    UnreadCounter.objects.bulk_create(
+        [UnreadCounter(user_id=user_id, **values) for user_id, values in counts.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('hms', '0018_notification_dedupe_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='unread_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('messages', models.IntegerField(default=0)),
+                ('notifications', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_unread_counters, migrations.RunPython.noop),
+    ]
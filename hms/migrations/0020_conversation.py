@@ -0,0 +1,104 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Left
+
+
+def backfill_conversations(apps, schema_editor):
+    """Group existing messages into one conversation per student
+
+    The student is the non-staff participant (the recipient when both are
+    staff). Read cursors start just before each side's oldest unread
+    message, and the message badges are recounted from the conversations.
+    """
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Conversation = apps.get_model('hms', 'Conversation')
+    Message = apps.get_model('hms', 'Message')
+    UnreadCounter = apps.get_model('hms', 'UnreadCounter')
+
+    student_ids = set(Message.objects.filter(sender__is_staff=False).values_list('sender_id', flat=True).distinct())
+    student_ids |= set(Message.objects.filter(sender__is_staff=True).values_list('recipient_id', flat=True).distinct())
+    Conversation.objects.bulk_create([Conversation(student_id=pk) for pk in student_ids], batch_size=500)
+
+    for student_field, staff_sent in (('sender', False), ('recipient', True)):
+        Message.objects.filter(sender__is_staff=staff_sent).update(conversation=Subquery(
+            Conversation.objects.filter(student=OuterRef(student_field)).values('pk')[:1]
+        ))
+
+    in_conversation = Message.objects.filter(conversation=OuterRef('pk')).order_by()
+    from_student = in_conversation.filter(sender=OuterRef('student'))
+    from_staff = in_conversation.exclude(sender=OuterRef('student'))
+
+    def first_unread(messages):
+        return Subquery(messages.filter(is_read=False).values('conversation').annotate(first=Min('id')).values('first'))
+
+    def unread_after(messages, cursor):
+        return Coalesce(Subquery(
+            messages.filter(id__gt=OuterRef(cursor)).values('conversation').annotate(total=Count('id')).values('total')
+        ), 0)
+
+    newest_id = Subquery(in_conversation.values('conversation').annotate(newest=Max('id')).values('newest'))
+    latest = in_conversation.order_by('-id')
+    Conversation.objects.update(
+        last_message_at=Subquery(latest.values('timestamp')[:1]),
+        last_message_preview=Coalesce(Subquery(latest.annotate(preview=Left('content', 80)).values('preview')[:1]), models.Value('')),
+        staff_read_id=Coalesce(first_unread(from_student) - 1, newest_id, 0),
+        student_read_id=Coalesce(first_unread(from_staff) - 1, newest_id, 0),
+    )
+    Conversation.objects.update(
+        staff_unread=unread_after(from_student, 'staff_read_id'),
+        student_unread=unread_after(from_staff, 'student_read_id'),
+    )
+
+    counts = dict(Conversation.objects.filter(student_unread__gt=0).values_list('student_id', 'student_unread'))
+    inbox_total = Conversation.objects.aggregate(total=Sum('staff_unread'))['total'] or 0
+    if inbox_total:
+        for staff_id in User.objects.filter(is_staff=True).values_list('pk', flat=True):
+            counts[staff_id] = counts.get(staff_id, 0) + inbox_total
+    UnreadCounter.objects.update(messages=0)
+    UnreadCounter.objects.bulk_create(
+        [UnreadCounter(user_id=user_id, messages=total) for user_id, total in counts.items()],
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['messages'],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hms', '0019_unreadcounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('last_message_preview', models.CharField(blank=True, max_length=80)),
+                ('student_read_id', models.BigIntegerField(default=0)),
+                ('staff_read_id', models.BigIntegerField(default=0)),
+                ('student_unread', models.IntegerField(default=0)),
+                ('staff_unread', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='conversation', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='recipient',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='received_messages', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='conversation',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='hms.conversation'),
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
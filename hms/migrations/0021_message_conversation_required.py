@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hms', '0020_conversation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='conversation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='hms.conversation'),
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='hms_msg_unread_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='hms_msg_thread_idx',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'id'], name='hms_msg_conv_idx'),
+        ),
+    ]
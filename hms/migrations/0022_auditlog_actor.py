@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hms', '0021_message_conversation_required'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='auditlog',
+            name='actor',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
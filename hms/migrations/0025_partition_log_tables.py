@@ -0,0 +1,94 @@
+import datetime
+
+from django.db import migrations
+
+PARTITIONED_TABLES = ('hms_auditlog', 'hms_loginactivity')
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_by_month(apps, schema_editor):
+    """Rebuild the log tables as monthly range partitions on PostgreSQL
+
+    Each table is renamed aside, recreated with PARTITION BY RANGE
+    (timestamp), given one partition per month of existing data (plus the
+    next two months and a DEFAULT partition), refilled and dropped. The
+    primary key becomes (id, timestamp), as PostgreSQL requires the
+    partition key in it; ids still come from one sequence per table.
+    Indexes and foreign keys keep their names so later migrations can
+    alter them.
+    SQLite has no partitioning; hms.partitions moves expired months into
+    archive tables there instead.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    quote = schema_editor.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            old = f'{table}_unpartitioned'
+            cursor.execute(
+                "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s "
+                "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)",
+                [table, table],
+            )
+            indexes = cursor.fetchall()
+            cursor.execute(
+                "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                "WHERE conrelid = %s::regclass AND contype = 'f'",
+                [table],
+            )
+            foreign_keys = cursor.fetchall()
+
+            for name, _ in indexes:
+                cursor.execute(f'DROP INDEX {quote(name)}')
+            for name, _ in foreign_keys:
+                cursor.execute(f'ALTER TABLE {quote(table)} DROP CONSTRAINT {quote(name)}')
+            cursor.execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(old)}')
+            cursor.execute(f'ALTER TABLE {quote(old)} RENAME CONSTRAINT {quote(table + "_pkey")} TO {quote(old + "_pkey")}')
+
+            # A plain sequence rather than the old serial/identity one, which
+            # is dropped with the old table
+            sequence = f'{table}_partitioned_id_seq'
+            cursor.execute(f'CREATE TABLE {quote(table)} (LIKE {quote(old)}) PARTITION BY RANGE ("timestamp")')
+            cursor.execute(f'CREATE SEQUENCE {quote(sequence)} AS bigint OWNED BY {quote(table)}."id"')
+            cursor.execute(f'ALTER TABLE {quote(table)} ALTER COLUMN "id" SET DEFAULT nextval(%s::regclass)', [sequence])
+            cursor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(table + "_pkey")} PRIMARY KEY ("id", "timestamp")')
+
+            cursor.execute(
+                f"SELECT DISTINCT date_trunc('month', \"timestamp\" AT TIME ZONE 'UTC')::date FROM {quote(old)}"
+            )
+            months = {row[0] for row in cursor.fetchall()}
+            this_month = datetime.datetime.now(datetime.timezone.utc).date().replace(day=1)
+            months.update(_add_months(this_month, offset) for offset in range(3))
+            for month in sorted(months):
+                end = _add_months(month, 1)
+                cursor.execute(
+                    f'CREATE TABLE {quote(f"{table}_p{month.year:04d}_{month.month:02d}")} PARTITION OF {quote(table)} '
+                    f"FOR VALUES FROM (%s) TO (%s)",
+                    [f'{month.isoformat()} 00:00:00+00', f'{end.isoformat()} 00:00:00+00'],
+                )
+            cursor.execute(f'CREATE TABLE {quote(table + "_default")} PARTITION OF {quote(table)} DEFAULT')
+
+            cursor.execute(f'INSERT INTO {quote(table)} SELECT * FROM {quote(old)}')
+            cursor.execute(f'SELECT setval(%s::regclass, COALESCE(MAX("id"), 0) + 1, false) FROM {quote(table)}', [sequence])
+            cursor.execute(f'DROP TABLE {quote(old)}')
+
+            for _, definition in indexes:
+                cursor.execute(definition)
+            for name, definition in foreign_keys:
+                cursor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hms', '0024_auditlog_diff'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_by_month, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:09
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hms', '0025_partition_log_tables'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loginactivity',
+            name='username',
+            field=models.CharField(blank=True, max_length=150),
+        ),
+        migrations.AlterField(
+            model_name='loginactivity',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='loginactivity',
+            index=models.Index(fields=['user', '-timestamp'], name='hms_login_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loginactivity',
+            index=models.Index(condition=models.Q(('status', 'Failed')), fields=['ip_address', '-timestamp'], name='hms_login_failed_ip_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hms', '0027_ratelimitcounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loginactivity',
+            index=models.Index(fields=['-timestamp', 'status'], name='hms_login_recent_idx'),
+        ),
+    ]
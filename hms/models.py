@@ -1,9 +1,67 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 import datetime
 
-class Student(models.Model):
+from .audit import ChangeTrackingMixin
+
+# Meal fields tracked by DailyMealSummary
+SUMMARY_FIELDS = ('date', 'breakfast', 'early', 'supper', 'away')
+
+class StudentQuerySet(models.QuerySet):
+    """Cohort lookups for reminders, notifications and the chat inbox"""
+
+    def present_on(self, day):
+        """Students who are neither covered by an AwayPeriod nor on approved leave on day"""
+        is_away = AwayPeriod.objects.covering(day).filter(student=models.OuterRef('pk'))
+        on_leave = LeaveRequest.objects.filter(
+            student=models.OuterRef('pk'),
+            status='approved',
+            start_date__lte=day,
+            end_date__gte=day
+        )
+        return self.filter(~models.Exists(is_away), ~models.Exists(on_leave))
+
+    def unconfirmed_for(self, meal_date):
+        """Students who still need to confirm meals for meal_date
+
+        A student is unconfirmed when they have no Meal record for the date
+        and are present (see present_on). All checks are NOT EXISTS
+        subqueries, so this is one query.
+        """
+        has_meal = Meal.objects.filter(student=models.OuterRef('pk'), date=meal_date)
+        return self.present_on(meal_date).filter(~models.Exists(has_meal))
+
+    def contacts(self):
+        """Only the columns needed for messaging, as named rows
+
+        Stream large cohorts with .iterator(chunk_size=...).
+
+        Returns:
+            QuerySet: Rows with first_name, last_name, university_id, email, phone
+        """
+        return self.order_by('pk').annotate(
+            first_name=models.F('user__first_name'),
+            last_name=models.F('user__last_name'),
+            email=models.F('user__email'),
+        ).values_list('first_name', 'last_name', 'university_id', 'email', 'phone', named=True)
+
+    def inbox(self):
+        """Students as the shared staff chat inbox, most recent conversation first
+
+        Rows carry unread_count (messages staff have not read),
+        last_message_at and last_message_preview, all read from the
+        student's Conversation, so any page of the inbox is one query.
+        """
+        return self.filter(user__is_staff=False).select_related('user').annotate(
+            unread_count=Coalesce('user__conversation__staff_unread', 0),
+            last_message_at=models.F('user__conversation__last_message_at'),
+            last_message_preview=models.F('user__conversation__last_message_preview'),
+        ).order_by(models.F('last_message_at').desc(nulls_last=True), 'user__first_name', 'pk')
+
+
+class Student(ChangeTrackingMixin, models.Model):
     """Extended profile for students"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='student_profile')
     university_id = models.CharField(max_length=20, unique=True, null=True, blank=True)
@@ -16,6 +74,8 @@ class Student(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = StudentQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.user.get_full_name()} ({self.university_id})"
 
@@ -32,17 +92,106 @@ class Meal(models.Model):
     class Meta:
         unique_together = ['student', 'date']
         ordering = ['-date']
+        indexes = [
+            # Kitchen pages filter by date plus the away flag
+            models.Index(fields=['date', 'away'], name='hms_meal_date_away_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student} - {self.date}"
 
-class AwayPeriod(models.Model):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded state so the daily summary can be updated by delta
+        instance.remember_summary_state()
+        return instance
+
+    def remember_summary_state(self):
+        """Snapshot the fields counted by DailyMealSummary"""
+        self._summary_state = {
+            name: getattr(self, name)
+            for name in SUMMARY_FIELDS
+            if name in self.__dict__
+        }
+
+class DailyMealSummary(models.Model):
+    """Per-day meal totals, kept in step with Meal changes"""
+    date = models.DateField(unique=True)
+    breakfast = models.IntegerField(default=0)
+    early = models.IntegerField(default=0)
+    supper = models.IntegerField(default=0)
+    away = models.IntegerField(default=0)
+    confirmed = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Daily Meal Summaries"
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"Meal summary for {self.date}"
+
+class AwayPeriodQuerySet(models.QuerySet):
+    """Coverage lookups for away periods"""
+
+    def covering(self, day):
+        """Periods that include the given day"""
+        return self.filter(start_date__lte=day, end_date__gte=day)
+
+    def overlapping(self, start_date, end_date):
+        """Periods that share at least one day with the given range"""
+        return self.filter(start_date__lte=end_date, end_date__gte=start_date)
+
+    def covering_any(self, dates):
+        """Periods that include at least one of the given dates (single query)"""
+        condition = models.Q(pk__in=[])
+        for day in set(dates):
+            condition |= models.Q(start_date__lte=day, end_date__gte=day)
+        return self.filter(condition)
+
+    def students_away_on(self, day):
+        """Students covered by an away period on the given day"""
+        covered = self.covering(day).filter(student=models.OuterRef('pk'))
+        return Student.objects.filter(models.Exists(covered))
+
+    def away_dates(self, dates):
+        """Map each student to the given dates they are away on
+
+        Fetches every overlapping period in one query, so a whole cohort can
+        be checked at once (filter the queryset by student first to narrow it).
+
+        Returns:
+            dict: student_id -> set of dates
+        """
+        dates = sorted(set(dates))
+        if not dates:
+            return {}
+
+        coverage = {}
+        rows = self.overlapping(dates[0], dates[-1]).values_list('student_id', 'start_date', 'end_date')
+        for student_id, start_date, end_date in rows:
+            covered = {day for day in dates if start_date <= day <= end_date}
+            if covered:
+                coverage.setdefault(student_id, set()).update(covered)
+        return coverage
+
+class AwayPeriod(ChangeTrackingMixin, models.Model):
     """Periods when a student is away"""
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='away_periods')
     start_date = models.DateField()
     end_date = models.DateField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = AwayPeriodQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['student', 'start_date', 'end_date'], name='hms_away_student_range_idx'),
+            # Leading on end_date keeps "who is away on D" selective as history grows
+            models.Index(fields=['end_date', 'start_date'], name='hms_away_end_start_idx'),
+        ]
+
     def clean(self):
         from django.core.exceptions import ValidationError
         if self.start_date > self.end_date:
@@ -51,7 +200,7 @@ class AwayPeriod(models.Model):
     def __str__(self):
         return f"{self.student} Away: {self.start_date} to {self.end_date}"
 
-class Activity(models.Model):
+class Activity(ChangeTrackingMixin, models.Model):
     """Weekly activities"""
     display_name = models.CharField(max_length=100)
     weekday = models.IntegerField(choices=[
@@ -69,7 +218,7 @@ class Activity(models.Model):
     def __str__(self):
         return f"{self.get_weekday_display()} - {self.display_name}"
 
-class Announcement(models.Model):
+class Announcement(ChangeTrackingMixin, models.Model):
     """System announcements"""
     title = models.CharField(max_length=200)
     content = models.TextField()
@@ -90,7 +239,7 @@ class Announcement(models.Model):
     def __str__(self):
         return self.title
 
-class Document(models.Model):
+class Document(ChangeTrackingMixin, models.Model):
     """Admin uploaded documents for students"""
     title = models.CharField(max_length=200)
     file = models.FileField(upload_to='documents/')
@@ -99,22 +248,54 @@ class Document(models.Model):
     def __str__(self):
         return self.title
 
-class Message(models.Model):
-    """Chat messages between student and admin"""
+class Conversation(models.Model):
+    """Chat thread between one student and the shared staff inbox
+
+    Each side has a read cursor (the id of the newest message it has read)
+    and a denormalized unread count, so marking a conversation read is a
+    single-row update and the inbox sorts on an indexed column.
+    """
+    PREVIEW_LENGTH = 80
+
+    student = models.OneToOneField(User, on_delete=models.CASCADE, related_name='conversation')
+    last_message_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True)
+    student_read_id = models.BigIntegerField(default=0)
+    staff_read_id = models.BigIntegerField(default=0)
+    student_unread = models.IntegerField(default=0)
+    staff_unread = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Conversation with {self.student}"
+
+
+class Message(ChangeTrackingMixin, models.Model):
+    """Chat message in a student's conversation with staff"""
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
-    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages')
+    # Null for messages from the student to the shared staff inbox
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='received_messages')
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['conversation', 'id'], name='hms_msg_conv_idx'),
+        ]
 
     def __str__(self):
-        return f"From {self.sender} to {self.recipient}"
+        return f"From {self.sender} to {self.recipient or 'staff'}"
 
+    def save(self, *args, **kwargs):
+        if self.conversation_id is None:
+            from .chat import conversation_for
+            self.conversation = conversation_for(self.sender if self.recipient is None or self.recipient.is_staff else self.recipient)
+        super().save(*args, **kwargs)
 
-class MaintenanceRequest(models.Model):
+
+class MaintenanceRequest(ChangeTrackingMixin, models.Model):
     """Maintenance tickets submitted by students"""
     PRIORITY_CHOICES = [
         ('low', 'Low'),
@@ -139,12 +320,15 @@ class MaintenanceRequest(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], condition=models.Q(status='pending'), name='hms_maint_pending_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.student} ({self.get_status_display()})"
 
 
-class Room(models.Model):
+class Room(ChangeTrackingMixin, models.Model):
     """Hostel room information"""
     ROOM_TYPES = [
         ('single', 'Single'),
@@ -181,7 +365,7 @@ class Room(models.Model):
         return self.capacity - self.current_occupancy
 
 
-class RoomAssignment(models.Model):
+class RoomAssignment(ChangeTrackingMixin, models.Model):
     """Track room assignments for students"""
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='room_assignments')
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='assignments')
@@ -201,7 +385,7 @@ class RoomAssignment(models.Model):
         return f"{self.student} - {self.room} (Bed {self.bed_number})"
 
 
-class RoomChangeRequest(models.Model):
+class RoomChangeRequest(ChangeTrackingMixin, models.Model):
     """Student requests for room changes"""
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -227,7 +411,7 @@ class RoomChangeRequest(models.Model):
         return f"{self.student} - Room Change Request ({self.get_status_display()})"
 
 
-class LeaveRequest(models.Model):
+class LeaveRequest(ChangeTrackingMixin, models.Model):
     """Leave applications from students"""
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -260,6 +444,10 @@ class LeaveRequest(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], condition=models.Q(status='pending'), name='hms_leave_pending_idx'),
+            models.Index(fields=['end_date', 'start_date'], condition=models.Q(status='approved'), name='hms_leave_approved_idx'),
+        ]
     
     def __str__(self):
         return f"{self.student} - Leave ({self.start_date} to {self.end_date})"
@@ -275,7 +463,7 @@ class LeaveRequest(models.Model):
         return (self.end_date - self.start_date).days + 1
 
 
-class Visitor(models.Model):
+class Visitor(ChangeTrackingMixin, models.Model):
     """Visitor logbook for hostel security"""
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='visitors')
     name = models.CharField(max_length=200)
@@ -291,6 +479,10 @@ class Visitor(models.Model):
     
     class Meta:
         ordering = ['-check_in_time']
+        indexes = [
+            models.Index(fields=['-check_in_time'], condition=models.Q(is_active=True), name='hms_visitor_active_idx'),
+            models.Index(fields=['-check_out_time'], condition=models.Q(is_active=False), name='hms_visitor_history_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} visiting {self.student}"
@@ -301,7 +493,7 @@ class Visitor(models.Model):
         self.save()
 
 
-class Event(models.Model):
+class Event(ChangeTrackingMixin, models.Model):
     """Hostel events and activities"""
     EVENT_CATEGORIES = [
         ('social', 'Social Event'),
@@ -365,7 +557,7 @@ class Event(models.Model):
         return None
 
 
-class EventRSVP(models.Model):
+class EventRSVP(ChangeTrackingMixin, models.Model):
     """Student RSVP for events"""
     RSVP_STATUS = [
         ('attending', 'Attending'),
@@ -389,19 +581,67 @@ class EventRSVP(models.Model):
     def __str__(self):
         return f"{self.student} - {self.event.title} ({self.get_status_display()})"
 
+# LoginActivity and AuditLog are append-only and stored by month
+# (partitioned on PostgreSQL); see hms.partitions and archive_logs
 class LoginActivity(models.Model):
+    SUCCESS = 'Success'
+    FAILED = 'Failed'
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='login_activities', null=True, blank=True)
+    # The username tried, kept for failed logins that match no user
+    username = models.CharField(max_length=150, blank=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
-    status = models.CharField(max_length=20, default='Success')
+    timestamp = models.DateTimeField(default=timezone.now)  # time of the login, not of the buffered write
+    status = models.CharField(max_length=20, default=SUCCESS)
 
     class Meta:
         verbose_name_plural = "Login Activities"
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['user', '-timestamp'], name='hms_login_user_idx'),
+            models.Index(fields=['ip_address', '-timestamp'], condition=models.Q(status='Failed'), name='hms_login_failed_ip_idx'),
+            models.Index(fields=['-timestamp', 'status'], name='hms_login_recent_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user} - {self.timestamp}"
+        return f"{self.user or self.username} - {self.timestamp}"
+
+class RateLimitCounter(models.Model):
+    """One window's hit count for a rate-limited key (see hms.ratelimit.DatabaseCounters)"""
+    key = models.CharField(max_length=100, unique=True)
+    count = models.PositiveIntegerField(default=0)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key}: {self.count}"
+
+class AuditLogQuerySet(models.QuerySet):
+    """Audit history lookups, each served by one of AuditLog's indexes"""
+
+    def for_model(self, model):
+        """Entries for a model class or model name (e.g. 'Room')"""
+        return self.filter(model_name=model if isinstance(model, str) else model.__name__)
+
+    def for_object(self, obj):
+        """Entries for one model instance, newest first"""
+        return self.filter(model_name=type(obj).__name__, object_id=str(obj.pk))
+
+    def by_actor(self, actor):
+        """Entries made by a User, or by a system actor name (e.g. 'process_notifications')"""
+        if isinstance(actor, str):
+            return self.filter(actor=actor)
+        return self.filter(user=actor)
+
+    def between(self, start=None, end=None):
+        """Entries with start <= timestamp < end; either bound may be omitted"""
+        queryset = self
+        if start is not None:
+            queryset = queryset.filter(timestamp__gte=start)
+        if end is not None:
+            queryset = queryset.filter(timestamp__lt=end)
+        return queryset
+
 
 class AuditLog(models.Model):
     ACTION_CHOICES = (
@@ -410,18 +650,30 @@ class AuditLog(models.Model):
         ('DELETE', 'Delete'),
     )
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # Set instead of user for changes made by a system actor (e.g. a management command)
+    actor = models.CharField(max_length=100, blank=True)
     model_name = models.CharField(max_length=50)
     object_id = models.CharField(max_length=50, null=True, blank=True)
     object_repr = models.CharField(max_length=200, null=True, blank=True)
     action = models.CharField(max_length=10, choices=ACTION_CHOICES)
     changes = models.TextField(null=True, blank=True) # JSON string or text summary
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # {field: [old, new]} for models using ChangeTrackingMixin
+    diff = models.JSONField(null=True, blank=True)
+    timestamp = models.DateTimeField(default=timezone.now)  # time of the change, not of the buffered write
+
+    objects = AuditLogQuerySet.as_manager()
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['model_name', 'object_id', '-timestamp'], name='hms_audit_object_idx'),
+            models.Index(fields=['user', '-timestamp'], name='hms_audit_user_idx'),
+            models.Index(fields=['actor', '-timestamp'], condition=~models.Q(actor=''), name='hms_audit_actor_idx'),
+            models.Index(fields=['-timestamp'], name='hms_audit_time_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.action} {self.model_name} by {self.user}"
+        return f"{self.action} {self.model_name} by {self.user or self.actor}"
 
 class Notification(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
@@ -430,14 +682,30 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     link = models.CharField(max_length=255, blank=True, null=True) # Optional link to action
+    dedupe_key = models.CharField(max_length=100, unique=True, null=True, blank=True,
+                                  help_text="Set by bulk senders so a re-run never notifies twice")
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='hms_notif_user_idx'),
+            models.Index(fields=['user', '-created_at'], condition=models.Q(is_read=False), name='hms_notif_unread_idx'),
+        ]
 
     def __str__(self):
         return f"Notification for {self.user}: {self.title}"
 
-class Payment(models.Model):
+class UnreadCounter(models.Model):
+    """Per-user unread message and notification counts, kept in step on send/read"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='unread_counter')
+    messages = models.IntegerField(default=0)
+    notifications = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Unread for {self.user}: {self.messages} messages, {self.notifications} notifications"
+
+class Payment(ChangeTrackingMixin, models.Model):
     PAYMENT_STATUS = (
         ('Pending', 'Pending'),
         ('Completed', 'Completed'),
@@ -456,6 +724,57 @@ class Payment(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Looked up on every M-Pesa callback
+            models.Index(fields=['checkout_request_id'], name='hms_payment_checkout_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student} - {self.amount} - {self.status}"
+
+
+class OutboundNotification(models.Model):
+    """Email/SMS waiting to be delivered by the notification worker
+
+    Request handlers only enqueue rows here; `manage.py process_notifications`
+    drains the queue with retries, backoff and per-channel rate limits.
+    """
+    CHANNEL_CHOICES = [
+        ('email', 'Email'),
+        ('sms', 'SMS'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    channel = models.CharField(max_length=10, choices=CHANNEL_CHOICES)
+    recipient = models.CharField(max_length=255, help_text="Email address or phone number")
+    subject = models.CharField(max_length=255, blank=True)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    source = models.CharField(max_length=100, blank=True, help_text="What triggered this message, e.g. announcement:12")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # The worker only ever scans rows that are still due
+            models.Index(
+                fields=['next_attempt_at'],
+                condition=models.Q(status__in=['pending', 'sending']),
+                name='hms_outbox_due_idx'
+            ),
+            models.Index(fields=['status', 'channel'], name='hms_outbox_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_channel_display()} to {self.recipient} ({self.status})"
@@ -2,12 +2,15 @@
 Notification Utilities for HMS
 Supports Email and SMS notifications
 """
-from django.core.mail import send_mail, EmailMultiAlternatives
+from django.core.mail import send_mail, get_connection, EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.conf import settings
 from django.utils import timezone
+from itertools import islice
 import logging
 
+from .outbox import enqueue_email, enqueue_sms
+
 logger = logging.getLogger(__name__)
 
 
@@ -56,14 +59,79 @@ class NotificationService:
             logger.error(f"Failed to send email to {to_email}: {str(e)}")
             return False
     
+    @staticmethod
+    def send_bulk_email(messages, batch_size=None, throttle=None):
+        """Send many emails over one SMTP connection per batch
+        
+        Each batch opens a single connection and sends its messages one by
+        one through send_messages, so a failure only affects its own
+        recipient. A dropped connection is reopened before the next message.
+        
+        Args:
+            messages: Iterable of (to_email, subject, message, html_message) tuples;
+                html_message may be None. Consumed one batch at a time, so a
+                generator keeps memory flat.
+            batch_size: Messages per connection (defaults to EMAIL_BATCH_SIZE)
+            throttle: Optional callable invoked before each message (rate limiting)
+        
+        Returns:
+            list: (to_email, sent) pairs in the order given
+        """
+        messages = iter(messages)
+        batch_size = batch_size or getattr(settings, 'EMAIL_BATCH_SIZE', 50)
+        outcomes = []
+        
+        while True:
+            batch = list(islice(messages, batch_size))
+            if not batch:
+                break
+            
+            connection = get_connection(fail_silently=False)
+            try:
+                connection.open()
+            except Exception as e:
+                logger.error(f"Could not open email connection: {str(e)}")
+                outcomes.extend((to_email, False) for to_email, *rest in batch)
+                continue
+            
+            try:
+                for to_email, subject, message, html_message in batch:
+                    if throttle:
+                        throttle()
+                    email = EmailMultiAlternatives(
+                        subject=subject,
+                        body=message,
+                        from_email=settings.DEFAULT_FROM_EMAIL,
+                        to=[to_email],
+                        connection=connection
+                    )
+                    if html_message:
+                        email.attach_alternative(html_message, "text/html")
+                    
+                    try:
+                        sent = connection.send_messages([email]) == 1
+                    except Exception as e:
+                        logger.error(f"Failed to send email to {to_email}: {str(e)}")
+                        sent = False
+                        connection.close()
+                        try:
+                            connection.open()
+                        except Exception:
+                            pass
+                    outcomes.append((to_email, sent))
+            finally:
+                connection.close()
+        
+        logger.info(f"Bulk email: {sum(sent for _, sent in outcomes)}/{len(outcomes)} sent")
+        return outcomes
+    
     @staticmethod
     def send_sms(phone_number, message):
         """Send SMS notification
         
-        This is a placeholder that can be integrated with:
-        - Twilio
-        - Africa's Talking
-        - Any other SMS gateway
+        Goes through the process-wide SMS dispatcher (see hms.sms), which
+        reuses one provider client: Twilio, Africa's Talking or the fake
+        gateway, chosen by SMS_PROVIDER or by whichever credentials are set.
         
         Args:
             phone_number: Recipient phone number
@@ -72,46 +140,42 @@ class NotificationService:
         Returns:
             bool: True if sent successfully, False otherwise
         """
+        outcomes = NotificationService.send_bulk_sms([(phone_number, message)])
+        return bool(outcomes) and outcomes[0][1]
+    
+    @staticmethod
+    def send_bulk_sms(messages):
+        """Send many SMS concurrently
+        
+        Recipients of the same text share multi-recipient provider requests,
+        which run on a bounded thread pool under the provider's rate limit.
+        
+        Args:
+            messages: Iterable of (phone_number, message) pairs
+        
+        Returns:
+            list: (phone_number, sent) pairs in the order given
+        """
+        from .sms import get_dispatcher
+        
+        messages = [(phone, message) for phone, message in messages if phone]
+        
+        # Check if SMS is configured
+        if not getattr(settings, 'SMS_ENABLED', False):
+            logger.warning("SMS is not enabled. Configure SMS_ENABLED in settings.")
+            return [(phone, False) for phone, message in messages]
+        
         try:
-            # Check if SMS is configured
-            if not getattr(settings, 'SMS_ENABLED', False):
-                logger.warning("SMS is not enabled. Configure SMS_ENABLED in settings.")
-                return False
-            
-            # Example: Twilio integration
-            if getattr(settings, 'TWILIO_ACCOUNT_SID', None):
-                from twilio.rest import Client
-                client = Client(
-                    settings.TWILIO_ACCOUNT_SID,
-                    settings.TWILIO_AUTH_TOKEN
-                )
-                client.messages.create(
-                    body=message,
-                    from_=settings.TWILIO_PHONE_NUMBER,
-                    to=phone_number
-                )
-                logger.info(f"SMS sent to {phone_number}")
-                return True
-            
-            # Example: Africa's Talking integration
-            elif getattr(settings, 'AFRICASTALKING_USERNAME', None):
-                import africastalking
-                africastalking.initialize(
-                    settings.AFRICASTALKING_USERNAME,
-                    settings.AFRICASTALKING_API_KEY
-                )
-                sms = africastalking.SMS
-                sms.send(message, [phone_number])
-                logger.info(f"SMS sent to {phone_number}")
-                return True
-            
-            else:
-                logger.warning("No SMS provider configured.")
-                return False
-                
+            dispatcher = get_dispatcher()
         except Exception as e:
-            logger.error(f"Failed to send SMS to {phone_number}: {str(e)}")
-            return False
+            logger.error(f"Failed to initialise SMS provider: {str(e)}")
+            dispatcher = None
+        
+        if dispatcher is None:
+            logger.warning("No SMS provider configured.")
+            return [(phone, False) for phone, message in messages]
+        
+        return dispatcher.send_many(messages)
 
 
 # ==================== NOTIFICATION TEMPLATES ====================
@@ -138,7 +202,7 @@ Reason: {leave_request.reason}
 Please review this request in the admin dashboard.
     """
     
-    return NotificationService.send_email(admin_email, subject, message)
+    return enqueue_email(admin_email, subject, message, source=f'leave:{leave_request.pk}') > 0
 
 
 def notify_leave_request_status(leave_request):
@@ -186,15 +250,12 @@ Hostel Management System
         """
         sms_message = f"HMS: Your leave request has been REJECTED. Check your email for details."
     
-    # Send email
-    email_sent = NotificationService.send_email(student_email, subject, message)
-    
-    # Send SMS if phone available
-    sms_sent = False
-    if student_phone:
-        sms_sent = NotificationService.send_sms(student_phone, sms_message)
+    # Queue email and SMS (if phone available) for the notification worker
+    source = f'leave:{leave_request.pk}'
+    email_queued = enqueue_email(student_email, subject, message, source=source)
+    sms_queued = enqueue_sms(student_phone, sms_message, source=source) if student_phone else 0
     
-    return email_sent or sms_sent
+    return bool(email_queued or sms_queued)
 
 
 def notify_maintenance_status_update(maintenance_request):
@@ -230,22 +291,25 @@ Hostel Management System
     
     sms_message = f"HMS: Your maintenance request '{maintenance_request.title}' is now {maintenance_request.get_status_display()}."
     
-    # Send email
-    email_sent = NotificationService.send_email(student_email, subject, message)
+    # Queue email and SMS (if phone available) for the notification worker
+    source = f'maintenance:{maintenance_request.pk}'
+    email_queued = enqueue_email(student_email, subject, message, source=source)
+    sms_queued = enqueue_sms(student_phone, sms_message, source=source) if student_phone else 0
     
-    # Send SMS if phone available
-    sms_sent = False
-    if student_phone:
-        sms_sent = NotificationService.send_sms(student_phone, sms_message)
-    
-    return email_sent or sms_sent
+    return bool(email_queued or sms_queued)
 
 
 def notify_new_announcement(announcement):
-    """Notify all students about a new announcement"""
+    """Queue announcement emails (and SMS for high/urgent) for every student
+
+    Only inserts outbox rows; the process_notifications worker delivers them.
+
+    Returns:
+        int: Number of emails queued
+    """
     from .models import Student
     
-    students = Student.objects.select_related('user').all()
+    contacts = list(Student.objects.values_list('user__email', 'phone'))
     
     priority_emoji = {
         'low': 'ℹ️',
@@ -272,23 +336,20 @@ Posted: {announcement.created_at.strftime('%B %d, %Y at %H:%M')}
     send_sms_notification = announcement.priority in ['high', 'urgent']
     sms_message = f"HMS ({announcement.get_priority_display()}): {announcement.title[:100]}"
     
-    success_count = 0
-    for student in students:
-        if student.user.email:
-            if NotificationService.send_email(student.user.email, subject, message):
-                success_count += 1
-        
-        if send_sms_notification and student.phone:
-            NotificationService.send_sms(student.phone, sms_message)
+    source = f'announcement:{announcement.pk}'
+    queued = enqueue_email([email for email, phone in contacts], subject, message, source=source)
     
-    return success_count
+    if send_sms_notification:
+        enqueue_sms([phone for email, phone in contacts], sms_message, source=source)
+    
+    return queued
 
 
-def notify_meal_reminder(student, meal_date):
-    """Send meal confirmation reminder to a student"""
+def meal_reminder_content(first_name, meal_date):
+    """Subject, email body and SMS text for a meal confirmation reminder"""
     subject = f"🍽️ Reminder: Confirm Your Meals for {meal_date.strftime('%B %d')}"
     message = f"""
-Dear {student.user.first_name},
+Dear {first_name},
 
 This is a friendly reminder to confirm your meal preferences for {meal_date.strftime('%A, %B %d, %Y')}.
 
@@ -300,6 +361,13 @@ Hostel Management System
     
     sms_message = f"HMS: Please confirm your meals for {meal_date.strftime('%b %d')} before 8 AM."
     
+    return subject, message, sms_message
+
+
+def notify_meal_reminder(student, meal_date):
+    """Send meal confirmation reminder to a student"""
+    subject, message, sms_message = meal_reminder_content(student.user.first_name, meal_date)
+    
     email_sent = NotificationService.send_email(student.user.email, subject, message)
     
     if student.phone:
@@ -308,20 +376,35 @@ Hostel Management System
     return email_sent
 
 
-def send_bulk_meal_reminders():
-    """Send reminders to all students who haven't confirmed meals for tomorrow"""
-    from .models import Student, Meal
+def send_bulk_meal_reminders(chunk_size=2000):
+    """Send reminders to all students who haven't confirmed meals for tomorrow
+    
+    Students away or on approved leave are skipped. Contacts are streamed
+    in chunks; emails go out through send_bulk_email, one SMTP connection
+    per batch, and the (identical) SMS texts as multi-recipient requests.
+    
+    Returns:
+        tuple: (emails sent, unconfirmed students)
+    """
+    from .models import Student
     from datetime import date, timedelta
     
     tomorrow = date.today() + timedelta(days=1)
     
-    # Get students who haven't confirmed meals
-    confirmed_ids = Meal.objects.filter(date=tomorrow).values_list('student_id', flat=True)
-    unconfirmed_students = Student.objects.exclude(id__in=confirmed_ids)
+    counts = {'students': 0}
+    texts = []
+    
+    def reminder_emails():
+        contacts = Student.objects.unconfirmed_for(tomorrow).contacts()
+        for contact in contacts.iterator(chunk_size=chunk_size):
+            counts['students'] += 1
+            subject, message, sms_message = meal_reminder_content(contact.first_name, tomorrow)
+            if contact.phone:
+                texts.append((contact.phone, sms_message))
+            if contact.email:
+                yield (contact.email, subject, message, None)
     
-    success_count = 0
-    for student in unconfirmed_students:
-        if notify_meal_reminder(student, tomorrow):
-            success_count += 1
+    outcomes = NotificationService.send_bulk_email(reminder_emails())
+    NotificationService.send_bulk_sms(texts)
     
-    return success_count, unconfirmed_students.count()
+    return sum(sent for _, sent in outcomes), counts['students']
@@ -0,0 +1,257 @@
+"""
+Notification Outbox for HMS
+Persistent email/SMS queue drained by the process_notifications worker
+
+Request handlers call enqueue_email / enqueue_sms, which only insert rows.
+The worker leases due rows, delivers them under per-channel rate limits
+and records the outcome, retrying failures with exponential backoff.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+
+# How long a claimed row stays invisible to other workers. If the worker
+# dies mid-batch the lease expires and the row is picked up again.
+CLAIM_LEASE = timedelta(minutes=5)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# ==================== ENQUEUE ====================
+
+def enqueue_email(recipients, subject, message, html_message=None, source=''):
+    """Queue one email per recipient
+
+    Args:
+        recipients: Email address (str) or iterable of addresses
+        subject: Email subject
+        message: Plain text message
+        html_message: Optional HTML message
+        source: What triggered the message, for tracing
+
+    Returns:
+        int: Number of messages queued
+    """
+    from .models import OutboundNotification
+
+    if isinstance(recipients, str):
+        recipients = [recipients]
+
+    queued = [
+        OutboundNotification(
+            channel='email',
+            recipient=recipient,
+            subject=subject[:255],
+            body=message,
+            html_body=html_message or '',
+            source=source
+        )
+        for recipient in recipients if recipient
+    ]
+    OutboundNotification.objects.bulk_create(queued, batch_size=500)
+    return len(queued)
+
+
+def enqueue_sms(phone_numbers, message, source=''):
+    """Queue one SMS per phone number
+
+    Returns:
+        int: Number of messages queued
+    """
+    from .models import OutboundNotification
+
+    if isinstance(phone_numbers, str):
+        phone_numbers = [phone_numbers]
+
+    queued = [
+        OutboundNotification(channel='sms', recipient=phone, body=message, source=source)
+        for phone in phone_numbers if phone
+    ]
+    OutboundNotification.objects.bulk_create(queued, batch_size=500)
+    return len(queued)
+
+
+# ==================== WORKER ====================
+
+class RateLimiter:
+    """Spaces calls to wait() so that at most `rate` happen per second
+
+    Safe to share between threads: each caller reserves the next free slot
+    under a lock and sleeps outside it.
+    """
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate else 0
+        self.clock = clock
+        self.sleep = sleep
+        self.next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = self.clock()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            self.sleep(slot - now)
+
+
+def retry_delay(attempts):
+    """Exponential backoff after the given number of failed attempts"""
+    base = _setting('NOTIFICATION_RETRY_BASE_SECONDS', 60)
+    cap = _setting('NOTIFICATION_RETRY_MAX_SECONDS', 3600)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), cap))
+
+
+def claim_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """Lease up to batch_size due messages to this worker
+
+    Rows are locked with SKIP LOCKED (on databases that support it), so
+    several workers can drain the queue side by side without double sends.
+
+    Returns:
+        list: Claimed OutboundNotification rows
+    """
+    from .models import OutboundNotification
+
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboundNotification.objects.select_for_update(skip_locked=True).filter(
+                status__in=['pending', 'sending'],
+                next_attempt_at__lte=now
+            ).order_by('next_attempt_at', 'pk')[:batch_size]
+        )
+        if batch:
+            OutboundNotification.objects.filter(pk__in=[item.pk for item in batch]).update(
+                status='sending',
+                attempts=F('attempts') + 1,
+                next_attempt_at=now + CLAIM_LEASE
+            )
+
+    for item in batch:
+        item.attempts += 1
+    return batch
+
+
+def deliver_emails(items, limiter=None):
+    """Send queued emails with one SMTP connection per batch
+
+    Returns:
+        list: One bool per item, True if it was sent
+    """
+    from .notifications import NotificationService
+
+    if not items:
+        return []
+
+    outcomes = NotificationService.send_bulk_email(
+        [(item.recipient, item.subject, item.body, item.html_body or None) for item in items],
+        throttle=limiter.wait if limiter else None
+    )
+    return [sent for _, sent in outcomes]
+
+
+def deliver_sms(items):
+    """Send queued SMS through the concurrent SMS dispatcher
+
+    Returns:
+        list: One bool per item, True if the provider accepted it
+    """
+    from .notifications import NotificationService
+
+    if not items:
+        return []
+
+    outcomes = NotificationService.send_bulk_sms([(item.recipient, item.body) for item in items])
+    return [sent for _, sent in outcomes]
+
+
+def record_results(delivered, undelivered, error='Delivery failed, see worker log'):
+    """Store delivery outcomes with one UPDATE per outcome group
+
+    Returns:
+        dict: {'sent', 'retrying', 'failed'} counts
+    """
+    from .models import OutboundNotification
+
+    now = timezone.now()
+    max_attempts = _setting('NOTIFICATION_MAX_ATTEMPTS', 5)
+    outcome = {'sent': len(delivered), 'retrying': 0, 'failed': 0}
+
+    if delivered:
+        OutboundNotification.objects.filter(pk__in=[item.pk for item in delivered]).update(
+            status='sent', sent_at=now, last_error=''
+        )
+
+    retry_groups = {}
+    failed = []
+    for item in undelivered:
+        if item.attempts >= max_attempts:
+            failed.append(item.pk)
+        else:
+            retry_groups.setdefault(item.attempts, []).append(item.pk)
+
+    if failed:
+        OutboundNotification.objects.filter(pk__in=failed).update(status='failed', last_error=error)
+        outcome['failed'] = len(failed)
+
+    for attempts, pks in retry_groups.items():
+        OutboundNotification.objects.filter(pk__in=pks).update(
+            status='pending', next_attempt_at=now + retry_delay(attempts), last_error=error
+        )
+        outcome['retrying'] += len(pks)
+
+    return outcome
+
+
+def process_outbox(batch_size=DEFAULT_BATCH_SIZE, limit=None, sleep=time.sleep):
+    """Deliver due messages until the queue is empty or limit is reached
+
+    Args:
+        batch_size: Rows claimed per transaction
+        limit: Optional maximum number of messages to process
+        sleep: Sleep function used by the rate limiters
+
+    Returns:
+        dict: {'sent', 'retrying', 'failed'} counts
+    """
+    rates = _setting('NOTIFICATION_RATE_LIMITS', {})
+    limiters = {channel: RateLimiter(rate, sleep=sleep) for channel, rate in rates.items()}
+    totals = {'sent': 0, 'retrying': 0, 'failed': 0}
+    processed = 0
+
+    while limit is None or processed < limit:
+        size = batch_size if limit is None else min(batch_size, limit - processed)
+        batch = claim_batch(size)
+        if not batch:
+            break
+
+        delivered, undelivered = [], []
+        emails = [item for item in batch if item.channel == 'email']
+        for item, sent in zip(emails, deliver_emails(emails, limiters.get('email'))):
+            (delivered if sent else undelivered).append(item)
+
+        # SMS are rate limited per provider by the SMS dispatcher
+        texts = [item for item in batch if item.channel == 'sms']
+        for item, sent in zip(texts, deliver_sms(texts)):
+            (delivered if sent else undelivered).append(item)
+
+        for key, value in record_results(delivered, undelivered).items():
+            totals[key] += value
+        processed += len(batch)
+
+    return totals
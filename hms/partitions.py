@@ -0,0 +1,234 @@
+"""
+Log Partitions for HMS
+Monthly storage for the append-only AuditLog and LoginActivity tables
+
+On PostgreSQL both tables are range-partitioned by month on timestamp
+(see migration 0025), with a DEFAULT partition catching rows outside the
+prepared months. Queries bounded by timestamp, such as the admin month
+filter, only read the partitions they need, and an old month is retired by
+detaching its partition instead of deleting rows. SQLite has no
+partitioning, so expired months are moved into per-month archive tables of
+the same name. Either way archive_month_tables() then writes each archived
+month to a compressed JSONL file and drops its table.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+import datetime
+import gzip
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+
+def partitioned_models():
+    """Models stored in monthly partitions"""
+    from .models import AuditLog, LoginActivity
+    return [AuditLog, LoginActivity]
+
+
+def is_partitioned():
+    return connection.vendor == 'postgresql'
+
+
+# ==================== MONTHS ====================
+
+def month_start(day):
+    return datetime.date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month, tz=datetime.timezone.utc):
+    """Aware [start, end) datetimes for the month; partitions use UTC months"""
+    start = datetime.datetime(month.year, month.month, 1, tzinfo=tz)
+    end = add_months(month, 1)
+    return start, datetime.datetime(end.year, end.month, 1, tzinfo=tz)
+
+
+def month_table(model, month):
+    """Name of the partition (or SQLite archive table) holding one month"""
+    return f'{model._meta.db_table}_p{month.year:04d}_{month.month:02d}'
+
+
+def _table_month(model, table):
+    match = re.fullmatch(re.escape(model._meta.db_table) + r'_p(\d{4})_(\d{2})', table)
+    return datetime.date(int(match[1]), int(match[2]), 1) if match else None
+
+
+# ==================== PARTITION MAINTENANCE ====================
+
+def attached_partitions(model):
+    """{month: table} for the monthly partitions attached to model's table"""
+    if not is_partitioned():
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = %s",
+            [model._meta.db_table],
+        )
+        tables = [row[0] for row in cursor.fetchall()]
+    return {month: table for table in tables if (month := _table_month(model, table))}
+
+
+def ensure_partitions(months_ahead=2, today=None):
+    """Create the partitions for this month and the next months_ahead months
+
+    New rows would otherwise land in the DEFAULT partition, which is never
+    archived by month. A no-op on databases without partitioning.
+
+    Returns:
+        list: Names of the partitions created
+    """
+    if not is_partitioned():
+        return []
+    first = month_start(today or timezone.now().astimezone(datetime.timezone.utc).date())
+    created = []
+    for model in partitioned_models():
+        existing = attached_partitions(model)
+        for offset in range(months_ahead + 1):
+            month = add_months(first, offset)
+            if month in existing:
+                continue
+            start, end = month_bounds(month)
+            table = month_table(model, month)
+            try:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute(
+                        f'CREATE TABLE {connection.ops.quote_name(table)} PARTITION OF '
+                        f'{connection.ops.quote_name(model._meta.db_table)} FOR VALUES FROM (%s) TO (%s)',
+                        [start, end],
+                    )
+            except Exception as e:
+                # e.g. rows for the month already sit in the DEFAULT partition
+                logger.error(f"Failed to create partition {table}: {str(e)}")
+                continue
+            created.append(table)
+    return created
+
+
+# ==================== ARCHIVING ====================
+
+def archived_tables(model):
+    """{month: table} for months detached or copied out but not yet exported"""
+    attached = set(attached_partitions(model).values())
+    return {
+        month: table
+        for table in connection.introspection.table_names()
+        if table not in attached and (month := _table_month(model, table))
+    }
+
+
+def expired_months(model, before):
+    """Months entirely before the month of before that still hold live rows"""
+    cutoff = month_start(before)
+    with timezone.override(datetime.timezone.utc):
+        months = {
+            month_start(day)
+            for day in model.objects.filter(timestamp__lt=month_bounds(cutoff)[0]).dates('timestamp', 'month')
+        }
+    # Empty partitions are retired too
+    months.update(month for month in attached_partitions(model) if month < cutoff)
+    return sorted(months)
+
+
+def detach_month(model, month):
+    """Move one month out of model's live table into its own table
+
+    Attached partitions are detached, which only touches the catalog.
+    Otherwise (SQLite, or rows in the PostgreSQL DEFAULT partition) the rows
+    are copied into the month's table and deleted from the live table.
+
+    Returns:
+        str: Name of the table now holding the month
+    """
+    quote = connection.ops.quote_name
+    parent, table = model._meta.db_table, month_table(model, month)
+    with transaction.atomic(), connection.cursor() as cursor:
+        if table in attached_partitions(model).values():
+            cursor.execute(f'ALTER TABLE {quote(parent)} DETACH PARTITION {quote(table)}')
+            return table
+
+        start, end = month_bounds(month)
+        expired = model.objects.filter(timestamp__gte=start, timestamp__lt=end).order_by()
+        select_sql, params = expired.values(*[f.attname for f in model._meta.concrete_fields]).query.sql_with_params()
+        if table in connection.introspection.table_names(cursor):
+            cursor.execute(f'INSERT INTO {quote(table)} {select_sql}', params)
+        else:
+            cursor.execute(f'CREATE TABLE {quote(table)} AS {select_sql}', params)
+        # Nothing references the log tables, so one plain DELETE is enough
+        column = quote(model._meta.get_field('timestamp').column)
+        cursor.execute(
+            f'DELETE FROM {quote(parent)} WHERE {column} >= %s AND {column} < %s',
+            [connection.ops.adapt_datetimefield_value(start), connection.ops.adapt_datetimefield_value(end)],
+        )
+    return table
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def export_table(table, path, chunk_size=2000):
+    """Write every row of table to a gzip-compressed JSONL file
+
+    Written to a temporary file first, so a partial export never replaces a
+    complete one.
+
+    Returns:
+        int: Number of rows written
+    """
+    quote = connection.ops.quote_name
+    partial = f'{path}.partial'
+    rows = 0
+    with connection.cursor() as cursor, gzip.open(partial, 'wt', encoding='utf-8') as out:
+        cursor.execute(f'SELECT * FROM {quote(table)} ORDER BY {quote("id")}')
+        columns = [col[0] for col in cursor.description]
+        while batch := cursor.fetchmany(chunk_size):
+            for row in batch:
+                out.write(json.dumps(dict(zip(columns, row)), default=_json_default) + '\n')
+            rows += len(batch)
+    os.replace(partial, path)
+    return rows
+
+
+def exported_rows(path):
+    """Rows in an export file, or None if it is missing or unreadable"""
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as archive:
+            return sum(1 for _ in archive)
+    except (OSError, EOFError):
+        return None
+
+
+def archive_month_tables(model, directory):
+    """Export each archived month table of model to directory, then drop it
+
+    A table is only dropped once its export file has been read back with
+    every row; otherwise it is kept for the next run.
+
+    Returns:
+        list: (table, rows, path) for each month archived
+    """
+    os.makedirs(directory, exist_ok=True)
+    archived = []
+    for month, table in sorted(archived_tables(model).items()):
+        path = os.path.join(directory, f'{table}.jsonl.gz')
+        rows = export_table(table, path)
+        if exported_rows(path) != rows:
+            logger.error(f"Export of {table} to {path} is incomplete; keeping the table")
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {connection.ops.quote_name(table)}')
+        archived.append((table, rows, path))
+    return archived
@@ -0,0 +1,216 @@
+"""
+Rate Limiting for HMS
+Sliding-window counters on the Django cache, used to throttle logins
+
+Each limit keeps one counter per fixed window and estimates the sliding
+window from the current and previous counters, the previous one weighted
+by how much of it still overlaps. Counters live in a store: CacheCounters
+keeps them in a Django cache (locmem in development, or a Redis or
+Memcached cache with an atomic incr), DatabaseCounters in RateLimitCounter
+rows incremented with F() so every worker shares exact counts. The file
+and database cache backends are not suitable, as their incr is a separate
+get and set that loses concurrent hits.
+
+Login attempts are checked before the password is hashed, and only failed
+attempts are counted, against both the client IP and the username tried.
+Credential stuffing is turned away cheaply, while the successful logins of
+a whole hostel behind one NAT address never use up the IP limit.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from datetime import timedelta
+import hashlib
+import math
+import time
+
+from .logins import client_ip
+
+
+class RateLimited(Exception):
+    """Raised when a limit is reached
+
+    Attributes:
+        retry_after: Seconds until another attempt would be allowed
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f'Rate limited; retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+# ==================== COUNTER STORES ====================
+
+class CacheCounters:
+    """Counters in a Django cache backend"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+    def incr(self, key, timeout):
+        self.cache.add(key, 0, timeout=timeout)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            self.cache.set(key, 1, timeout=timeout)
+
+
+class DatabaseCounters:
+    """Counters in RateLimitCounter rows, shared by every worker
+
+    Increments are single UPDATE ... SET count = count + 1 statements, so
+    concurrent hits from different workers are never lost.
+    """
+
+    def get_many(self, keys):
+        from .models import RateLimitCounter
+
+        return dict(RateLimitCounter.objects.filter(
+            key__in=keys, expires_at__gt=timezone.now()
+        ).values_list('key', 'count'))
+
+    def incr(self, key, timeout):
+        from .models import RateLimitCounter
+
+        # Keys carry their window index, so a row is never reused once expired
+        if RateLimitCounter.objects.filter(key=key).update(count=F('count') + 1):
+            return
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                RateLimitCounter.objects.create(key=key, count=1, expires_at=now + timedelta(seconds=timeout))
+        except IntegrityError:
+            # Another worker created the row first
+            RateLimitCounter.objects.filter(key=key).update(count=F('count') + 1)
+        else:
+            # Each row is created once per key and window, which bounds this cleanup
+            RateLimitCounter.objects.filter(expires_at__lte=now).delete()
+
+
+# ==================== LIMITS ====================
+
+class SlidingWindow:
+    """At most `limit` hits per `window` seconds for each key
+
+    Args:
+        name: Prefix separating this limit's counter keys from others
+        limit: Hits allowed per window
+        window: Window length in seconds
+        store: CacheCounters or DatabaseCounters holding the counters
+    """
+
+    def __init__(self, name, limit, window, store):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.store = store
+
+    def _keys(self, key, now):
+        digest = hashlib.sha256(str(key).lower().encode()).hexdigest()[:32]
+        index = int(now // self.window)
+        return f'hms:rl:{self.name}:{digest}:{index}', f'hms:rl:{self.name}:{digest}:{index - 1}'
+
+    def _counts(self, key, now):
+        current_key, previous_key = self._keys(key, now)
+        counts = self.store.get_many([current_key, previous_key])
+        return counts.get(current_key, 0), counts.get(previous_key, 0)
+
+    def usage(self, key, now=None):
+        """Estimated hits in the window ending now"""
+        now = time.time() if now is None else now
+        current, previous = self._counts(key, now)
+        overlap = 1 - (now % self.window) / self.window
+        return current + previous * overlap
+
+    def retry_after(self, key, now=None):
+        """Seconds until key is under its limit again (0 if it is now)"""
+        now = time.time() if now is None else now
+        current, previous = self._counts(key, now)
+        elapsed = now % self.window
+        if current + previous * (1 - elapsed / self.window) < self.limit:
+            return 0
+        if current >= self.limit:
+            # Once this window is the previous one, its weight must fall below the limit
+            wait = self.window - elapsed + self.window * (1 - self.limit / current)
+        else:
+            # The previous window's weight falls linearly to zero
+            wait = self.window * (1 - (self.limit - current) / previous) - elapsed
+        return max(math.ceil(wait), 1)
+
+    def hit(self, key, now=None):
+        """Count one hit for key"""
+        now = time.time() if now is None else now
+        current_key, _ = self._keys(key, now)
+        # Kept for two windows: one as current, one as previous
+        self.store.incr(current_key, timeout=self.window * 2)
+
+
+class LoginLimiter:
+    """Per-IP and per-username throttling for password logins
+
+    Args:
+        ip_limit: (failed attempts, seconds) allowed from one client IP
+        username_limit: (failed attempts, seconds) allowed for one username
+        store: CacheCounters or DatabaseCounters holding the counters
+    """
+
+    def __init__(self, ip_limit, username_limit, store):
+        self.by_ip = SlidingWindow('login-ip', *ip_limit, store=store)
+        self.by_username = SlidingWindow('login-user', *username_limit, store=store)
+
+    def check(self, ip, username):
+        """Raise RateLimited if an attempt must be refused
+
+        Call before authenticating, so a refused attempt costs no hashing.
+        """
+        now = time.time()
+        wait = max(
+            self.by_ip.retry_after(ip, now) if ip else 0,
+            self.by_username.retry_after(username, now) if username else 0,
+        )
+        if wait:
+            raise RateLimited(wait)
+
+    def failed(self, ip, username):
+        """Count a failed attempt against ip and username"""
+        now = time.time()
+        if ip:
+            self.by_ip.hit(ip, now)
+        if username:
+            self.by_username.hit(username, now)
+
+
+def counter_store():
+    """The counter store named by settings.RATELIMIT_STORE"""
+    if settings.RATELIMIT_STORE == 'db':
+        return DatabaseCounters()
+    return CacheCounters(caches[settings.RATELIMIT_CACHE])
+
+
+def login_limiter():
+    """LoginLimiter configured from settings.LOGIN_RATE_LIMITS"""
+    limits = settings.LOGIN_RATE_LIMITS
+    return LoginLimiter(limits['ip'], limits['username'], store=counter_store())
+
+
+def check_login(request, username):
+    """Refuse a login attempt from request for username if over a limit
+
+    Raises:
+        RateLimited: With the seconds the client should wait
+    """
+    if not settings.RATELIMIT_ENABLED:
+        return
+    login_limiter().check(client_ip(request) if request is not None else None, username)
+
+
+def login_failed(request, username):
+    """Record a failed login from request for username (see the user_login_failed handler)"""
+    if settings.RATELIMIT_ENABLED:
+        login_limiter().failed(client_ip(request) if request is not None else None, username)
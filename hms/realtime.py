@@ -0,0 +1,249 @@
+"""
+Real-time Events for HMS
+Publish/subscribe used to push in-app notifications to SSE clients
+
+Events are published from ordinary (sync) code such as signal handlers and
+delivered to asyncio queues owned by the connected event streams. The
+default broker only reaches streams in the same process; PostgresBroker
+relays events between processes with LISTEN/NOTIFY.
+"""
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+import asyncio
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Events kept per connection before the slowest clients start losing them
+QUEUE_SIZE = 100
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class Subscription:
+    """One stream's view of a broker channel"""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def deliver(self, event):
+        """Queue an event from any thread"""
+        def put():
+            try:
+                self.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.warning(f"Dropping realtime event for {self.channel}: client is not keeping up")
+        try:
+            self.loop.call_soon_threadsafe(put)
+        except RuntimeError:
+            # Event loop already closed; the stream is gone
+            self.close()
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Delivers events to subscribers in this process only"""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """Subscribe the running event loop to a channel (call from async code)"""
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._subscribers.get(channel, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def deliver_local(self, channels, event):
+        with self._lock:
+            targets = [s for channel in channels for s in self._subscribers.get(channel, ())]
+        for subscription in targets:
+            subscription.deliver(event)
+
+    def publish(self, channels, event):
+        """Send an event to every subscriber of the given channels
+
+        Args:
+            channels: Channel name or list of channel names
+            event: JSON-serialisable dict with a 'type' key
+        """
+        if isinstance(channels, str):
+            channels = [channels]
+        self.deliver_local(channels, event)
+
+
+class PostgresBroker(InProcessBroker):
+    """Relays events between processes with PostgreSQL LISTEN/NOTIFY
+
+    publish() issues a NOTIFY on the default database connection (so it is
+    delivered only if the surrounding transaction commits). A daemon thread
+    per process LISTENs on its own connection and hands events to the local
+    subscribers.
+    """
+    pg_channel = 'hms_realtime'
+    # NOTIFY payloads are capped at 8000 bytes
+    max_payload = 7500
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+
+    def subscribe(self, channel):
+        self._ensure_listener()
+        return super().subscribe(channel)
+
+    def publish(self, channels, event):
+        from django.db import connection
+
+        if isinstance(channels, str):
+            channels = [channels]
+
+        with connection.cursor() as cursor:
+            for payload in self._payloads(list(channels), event):
+                cursor.execute('SELECT pg_notify(%s, %s)', [self.pg_channel, payload])
+
+    def _payloads(self, channels, event):
+        """Split the channel list so each NOTIFY payload fits the size cap"""
+        payload = json.dumps({'channels': channels, 'event': event}, default=str)
+        if len(payload.encode()) <= self.max_payload or len(channels) == 1:
+            yield payload
+            return
+        middle = len(channels) // 2
+        yield from self._payloads(channels[:middle], event)
+        yield from self._payloads(channels[middle:], event)
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='hms-realtime-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        import select
+        import psycopg2
+        from django.db import connections
+
+        params = connections['default'].get_connection_params()
+        conn = psycopg2.connect(**params)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.pg_channel}')
+
+        try:
+            while True:
+                if select.select([conn], [], [], 30) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        message = json.loads(notify.payload)
+                        self.deliver_local(message['channels'], message['event'])
+                    except (ValueError, KeyError) as e:
+                        logger.error(f"Bad realtime payload: {str(e)}")
+        except Exception as e:
+            logger.error(f"Realtime listener stopped: {str(e)}")
+        finally:
+            conn.close()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def broker_path():
+    """Dotted path of the broker to use
+
+    REALTIME_BROKER if set, else PostgresBroker on PostgreSQL, so events
+    reach every worker and the notification process, and InProcessBroker
+    on other databases (SQLite in development).
+    """
+    path = getattr(settings, 'REALTIME_BROKER', None)
+    if path:
+        return path
+    if connection.vendor == 'postgresql':
+        return 'hms.realtime.PostgresBroker'
+    return 'hms.realtime.InProcessBroker'
+
+
+def get_broker():
+    """Process-wide broker chosen by broker_path()"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(broker_path())()
+    return _broker
+
+
+def publish(channels, event):
+    """Publish an event, logging instead of raising so callers never fail on it"""
+    try:
+        get_broker().publish(channels, event)
+    except Exception as e:
+        logger.error(f"Failed to publish realtime event: {str(e)}")
+
+
+# ==================== NOTIFICATIONS ====================
+
+def notification_event(notification, unread=None):
+    event = {
+        'type': 'notification',
+        'id': notification.pk,
+        'title': notification.title,
+        'message': notification.message,
+        'link': notification.link or '',
+        'created_at': notification.created_at.isoformat() if notification.created_at else None,
+    }
+    if unread is not None:
+        event['unread'] = unread
+    return event
+
+
+def publish_notification(notification):
+    """Push a new notification and the recipient's unread count"""
+    from .unread import counts_for
+
+    unread = counts_for(notification.user_id)['notifications']
+    publish(user_channel(notification.user_id), notification_event(notification, unread))
+
+
+def publish_bulk_notifications(user_ids, title, message, link=''):
+    """Push one notification to many users after a bulk insert
+
+    The event carries no unread count; clients add one to theirs.
+    """
+    publish([user_channel(user_id) for user_id in user_ids], {
+        'type': 'notification',
+        'title': title,
+        'message': message,
+        'link': link,
+    })
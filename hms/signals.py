@@ -1,10 +1,16 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from django.contrib.auth.signals import user_logged_in
+from django.contrib.auth.signals import user_logged_in, user_login_failed
 from allauth.socialaccount.signals import pre_social_login
-from .models import Student, LoginActivity, AuditLog
-from .middleware import get_current_user
+from django.db import transaction
+from .models import (Student, Meal, Message, Notification, LoginActivity, AuditLog, Announcement, Activity,
+                     Document, Event)
+from .middleware import SystemActor, get_current_actor
+from .meal_stats import record_meal_saved, record_meal_deleted
+from .realtime import publish_notification
+from . import audit, caching, chat, logins, ratelimit, unread
+import functools
 import json
 
 @receiver(post_save, sender=User)
@@ -31,38 +37,102 @@ def link_to_local_user(sender, request, sociallogin, **kwargs):
         except User.DoesNotExist:
             pass
 
+# ============================================
+# MEAL SUMMARY ROLLUP
+# ============================================
+
+@receiver(post_save, sender=Meal)
+def update_daily_meal_summary(sender, instance, created, raw=False, **kwargs):
+    """Keep DailyMealSummary in step with single Meal saves"""
+    if raw:
+        return
+    record_meal_saved(instance, created)
+
+@receiver(post_delete, sender=Meal)
+def remove_from_daily_meal_summary(sender, instance, **kwargs):
+    """Subtract deleted meals from DailyMealSummary"""
+    record_meal_deleted(instance)
+
+# ============================================
+# UNREAD COUNTERS
+# ============================================
+
+@receiver(post_save, sender=Message)
+def count_new_message(sender, instance, created, raw=False, **kwargs):
+    """Update the conversation and bump its reader's unread counters"""
+    if created and not raw:
+        chat.record_message(instance)
+
+@receiver(post_delete, sender=Message)
+def uncount_deleted_message(sender, instance, **kwargs):
+    chat.forget_message(instance)
+
+@receiver(post_save, sender=Notification)
+def count_new_notification(sender, instance, created, raw=False, **kwargs):
+    """Bump the recipient's unread notification counter"""
+    if created and not raw and not instance.is_read:
+        unread.adjust(instance.user_id, notifications=1)
+
+@receiver(post_delete, sender=Notification)
+def uncount_deleted_notification(sender, instance, **kwargs):
+    if not instance.is_read:
+        unread.adjust(instance.user_id, notifications=-1)
+
+# ============================================
+# REAL-TIME NOTIFICATIONS
+# ============================================
+
+@receiver(post_save, sender=Notification)
+def push_new_notification(sender, instance, created, raw=False, **kwargs):
+    """Push new notifications to the recipient's open event streams"""
+    if created and not raw:
+        transaction.on_commit(lambda: publish_notification(instance))
+
+# ============================================
+# READ CACHE INVALIDATION
+# ============================================
+
+CACHE_NAMESPACES = {Announcement: 'announcements', Activity: 'activities', Document: 'documents', Event: 'events'}
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_cached_lists(sender, raw=False, **kwargs):
+    """Drop cached lists built from a changed Announcement, Activity, Document or Event"""
+    namespace = CACHE_NAMESPACES.get(sender)
+    if namespace and not raw:
+        # After commit, so no request re-caches the old rows in between
+        transaction.on_commit(functools.partial(caching.bump, namespace))
+
 # ============================================
 # SECURITY & AUDIT LOGGING
 # ============================================
 
 @receiver(user_logged_in)
 def log_user_login(sender, request, user, **kwargs):
-    """Log user login activity"""
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    
-    user_agent = request.META.get('HTTP_USER_AGENT', '')
-    
-    LoginActivity.objects.create(
-        user=user,
-        ip_address=ip,
-        user_agent=user_agent
-    )
+    """Log user login activity (written in batches, see hms.logins)"""
+    logins.record_login(request, user=user)
+
+@receiver(user_login_failed)
+def log_failed_login(sender, credentials, request=None, **kwargs):
+    """Log failed login attempts and count them against the client and username tried"""
+    username = credentials.get('username') or credentials.get('email') or ''
+    logins.record_login(request, username=username, status=LoginActivity.FAILED)
+    ratelimit.login_failed(request, username)
 
 @receiver(post_save)
 @receiver(post_delete)
 def log_audit_change(sender, instance, **kwargs):
-    """Log changes to sensitive models"""
-    # Ignore logging models and migration history
-    if sender in [LoginActivity, AuditLog] or sender._meta.model_name == 'session' or sender._meta.app_label == 'admin':
+    """Log changes to the models listed in settings.AUDIT_LOG_MODELS"""
+    if not audit.is_audited(sender):
         return
-        
-    user = get_current_user()
-    if not user or not user.is_authenticated:
-        return # Only log authenticated actions or rely on system (can create system user if needed)
+
+    actor = get_current_actor()
+    if isinstance(actor, SystemActor):
+        user, actor_name = None, actor.name
+    elif actor is not None and actor.is_authenticated:
+        user, actor_name = actor, ''
+    else:
+        return # Only log authenticated users and explicit system actors
     
     # Determine action
     if 'created' not in kwargs:
@@ -72,15 +142,26 @@ def log_audit_change(sender, instance, **kwargs):
     else:
         action = 'UPDATE'
         
+    # Diffed against the values loaded with the instance, not a fresh SELECT
+    diff = audit.audit_diff(instance, action, kwargs.get('update_fields'))
+    if action == 'UPDATE' and diff == {}:
+        return # Saved without changing any tracked field
+
     object_repr = str(instance)[:200]
     object_id = str(instance.pk)
     model_name = sender.__name__
+    changes = f"{action} on {model_name}"
+    if action == 'UPDATE' and diff:
+        changes = f"{changes}: {', '.join(diff)}"
     
-    AuditLog.objects.create(
+    # Written in bulk once the change commits (see hms.audit)
+    audit.record(AuditLog(
         user=user,
+        actor=actor_name,
         model_name=model_name,
         object_id=object_id,
         object_repr=object_repr,
         action=action,
-        changes=f"{action} on {model_name}"
-    )
+        changes=changes,
+        diff=diff,
+    ))
@@ -0,0 +1,231 @@
+"""
+SMS Gateway for HMS
+Cached provider clients and concurrent, rate-limited SMS fan-out
+
+Provider clients are created once per process. The dispatcher groups
+recipients of the same text into multi-recipient requests (where the
+provider supports it) and sends the requests over a bounded thread pool,
+spaced by a per-provider rate limit.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+import atexit
+import logging
+import threading
+import time
+
+from .outbox import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== PROVIDERS ====================
+
+def to_e164(number, country_code='254'):
+    """Phone number in E.164 form (+2547...), reading local numbers (07...) as in country_code"""
+    number = ''.join(ch for ch in str(number) if ch.isdigit() or ch == '+')
+    if number.startswith('+'):
+        return number
+    if number.startswith('00'):
+        return '+' + number[2:]
+    if number.startswith(country_code):
+        return '+' + number
+    return '+' + country_code + number.lstrip('0')
+
+
+class AfricasTalkingProvider:
+    """Africa's Talking bulk SMS; one API call covers many recipients
+
+    Recipients are sent in E.164 form, the form the API reports results in,
+    and results are mapped back to the numbers as given.
+    """
+    name = 'africastalking'
+
+    def __init__(self, username, api_key, max_recipients=100, country_code='254'):
+        import africastalking
+        africastalking.initialize(username, api_key)
+        self.sms = africastalking.SMS
+        self.max_recipients = max_recipients
+        self.country_code = country_code
+
+    def send(self, message, recipients):
+        normalised = {recipient: to_e164(recipient, self.country_code) for recipient in recipients}
+        response = self.sms.send(message, list(dict.fromkeys(normalised.values())))
+        delivered = {
+            to_e164(entry.get('number', ''), self.country_code): entry.get('status') == 'Success'
+            for entry in response.get('SMSMessageData', {}).get('Recipients', [])
+        }
+        return {recipient: delivered.get(number, False) for recipient, number in normalised.items()}
+
+
+class TwilioProvider:
+    """Twilio Programmable SMS; one API call per recipient"""
+    name = 'twilio'
+    max_recipients = 1
+
+    def __init__(self, account_sid, auth_token, from_number):
+        from twilio.rest import Client
+        self.client = Client(account_sid, auth_token)
+        self.from_number = from_number
+
+    def send(self, message, recipients):
+        for recipient in recipients:
+            self.client.messages.create(body=message, from_=self.from_number, to=recipient)
+        return {recipient: True for recipient in recipients}
+
+
+class FakeGateway:
+    """In-process stand-in for an SMS provider, for tests and benchmarks
+
+    Records every request in `requests` as (message, recipients). `latency`
+    simulates the provider round trip; numbers in `failing` are rejected.
+    """
+    name = 'fake'
+
+    def __init__(self, max_recipients=100, latency=0, failing=()):
+        self.max_recipients = max_recipients
+        self.latency = latency
+        self.failing = set(failing)
+        self.requests = []
+        self.active = 0
+        self.peak_concurrency = 0
+        self._lock = threading.Lock()
+
+    def send(self, message, recipients):
+        with self._lock:
+            self.active += 1
+            self.peak_concurrency = max(self.peak_concurrency, self.active)
+            self.requests.append((message, list(recipients)))
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            return {recipient: recipient not in self.failing for recipient in recipients}
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    @property
+    def sent(self):
+        return [(recipient, message) for message, recipients in self.requests for recipient in recipients]
+
+
+def build_provider():
+    """Create the provider configured in settings, or None if SMS is not set up"""
+    provider = getattr(settings, 'SMS_PROVIDER', '')
+
+    if provider == 'fake':
+        return FakeGateway()
+    if provider == 'twilio' or (not provider and getattr(settings, 'TWILIO_ACCOUNT_SID', None)):
+        return TwilioProvider(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN, settings.TWILIO_PHONE_NUMBER)
+    if provider == 'africastalking' or (not provider and getattr(settings, 'AFRICASTALKING_USERNAME', None)):
+        return AfricasTalkingProvider(
+            settings.AFRICASTALKING_USERNAME,
+            settings.AFRICASTALKING_API_KEY,
+            getattr(settings, 'AFRICASTALKING_BATCH_SIZE', 100),
+            getattr(settings, 'SMS_COUNTRY_CODE', '254')
+        )
+    return None
+
+
+# ==================== DISPATCHER ====================
+
+class SMSDispatcher:
+    """Sends SMS through one provider over a bounded thread pool
+
+    Args:
+        provider: Object with `name`, `max_recipients` and send(message, recipients)
+        max_workers: Concurrent provider requests
+        rate: Provider requests per second (0 for no limit)
+    """
+
+    def __init__(self, provider, max_workers=4, rate=0):
+        self.provider = provider
+        self.limiter = RateLimiter(rate)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hms-sms')
+
+    def _send_request(self, message, recipients):
+        self.limiter.wait()
+        try:
+            return self.provider.send(message, recipients)
+        except Exception as e:
+            logger.error(f"SMS via {self.provider.name} to {len(recipients)} recipient(s) failed: {str(e)}")
+            return {recipient: False for recipient in recipients}
+
+    def send_many(self, messages):
+        """Send many SMS, merging recipients that share the same text
+
+        Args:
+            messages: Iterable of (phone_number, message) pairs
+
+        Returns:
+            list: (phone_number, sent) pairs in the order given
+        """
+        messages = [(phone, text) for phone, text in messages if phone]
+
+        by_text = {}
+        for phone, text in messages:
+            recipients = by_text.setdefault(text, [])
+            if phone not in recipients:
+                recipients.append(phone)
+
+        size = max(self.provider.max_recipients, 1)
+        futures = [
+            (text, self.executor.submit(self._send_request, text, recipients[i:i + size]))
+            for text, recipients in by_text.items()
+            for i in range(0, len(recipients), size)
+        ]
+
+        results = {}
+        for text, future in futures:
+            for phone, sent in future.result().items():
+                results[(phone, text)] = sent
+
+        sent_count = sum(results.values())
+        logger.info(f"SMS via {self.provider.name}: {sent_count}/{len(results)} sent in {len(futures)} request(s)")
+        return [(phone, results.get((phone, text), False)) for phone, text in messages]
+
+    def send(self, message, recipients):
+        """Send one text to many recipients
+
+        Returns:
+            dict: phone_number -> sent
+        """
+        return dict(self.send_many((phone, message) for phone in recipients))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Process-wide dispatcher, created on first use
+
+    Returns:
+        SMSDispatcher or None if no provider is configured
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                provider = build_provider()
+                if provider is None:
+                    return None
+                _dispatcher = SMSDispatcher(
+                    provider,
+                    max_workers=getattr(settings, 'SMS_MAX_WORKERS', 4),
+                    rate=getattr(settings, 'SMS_RATE_LIMITS', {}).get(provider.name, 0)
+                )
+                atexit.register(_dispatcher.shutdown)
+    return _dispatcher
+
+
+def reset_dispatcher():
+    """Drop the cached dispatcher, e.g. after changing SMS settings"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is not None:
+            _dispatcher.shutdown()
+        _dispatcher = None
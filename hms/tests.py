@@ -1,9 +1,26 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.contrib.auth.models import User
 from django.utils import timezone
 from .models import Student, Meal
 from datetime import date, timedelta, time
 from unittest.mock import patch
+from io import StringIO
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+
+# Login events are written as they happen, so tests see their LoginActivity rows at once
+unbuffered_logins = override_settings(LOGIN_ACTIVITY_BUFFERED=False)
+
+
+def setUpModule():
+    from .logins import reset_recorder
+    unbuffered_logins.enable()
+    reset_recorder()
+
+
+def tearDownModule():
+    from .logins import reset_recorder
+    unbuffered_logins.disable()
+    reset_recorder()
 
 class MealSubmissionTest(TestCase):
     def setUp(self):
@@ -57,3 +74,1494 @@ class AdminDashboardTest(TestCase):
         response = self.client.get('/kitchen/dashboard/')
         self.assertEqual(response.context['today_stats']['breakfast'], 1)
         self.assertEqual(response.context['today_stats']['supper'], 1)
+
+class MealStatsTest(TestCase):
+    def setUp(self):
+        self.students = []
+        for i in range(3):
+            user = User.objects.create_user(username=f'stats{i}', password='p')
+            self.students.append(user.student_profile)
+
+    def test_daily_stats_single_query(self):
+        """Per-day counters for any range cost one query and are zero-filled"""
+        from .meal_stats import daily_meal_stats
+        today = date.today()
+        Meal.objects.create(student=self.students[0], date=today, breakfast=True, early=True)
+        Meal.objects.create(student=self.students[1], date=today, supper=True)
+        Meal.objects.create(student=self.students[2], date=today, away=True)
+
+        with self.assertNumQueries(1):
+            stats = daily_meal_stats(today - timedelta(days=89), today)
+
+        self.assertEqual(len(stats), 90)
+        self.assertEqual(stats[today], {'breakfast': 1, 'early': 1, 'supper': 1, 'away': 1, 'confirmed': 3})
+        self.assertEqual(stats[today - timedelta(days=1)]['confirmed'], 0)
+
+    def test_unconfirmed_count(self):
+        """Students without a meal record for the date are unconfirmed"""
+        from .meal_stats import unconfirmed_count
+        tomorrow = date.today() + timedelta(days=1)
+        Meal.objects.create(student=self.students[0], date=tomorrow, breakfast=True)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(unconfirmed_count(tomorrow), 2)
+
+class AnalyticsDashboardTest(TestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(username='analyst', password='password123')
+        self.client = Client()
+        self.client.login(username='analyst', password='password123')
+
+    def test_query_count_independent_of_range(self):
+        """Widening the range must not add queries"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as week:
+            self.client.get('/manage/analytics/?days=7')
+        with CaptureQueriesContext(connection) as semester:
+            response = self.client.get('/manage/analytics/?days=180')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['range_days'], 180)
+        self.assertEqual(len(week.captured_queries), len(semester.captured_queries))
+
+    def test_weekly_window_is_not_widened_by_an_old_range(self):
+        from . import meal_stats
+        with patch('hms.views.meal_stats.daily_meal_stats', wraps=meal_stats.daily_meal_stats) as daily:
+            response = self.client.get('/manage/analytics/', {'start': '2015-01-01', 'end': '2015-01-31'})
+        self.assertEqual(response.status_code, 200)
+        today = date.today()
+        self.assertEqual([c.args for c in daily.call_args_list],
+                         [(date(2015, 1, 1), date(2015, 1, 31)), (today - timedelta(days=6), today)])
+
+    def test_out_of_range_days_are_clamped(self):
+        from .analytics import MAX_RANGE_DAYS, parse_date_range
+        today = date.today()
+        self.assertEqual(parse_date_range({'days': '100000000'}),
+                         (today - timedelta(days=MAX_RANGE_DAYS - 1), today))
+        self.assertEqual(parse_date_range({'end': '0001-01-02', 'days': '5'}),
+                         (today - timedelta(days=29), today))
+        self.assertEqual(self.client.get('/manage/analytics/?days=100000000').status_code, 200)
+
+    def test_breakdowns_zero_filled(self):
+        """Grouped breakdowns include every choice, even with no rows"""
+        from .analytics import maintenance_breakdown
+        from .models import MaintenanceRequest
+        student = User.objects.create_user(username='fixer', password='p').student_profile
+        MaintenanceRequest.objects.create(student=student, title='Tap', description='Leaks', priority='high')
+
+        with self.assertNumQueries(1):
+            breakdown = maintenance_breakdown()
+
+        self.assertEqual(breakdown['status'], {'pending': 1, 'in_progress': 0, 'resolved': 0})
+        self.assertEqual(breakdown['priority']['high'], 1)
+        self.assertEqual(breakdown['priority']['critical'], 0)
+
+class DailyMealSummaryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rollup', password='password123')
+        self.student = self.user.student_profile
+        self.today = date.today()
+
+    def summary(self, day):
+        from .meal_stats import daily_meal_stats
+        return daily_meal_stats(day, day)[day]
+
+    def test_rollup_follows_meal_changes(self):
+        """Creating, editing and deleting meals keeps the rollup exact"""
+        meal = Meal.objects.create(student=self.student, date=self.today, breakfast=True)
+        self.assertEqual(self.summary(self.today), {'breakfast': 1, 'early': 0, 'supper': 0, 'away': 0, 'confirmed': 1})
+
+        meal = Meal.objects.get(pk=meal.pk)
+        meal.breakfast = False
+        meal.supper = True
+        meal.save()
+        self.assertEqual(self.summary(self.today), {'breakfast': 0, 'early': 0, 'supper': 1, 'away': 0, 'confirmed': 1})
+
+        meal.delete()
+        self.assertEqual(self.summary(self.today)['confirmed'], 0)
+        self.assertEqual(self.summary(self.today)['supper'], 0)
+
+    def test_confirm_meals_updates_rollup(self):
+        """Meal confirmation through the view is reflected in the rollup"""
+        client = Client()
+        client.login(username='rollup', password='password123')
+        tomorrow = self.today + timedelta(days=1)
+        client.post('/student/confirm-meals/', {'date': str(tomorrow), 'supper': 'on'})
+        self.assertEqual(self.summary(tomorrow)['supper'], 1)
+        self.assertEqual(self.summary(tomorrow)['confirmed'], 1)
+
+    def test_rebuild_command(self):
+        """The rebuild command repairs a drifted rollup"""
+        from django.core.management import call_command
+        from .models import DailyMealSummary
+        Meal.objects.create(student=self.student, date=self.today, away=True)
+        DailyMealSummary.objects.filter(date=self.today).update(away=42, confirmed=7)
+
+        call_command('rebuild_meal_summaries', stdout=StringIO())
+
+        self.assertEqual(self.summary(self.today)['away'], 1)
+        self.assertEqual(self.summary(self.today)['confirmed'], 1)
+
+class AwayModeTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='traveller', password='password123')
+        self.student = self.user.student_profile
+        self.client = Client()
+        self.client.login(username='traveller', password='password123')
+
+    def test_mark_away_is_constant_query(self):
+        """A 90-day away period is upserted in bulk, not day by day"""
+        from .meals import mark_away
+        start = date.today()
+        Meal.objects.create(student=self.student, date=start, breakfast=True, supper=True)
+
+        with self.assertNumQueries(5):
+            marked = mark_away(self.student, start, start + timedelta(days=89))
+
+        self.assertEqual(marked, 90)
+        self.assertEqual(Meal.objects.filter(student=self.student, away=True).count(), 90)
+        self.assertFalse(Meal.objects.filter(student=self.student, breakfast=True).exists())
+
+    def test_toggle_away_mode_view(self):
+        """Away Mode creates the period and flags every covered meal"""
+        from .models import AwayPeriod
+        start = date.today() + timedelta(days=1)
+        end = start + timedelta(days=13)
+        self.client.post('/student/toggle-away/', {'start_date': str(start), 'end_date': str(end)})
+
+        self.assertTrue(AwayPeriod.objects.filter(student=self.student, start_date=start, end_date=end).exists())
+        self.assertEqual(Meal.objects.filter(student=self.student, away=True).count(), 14)
+
+    def test_approved_leave_flags_meals(self):
+        """Approving a leave request marks the leave days as away"""
+        from .models import LeaveRequest
+        from .meal_stats import daily_meal_stats
+        start = date.today() + timedelta(days=2)
+        leave = LeaveRequest.objects.create(
+            student=self.student, start_date=start, end_date=start + timedelta(days=2), reason='Home'
+        )
+        User.objects.create_superuser(username='warden', password='password123')
+        admin_client = Client()
+        admin_client.login(username='warden', password='password123')
+
+        with patch('hms.notifications.notify_leave_request_status'):
+            admin_client.post(f'/manage/leave/approve/{leave.pk}/', {'status': 'approved', 'admin_notes': ''})
+
+        self.assertEqual(Meal.objects.filter(student=self.student, away=True).count(), 3)
+        self.assertEqual(daily_meal_stats(start, start)[start]['away'], 1)
+
+class StudentDashboardTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='password123')
+        self.student = self.user.student_profile
+        self.client = Client()
+        self.client.login(username='reader', password='password123')
+
+    def test_dashboard_does_not_write(self):
+        """Viewing the dashboard never creates or corrects meal rows"""
+        from .models import AwayPeriod, AuditLog
+        today = date.today()
+        AwayPeriod.objects.create(student=self.student, start_date=today, end_date=today)
+        Meal.objects.create(student=self.student, date=today, breakfast=True)
+        audit_rows = AuditLog.objects.count()
+
+        response = self.client.get('/student/dashboard/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['is_away_today'])
+        self.assertTrue(response.context['meal_today'].away)
+        self.assertFalse(response.context['meal_today'].breakfast)
+        self.assertIsNone(response.context['meal_tomorrow'].pk)
+        # The stored row is untouched and nothing new was written
+        self.assertTrue(Meal.objects.get(student=self.student, date=today).breakfast)
+        self.assertEqual(Meal.objects.filter(student=self.student).count(), 1)
+        self.assertEqual(AuditLog.objects.count(), audit_rows)
+
+    def test_resolver_query_count(self):
+        """Meal states for several days cost two reads"""
+        from .meals import resolve_meal_states
+        today = date.today()
+        with self.assertNumQueries(2):
+            meals, away_dates = resolve_meal_states(self.student, [today, today + timedelta(days=1)])
+        self.assertEqual(len(meals), 2)
+        self.assertEqual(away_dates, set())
+
+class AwayPeriodCoverageTest(TestCase):
+    def setUp(self):
+        self.today = date.today()
+        self.students = [
+            User.objects.create_user(username=f'cohort{i}', password='p').student_profile
+            for i in range(3)
+        ]
+
+    def test_cohort_lookups_are_single_queries(self):
+        """Who is away on D and which dates each student is away, one query each"""
+        from .models import AwayPeriod
+        AwayPeriod.objects.create(student=self.students[0], start_date=self.today, end_date=self.today + timedelta(days=3))
+        AwayPeriod.objects.create(student=self.students[1], start_date=self.today + timedelta(days=2), end_date=self.today + timedelta(days=5))
+
+        with self.assertNumQueries(1):
+            away_today = set(AwayPeriod.objects.students_away_on(self.today))
+        self.assertEqual(away_today, {self.students[0]})
+
+        dates = [self.today, self.today + timedelta(days=4)]
+        with self.assertNumQueries(1):
+            coverage = AwayPeriod.objects.away_dates(dates)
+        self.assertEqual(coverage, {self.students[0].pk: {self.today}, self.students[1].pk: {dates[1]}})
+
+        with self.assertNumQueries(1):
+            self.assertFalse(AwayPeriod.objects.filter(student=self.students[2]).covering_any(dates).exists())
+
+    def test_overlapping_periods_are_merged(self):
+        """New periods absorb overlapping and adjacent ones"""
+        from .models import AwayPeriod
+        from .meals import create_away_period
+        student = self.students[0]
+        create_away_period(student, self.today, self.today + timedelta(days=2))
+        create_away_period(student, self.today + timedelta(days=6), self.today + timedelta(days=8))
+        merged = create_away_period(student, self.today + timedelta(days=3), self.today + timedelta(days=6))
+
+        self.assertEqual(AwayPeriod.objects.filter(student=student).count(), 1)
+        self.assertEqual((merged.start_date, merged.end_date), (self.today, self.today + timedelta(days=8)))
+
+
+class HotQueryIndexTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='indexed', password='p')
+        self.staff = User.objects.create_user(username='indexstaff', password='p', is_staff=True)
+
+    def assertUsesIndex(self, queryset, index_name):
+        from django.db import connection
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plan assertions are written against SQLite')
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_hot_queries_use_indexes(self):
+        """Every hot filter on the dashboards resolves through a declared index"""
+        from .models import Message, Notification, Payment, MaintenanceRequest, LeaveRequest, Visitor
+        today = date.today()
+
+        self.assertUsesIndex(Meal.objects.filter(date=today, away=False), 'hms_meal_date_away_idx')
+        self.assertUsesIndex(Message.objects.filter(conversation=1, id__gt=10).order_by('id'), 'hms_msg_conv_idx')
+        self.assertUsesIndex(Message.objects.filter(conversation=1, id__lt=10).order_by('-id'), 'hms_msg_conv_idx')
+        self.assertUsesIndex(Notification.objects.filter(user=self.user, is_read=False), 'hms_notif_unread_idx')
+        self.assertUsesIndex(Notification.objects.filter(user=self.user).order_by('-created_at'), 'hms_notif_user_idx')
+        self.assertUsesIndex(Payment.objects.filter(checkout_request_id='ws_CO_1'), 'hms_payment_checkout_idx')
+        self.assertUsesIndex(MaintenanceRequest.objects.filter(status='pending'), 'hms_maint_pending_idx')
+        self.assertUsesIndex(LeaveRequest.objects.filter(status='pending'), 'hms_leave_pending_idx')
+        self.assertUsesIndex(
+            LeaveRequest.objects.filter(status='approved', start_date__lte=today, end_date__gte=today),
+            'hms_leave_approved_idx'
+        )
+        self.assertUsesIndex(Visitor.objects.filter(is_active=True), 'hms_visitor_active_idx')
+
+
+class MealExportTest(TestCase):
+    def setUp(self):
+        self.today = date.today()
+        self.staff = User.objects.create_user(username='bursar', password='p', is_staff=True)
+        self.client.login(username='bursar', password='p')
+        for i, name in enumerate(['Amina', 'Brian']):
+            student = User.objects.create_user(username=f'export{i}', password='p', first_name=name, last_name='Otieno').student_profile
+            student.university_id = f'U{i}'
+            student.save()
+            for offset in range(3):
+                Meal.objects.create(student=student, date=self.today - timedelta(days=offset), breakfast=True, supper=bool(i))
+
+    def test_csv_streams_range_with_student_totals(self):
+        """Range export streams every meal row followed by per-student and overall totals"""
+        start = self.today - timedelta(days=2)
+        response = self.client.get('/kitchen/export-csv/', {'start': start.isoformat(), 'end': self.today.isoformat()})
+        self.assertTrue(response.streaming)
+        self.assertIn(f'meals_{start}_to_{self.today}.csv', response['Content-Disposition'])
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'Date,Name,University ID,Breakfast,Early,Supper,Away,Phone')
+        self.assertEqual(len([line for line in lines if line.startswith(str(self.today.year))]), 6)
+        self.assertIn(f'{start},Amina Otieno,U0,Yes,No,No,No,', lines)
+        self.assertIn('U0,Amina Otieno,3,3,0,0,0', lines)
+        self.assertIn('U1,Brian Otieno,3,3,0,3,0', lines)
+        self.assertEqual(lines[-1], 'Totals,,6 confirmed,6,0,3,0,')
+
+    def test_legacy_date_parameter_exports_one_day(self):
+        response = self.client.get('/kitchen/export-csv/', {'date': self.today.isoformat()})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len([line for line in lines if line.startswith(str(self.today.year))]), 2)
+        self.assertEqual(lines[-1], 'Totals,,2 confirmed,2,0,1,0,')
+
+    def test_xlsx_export(self):
+        import io, zipfile
+        response = self.client.get('/kitchen/export-xlsx/', {'start': (self.today - timedelta(days=2)).isoformat()})
+        self.assertEqual(response.status_code, 200)
+        workbook = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIn('xl/worksheets/sheet2.xml', workbook.namelist())
+
+    async def test_exports_stream_asynchronously_under_asgi(self):
+        """Under ASGI the content is an async iterator, so Django does not buffer it"""
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get('/kitchen/export-csv/', {'date': self.today.isoformat()})
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(b''.join(chunks).decode().splitlines()[-1], 'Totals,,2 confirmed,2,0,1,0,')
+
+        response = await self.async_client.get('/kitchen/export-xlsx/')
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(body), int(response['Content-Length']))
+
+
+class NotificationOutboxTest(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='warden', password='p', email='warden@example.com', is_staff=True)
+        for i in range(3):
+            student = User.objects.create_user(username=f'outbox{i}', password='p', email=f'outbox{i}@example.com').student_profile
+            student.phone = f'+25470000000{i}'
+            student.save()
+
+    def test_announcement_only_enqueues(self):
+        """Creating an announcement queues messages instead of sending them in the request"""
+        from django.core import mail
+        from .models import OutboundNotification
+        self.client.login(username='warden', password='p')
+        response = self.client.post('/manage/announcements/create/', {
+            'title': 'Water outage', 'content': 'No water tonight', 'priority': 'urgent', 'is_active': 'on'
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+
+        students = Student.objects.count()
+        self.assertEqual(OutboundNotification.objects.filter(channel='email', status='pending').count(), students)
+        self.assertEqual(OutboundNotification.objects.filter(channel='sms').count(), 3)
+
+    def test_worker_delivers_and_marks_sent(self):
+        from django.core import mail
+        from .models import OutboundNotification
+        from .outbox import enqueue_email, process_outbox
+        enqueue_email(['a@example.com', 'b@example.com'], 'Hello', 'Body', source='test')
+
+        totals = process_outbox(batch_size=1)
+        self.assertEqual(totals, {'sent': 2, 'retrying': 0, 'failed': 0})
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertFalse(OutboundNotification.objects.exclude(status='sent').exists())
+
+    def test_failures_back_off_then_fail(self):
+        from .models import OutboundNotification
+        from .outbox import enqueue_email, process_outbox
+        enqueue_email('a@example.com', 'Hello', 'Body')
+
+        with self.settings(NOTIFICATION_MAX_ATTEMPTS=2), patch('hms.outbox.deliver_emails', side_effect=lambda items, limiter=None: [False] * len(items)):
+            self.assertEqual(process_outbox()['retrying'], 1)
+            item = OutboundNotification.objects.get()
+            self.assertEqual((item.status, item.attempts), ('pending', 1))
+            self.assertGreater(item.next_attempt_at, timezone.now())
+
+            # Not due yet, so a second pass finds nothing
+            self.assertEqual(process_outbox()['retrying'], 0)
+
+            OutboundNotification.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(process_outbox()['failed'], 1)
+            self.assertEqual(OutboundNotification.objects.get().status, 'failed')
+
+    def test_rate_limiter_spaces_sends(self):
+        from .outbox import RateLimiter
+        now = [0.0]
+        slept = []
+        def sleep(seconds):
+            slept.append(seconds)
+            now[0] += seconds
+        limiter = RateLimiter(4, clock=lambda: now[0], sleep=sleep)
+        for _ in range(3):
+            limiter.wait()
+        self.assertEqual(slept, [0.25, 0.25])
+
+
+class CountingEmailBackend(LocmemEmailBackend):
+    """Local SMTP stand-in that opens a session per send_messages call unless
+    already connected, like the SMTP backend, and counts the sessions"""
+    opened = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connected = False
+
+    def open(self):
+        if self.connected:
+            return False
+        CountingEmailBackend.opened += 1
+        self.connected = True
+        return True
+
+    def close(self):
+        self.connected = False
+
+    def send_messages(self, messages):
+        new_session = self.open()
+        try:
+            if any('bounce@example.com' in message.to for message in messages):
+                raise OSError('mailbox unavailable')
+            return super().send_messages(messages)
+        finally:
+            if new_session:
+                self.close()
+
+
+class BulkEmailTest(TestCase):
+    def setUp(self):
+        CountingEmailBackend.opened = 0
+
+    def test_connections_drop_from_n_to_n_over_batch(self):
+        """N single sends open N connections; the bulk API opens one per batch"""
+        from django.core import mail
+        from .notifications import NotificationService
+        messages = [(f'student{i}@example.com', 'Reminder', 'Confirm your meals', None) for i in range(20)]
+
+        with self.settings(EMAIL_BACKEND='hms.tests.CountingEmailBackend'):
+            for to_email, subject, body, html in messages:
+                NotificationService.send_email(to_email, subject, body)
+            single = CountingEmailBackend.opened
+
+            CountingEmailBackend.opened = 0
+            outcomes = NotificationService.send_bulk_email(messages, batch_size=10)
+
+        self.assertEqual(single, 20)
+        self.assertEqual(CountingEmailBackend.opened, 2)
+        self.assertEqual(len(mail.outbox), 40)
+        self.assertTrue(all(sent for _, sent in outcomes))
+
+    def test_per_recipient_outcomes(self):
+        from .notifications import NotificationService
+        messages = [
+            ('ok@example.com', 'Hi', 'Body', '<p>Body</p>'),
+            ('bounce@example.com', 'Hi', 'Body', None),
+            ('ok2@example.com', 'Hi', 'Body', None),
+        ]
+        with self.settings(EMAIL_BACKEND='hms.tests.CountingEmailBackend'):
+            outcomes = NotificationService.send_bulk_email(messages)
+        self.assertEqual(outcomes, [('ok@example.com', True), ('bounce@example.com', False), ('ok2@example.com', True)])
+
+    def test_unconfirmed_alert_goes_through_bulk_api(self):
+        from django.conf import settings
+        from django.core import mail
+        User.objects.create_user(username='hungry', password='p', first_name='Hungry', email='hungry@example.com')
+        User.objects.create_user(username='matron', password='p', is_staff=True)
+        self.client.login(username='matron', password='p')
+
+        with self.settings(EMAIL_BACKEND='hms.tests.CountingEmailBackend'):
+            self.client.get('/kitchen/send-notifications/')
+        self.assertEqual(CountingEmailBackend.opened, 1)
+        self.assertEqual(mail.outbox[0].to, [settings.ADMIN_EMAIL])
+        self.assertIn('Hungry (', mail.outbox[0].body)
+
+
+class SMSDispatcherTest(TestCase):
+    def test_multi_recipient_requests_and_outcomes(self):
+        """Shared texts become multi-recipient requests; outcomes keep input order"""
+        from .sms import FakeGateway, SMSDispatcher
+        gateway = FakeGateway(max_recipients=100, failing={'+254700000007'})
+        dispatcher = SMSDispatcher(gateway, max_workers=4)
+        phones = [f'+2547{i:08d}' for i in range(250)]
+
+        outcomes = dispatcher.send_many([(phone, 'Water outage') for phone in phones] + [('+254799999999', 'Other')])
+        dispatcher.shutdown()
+
+        self.assertEqual(len(gateway.requests), 4)
+        self.assertEqual([phone for phone, _ in outcomes], phones + ['+254799999999'])
+        self.assertEqual([phone for phone, sent in outcomes if not sent], ['+254700000007'])
+
+    def test_africastalking_results_match_local_numbers(self):
+        """Local 07... numbers go out in E.164 and still get their results"""
+        from unittest.mock import MagicMock
+        from .sms import AfricasTalkingProvider
+        provider = AfricasTalkingProvider.__new__(AfricasTalkingProvider)
+        provider.country_code = '254'
+        provider.sms = MagicMock()
+        provider.sms.send.return_value = {'SMSMessageData': {'Recipients': [
+            {'number': '+254712345678', 'status': 'Success'},
+            {'number': '+254722000000', 'status': 'InvalidPhoneNumber'},
+        ]}}
+
+        results = provider.send('Hi', ['0712 345 678', '254722000000', '+254733000000'])
+
+        provider.sms.send.assert_called_once_with('Hi', ['+254712345678', '+254722000000', '+254733000000'])
+        self.assertEqual(results, {'0712 345 678': True, '254722000000': False, '+254733000000': False})
+
+    def test_requests_run_concurrently(self):
+        from .sms import FakeGateway, SMSDispatcher
+        gateway = FakeGateway(max_recipients=10, latency=0.05)
+        dispatcher = SMSDispatcher(gateway, max_workers=4)
+        dispatcher.send('Hi', [f'+2547{i:08d}' for i in range(80)])
+        dispatcher.shutdown()
+        self.assertEqual(len(gateway.requests), 8)
+        self.assertGreater(gateway.peak_concurrency, 1)
+        self.assertLessEqual(gateway.peak_concurrency, 4)
+
+    def test_service_reuses_one_provider(self):
+        """NotificationService sends through a cached process-wide dispatcher"""
+        from .notifications import NotificationService
+        from .sms import get_dispatcher, reset_dispatcher
+        with self.settings(SMS_ENABLED=True, SMS_PROVIDER='fake'):
+            reset_dispatcher()
+            try:
+                self.assertTrue(NotificationService.send_sms('+254700000001', 'One'))
+                NotificationService.send_bulk_sms([('+254700000002', 'Two'), ('+254700000003', 'Two')])
+                gateway = get_dispatcher().provider
+                self.assertEqual(gateway.requests, [('One', ['+254700000001']), ('Two', ['+254700000002', '+254700000003'])])
+            finally:
+                reset_dispatcher()
+
+    def test_disabled_sms_reports_failures(self):
+        from .notifications import NotificationService
+        with self.settings(SMS_ENABLED=False):
+            self.assertFalse(NotificationService.send_sms('+254700000001', 'One'))
+
+
+class UnconfirmedCohortTest(TestCase):
+    def setUp(self):
+        self.tomorrow = date.today() + timedelta(days=1)
+        self.students = []
+        for i in range(5):
+            user = User.objects.create_user(username=f'cohort{i}', password='p', first_name=f'S{i}', email=f's{i}@example.com')
+            self.students.append(user.student_profile)
+
+    def test_skips_confirmed_away_and_on_leave(self):
+        """One query; confirmed, away and approved-leave students are excluded"""
+        from .models import AwayPeriod, LeaveRequest
+        Meal.objects.create(student=self.students[0], date=self.tomorrow, supper=True)
+        AwayPeriod.objects.create(student=self.students[1], start_date=date.today(), end_date=self.tomorrow)
+        leave = dict(leave_type='home', reason='Family visit', destination='Nairobi',
+                     start_date=self.tomorrow, end_date=self.tomorrow)
+        LeaveRequest.objects.create(student=self.students[2], status='approved', **leave)
+        LeaveRequest.objects.create(student=self.students[3], status='pending', **leave)
+
+        with self.assertNumQueries(1):
+            rows = list(Student.objects.unconfirmed_for(self.tomorrow).contacts().iterator(chunk_size=2))
+        self.assertEqual([row.first_name for row in rows], ['S3', 'S4'])
+        self.assertEqual(rows[0].email, 's3@example.com')
+
+    def test_bulk_reminders_use_cohort(self):
+        from django.core import mail
+        from .notifications import send_bulk_meal_reminders
+        Meal.objects.create(student=self.students[0], date=self.tomorrow, supper=True)
+        sent, total = send_bulk_meal_reminders()
+        self.assertEqual((sent, total), (4, 4))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), [f's{i}@example.com' for i in range(1, 5)])
+        self.assertIn('Dear S1,', [m for m in mail.outbox if m.to == ['s1@example.com']][0].body)
+
+
+class MealReminderCommandTest(TestCase):
+    def setUp(self):
+        self.students = [User.objects.create_user(username=f'diner{i}', password='p').student_profile for i in range(5)]
+
+    def run_command(self, *args):
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('send_meal_reminders', '--meal', 'Lunch', *args, stdout=out)
+        return out.getvalue()
+
+    def test_bulk_idempotent_and_skips_away(self):
+        """Batched inserts, re-runs are no-ops and away students are skipped"""
+        from .models import AwayPeriod, Notification
+        AwayPeriod.objects.create(student=self.students[0], start_date=date.today(), end_date=date.today())
+
+        # cohort read + (user lock, dedupe check, insert, counter insert + update) per batch
+        with self.assertNumQueries(1 + 2 * 5):
+            output = self.run_command('--batch-size', '3')
+        self.assertIn('Successfully sent 4 Lunch reminders (0 already sent)', output)
+        self.assertEqual(Notification.objects.count(), 4)
+        self.assertEqual(self.students[1].user.unread_counter.notifications, 1)
+        self.assertFalse(Notification.objects.filter(user=self.students[0].user).exists())
+
+        output = self.run_command()
+        self.assertIn('sent 0 Lunch reminders (4 already sent)', output)
+        self.assertEqual(Notification.objects.count(), 4)
+
+    def test_counts_and_pushes_only_reminders_it_inserted(self):
+        from .models import Notification
+        # Inserted by a run that committed first
+        user = self.students[2].user
+        Notification.objects.create(user=user, title='Lunch', message='',
+                                    dedupe_key=f'meal-reminder:{date.today()}:lunch:{user.pk}')
+
+        with patch('hms.management.commands.send_meal_reminders.publish_bulk_notifications') as publish:
+            output = self.run_command()
+        self.assertIn('sent 4 Lunch reminders (1 already sent)', output)
+        self.assertNotIn(user.pk, publish.call_args.args[0])
+        self.assertEqual(len(publish.call_args.args[0]), 4)
+        # Counted once, by the post_save of the earlier insert
+        self.assertEqual(User.objects.get(pk=user.pk).unread_counter.notifications, 1)
+
+    def test_dry_run_writes_nothing(self):
+        from .models import Notification
+        output = self.run_command('--dry-run')
+        self.assertIn('Would send 5 Lunch reminders', output)
+        self.assertFalse(Notification.objects.exists())
+
+
+class NotificationStreamTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', password='p')
+
+    def test_wsgi_clients_are_told_not_to_reconnect(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/notifications/stream/')
+        self.assertEqual(response.status_code, 204)
+
+    async def test_stream_pushes_new_notifications(self):
+        """The ASGI stream sends the unread count, then each new notification"""
+        import asyncio
+        from asgiref.sync import sync_to_async
+        from django.test import AsyncClient
+        from .models import Notification
+
+        await Notification.objects.acreate(user=self.user, title='Old', message='Earlier')
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        response = await client.get('/notifications/stream/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content.__aiter__()
+
+        first = await asyncio.wait_for(stream.__anext__(), 5)
+        self.assertEqual(first.decode() if isinstance(first, bytes) else first, 'event: unread\ndata: {"unread": 1}\n\n')
+
+        def notify():
+            with self.captureOnCommitCallbacks(execute=True):
+                Notification.objects.create(user=self.user, title='Payment received', message='KES 5,000')
+        await sync_to_async(notify)()
+
+        pushed = await asyncio.wait_for(stream.__anext__(), 5)
+        pushed = pushed.decode() if isinstance(pushed, bytes) else pushed
+        self.assertTrue(pushed.startswith('event: notification\n'))
+        self.assertIn('"title": "Payment received"', pushed)
+        self.assertIn('"unread": 2', pushed)
+        await stream.aclose()
+
+    async def test_broker_delivers_across_threads(self):
+        import asyncio
+        import threading
+        from .realtime import InProcessBroker
+        broker = InProcessBroker()
+        subscription = broker.subscribe('user:1')
+        other = broker.subscribe('user:2')
+
+        thread = threading.Thread(target=broker.publish, args=(['user:1'], {'type': 'ping'}))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(await asyncio.wait_for(subscription.get(), 1), {'type': 'ping'})
+        self.assertTrue(other.queue.empty())
+        subscription.close()
+        other.close()
+        self.assertEqual(broker.subscriber_count(), 0)
+
+    def test_broker_follows_database_unless_set(self):
+        from .realtime import broker_path
+        with self.settings(REALTIME_BROKER=None):
+            self.assertEqual(broker_path(), 'hms.realtime.InProcessBroker')
+            with patch('hms.realtime.connection') as connection:
+                connection.vendor = 'postgresql'
+                self.assertEqual(broker_path(), 'hms.realtime.PostgresBroker')
+                with self.settings(REALTIME_BROKER='hms.realtime.InProcessBroker'):
+                    self.assertEqual(broker_path(), 'hms.realtime.InProcessBroker')
+
+    def test_postgres_payloads_fit_notify_limit(self):
+        from .realtime import PostgresBroker
+        broker = PostgresBroker()
+        channels = [f'user:{i}' for i in range(3000)]
+        payloads = list(broker._payloads(channels, {'type': 'notification', 'title': 'Lunch'}))
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(payload.encode()) <= broker.max_payload for payload in payloads))
+
+
+class UnreadCounterTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='warden', password='p', is_staff=True)
+        self.student = User.objects.create_user(username='resident', password='p')
+
+    def counts(self, user):
+        from .unread import counts_for
+        return counts_for(user)
+
+    def test_counters_follow_send_read_and_delete(self):
+        from .chat import conversation_for, mark_read
+        from .models import Message, Notification
+        from .unread import mark_notifications_read
+        self.assertEqual(self.counts(self.student), {'messages': 0, 'notifications': 0})
+
+        sent = [Message.objects.create(sender=self.admin, recipient=self.student, content=text)
+                for text in ('Hi', 'Rent is due', 'Gate closes at 10')]
+        notes = [Notification.objects.create(user=self.student, title=f'N{i}', message='m') for i in range(3)]
+        self.assertEqual(self.counts(self.student), {'messages': 3, 'notifications': 3})
+
+        sent[0].delete()
+        notes[0].delete()
+        self.assertEqual(mark_notifications_read(self.student, [notes[1].pk]), 1)
+        conversation = conversation_for(self.student)
+        self.assertEqual(mark_read(conversation, self.student), 2)
+        self.assertEqual(mark_read(conversation, self.student), 0)
+        self.assertEqual(self.counts(self.student), {'messages': 0, 'notifications': 1})
+
+    def test_badges_come_from_context_processor(self):
+        from .models import Message
+        Message.objects.create(sender=self.student, recipient=self.admin, content='Tap is leaking')
+        self.client.force_login(self.admin)
+
+        response = self.client.get('/chat/')
+        self.assertEqual(response.context['unread_counts']['messages'], 1)
+        unread_by_user = {s.user_id: s.unread_count for s in response.context['students']}
+        self.assertEqual(unread_by_user[self.student.pk], 1)
+
+        # Opening the conversation marks it read
+        self.client.get(f'/chat/{self.student.pk}/')
+        self.assertEqual(self.counts(self.admin)['messages'], 0)
+
+    def test_mark_notifications_read_endpoint(self):
+        from .models import Notification
+        Notification.objects.create(user=self.student, title='Lunch', message='m')
+        self.client.force_login(self.student)
+        self.assertEqual(self.client.get('/notifications/read/').status_code, 405)
+        response = self.client.post('/notifications/read/')
+        self.assertEqual(response.json(), {'marked': 1, 'unread': 0})
+
+    def test_reconcile_repairs_drift(self):
+        from django.core.management import call_command
+        from .models import Conversation, Message, Notification, UnreadCounter
+        Message.objects.create(sender=self.student, content='Hi')
+        Notification.objects.create(user=self.admin, title='T', message='m')
+        # Writes that bypass signals leave the counters stale
+        Conversation.objects.update(staff_unread=0, student_unread=4)
+        Notification.objects.bulk_create([Notification(user=self.student, title='B', message='m')])
+        UnreadCounter.objects.filter(pk=self.admin.pk).update(notifications=7)
+
+        out = StringIO()
+        call_command('reconcile_unread_counters', stdout=out)
+        self.assertIn('Repaired unread counters for 2 users', out.getvalue())
+        self.assertEqual(self.counts(self.student), {'messages': 0, 'notifications': 1})
+        self.assertEqual(self.counts(self.admin), {'messages': 1, 'notifications': 1})
+        self.assertEqual(Conversation.objects.values_list('staff_unread', 'student_unread').get(), (1, 0))
+
+
+class ChatInboxTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='warden', password='p', is_staff=True)
+        self.client.force_login(self.admin)
+
+    def add_students(self, count):
+        from .models import Message
+        start = User.objects.count()
+        users = [User.objects.create_user(username=f'inbox{start + i}', password='p') for i in range(count)]
+        for user in users:
+            Message.objects.create(sender=user, recipient=self.admin, content='Hello warden')
+        return users
+
+    def inbox_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/chat/')
+            list(response.context['students'])
+        return len(queries)
+
+    def test_inbox_annotations_and_order(self):
+        from .models import Message
+        quiet, chatty = self.add_students(2)
+        Message.objects.create(sender=self.admin, recipient=quiet, content='x' * 200)
+        Message.objects.create(sender=chatty, recipient=self.admin, content='Water is off again')
+        Message.objects.create(sender=self.admin, recipient=chatty, content='Plumber is on the way')
+        silent = User.objects.create_user(username='silent', password='p')
+
+        rows = list(self.client.get('/chat/').context['students'])
+        self.assertEqual([row.user for row in rows], [chatty, quiet, silent])
+        self.assertEqual([row.unread_count for row in rows], [2, 1, 0])
+        self.assertEqual(rows[0].last_message_preview, 'Plumber is on the way')
+        self.assertEqual(len(rows[1].last_message_preview), 80)
+        self.assertIsNone(rows[2].last_message_at)
+
+    def test_query_count_is_constant(self):
+        self.add_students(2)
+        baseline = self.inbox_queries()
+        self.add_students(30)
+        self.assertEqual(self.inbox_queries(), baseline)
+
+    def test_inbox_is_paginated(self):
+        from .views import CHAT_INBOX_PAGE_SIZE
+        self.add_students(CHAT_INBOX_PAGE_SIZE + 1)
+        page = self.client.get('/chat/', {'page': 2}).context['students']
+        self.assertEqual(len(page), 1)
+        self.assertEqual(page.paginator.count, CHAT_INBOX_PAGE_SIZE + 1)
+
+
+class ChatMessageApiTest(TestCase):
+    def setUp(self):
+        from .chat import conversation_for
+        from .models import Message
+        self.admin = User.objects.create_user(username='warden', password='p', is_staff=True)
+        self.student = User.objects.create_user(username='talker', password='p')
+        conversation = conversation_for(self.student)
+        Message.objects.bulk_create([
+            Message(conversation=conversation, sender=self.student if i % 2 else self.admin,
+                    recipient=self.admin if i % 2 else self.student, content=f'm{i}')
+            for i in range(60)
+        ])
+        self.ids = list(Message.objects.order_by('id').values_list('id', flat=True))
+
+    def test_page_loads_only_latest_messages(self):
+        from .views import CHAT_PAGE_SIZE
+        self.client.force_login(self.student)
+        response = self.client.get('/chat/')
+        self.assertEqual([m.pk for m in response.context['messages']], self.ids[-CHAT_PAGE_SIZE:])
+        self.assertTrue(response.context['has_older'])
+
+    def test_cursors(self):
+        self.client.force_login(self.admin)
+        url = f'/chat/{self.student.pk}/messages/'
+
+        older = self.client.get(url, {'before': self.ids[-50]}).json()
+        self.assertEqual([m['id'] for m in older['messages']], self.ids[:10])
+        self.assertFalse(older['has_more'])
+
+        newer = self.client.get(url, {'after': self.ids[-3]}).json()
+        self.assertEqual([m['id'] for m in newer['messages']], self.ids[-2:])
+        self.assertEqual(newer['messages'][-1]['mine'], False)
+        self.assertEqual(self.client.get(url, {'after': 'x'}).status_code, 400)
+
+    def test_post_returns_message_for_polling_clients(self):
+        self.client.force_login(self.student)
+        response = self.client.post('/chat/messages/', {'content': 'Is the gate open?'})
+        self.assertEqual(response.status_code, 201)
+        sent = response.json()['message']
+        self.assertTrue(sent['mine'])
+
+        self.client.force_login(self.admin)
+        polled = self.client.get(f'/chat/{self.student.pk}/messages/', {'after': self.ids[-1]}).json()
+        self.assertEqual([m['content'] for m in polled['messages']], ['Is the gate open?'])
+        self.assertEqual(self.client.post('/chat/messages/', {'content': ''}).status_code, 404)
+
+
+class ConversationTest(TestCase):
+    def setUp(self):
+        self.warden = User.objects.create_user(username='warden', password='p', is_staff=True)
+        self.matron = User.objects.create_user(username='matron', password='p', is_staff=True)
+        self.student = User.objects.create_user(username='boarder', password='p')
+
+    def test_student_messages_reach_shared_staff_inbox(self):
+        from .models import Conversation
+        from .unread import counts_for
+        self.client.force_login(self.student)
+        self.client.post('/chat/messages/', {'content': 'My key is lost'})
+
+        conversation = Conversation.objects.get(student=self.student)
+        message = conversation.messages.get()
+        self.assertIsNone(message.recipient)
+        self.assertEqual(conversation.last_message_preview, 'My key is lost')
+        self.assertEqual(conversation.staff_unread, 1)
+        self.assertEqual([counts_for(u)['messages'] for u in (self.warden, self.matron)], [1, 1])
+
+        # Any staff member can reply, and reading clears the inbox for all of them
+        self.client.force_login(self.matron)
+        self.client.get(f'/chat/{self.student.pk}/')
+        self.client.post(f'/chat/{self.student.pk}/messages/', {'content': 'Collect a spare at the office'})
+        self.assertEqual([counts_for(u)['messages'] for u in (self.warden, self.matron)], [0, 0])
+        self.assertEqual(counts_for(self.student)['messages'], 1)
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.staff_read_id, message.pk)
+        self.assertEqual(conversation.last_message_preview, 'Collect a spare at the office')
+
+    def test_viewing_is_read_only_and_limited_to_students(self):
+        from .models import Conversation
+        self.client.force_login(self.warden)
+        self.assertEqual(self.client.get(f'/chat/{self.matron.pk}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/chat/{self.matron.pk}/messages/').status_code, 404)
+
+        response = self.client.get(f'/chat/{self.student.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['chat_open'])
+        self.assertEqual(self.client.get(f'/chat/{self.student.pk}/messages/').json(),
+                         {'messages': [], 'has_more': False})
+        self.assertFalse(Conversation.objects.exists())
+
+        # The first message creates the conversation
+        self.client.post(f'/chat/{self.student.pk}/', {'content': 'Welcome to the hostel'})
+        self.assertEqual(Conversation.objects.get().student, self.student)
+
+    def test_mark_read_is_constant_query(self):
+        from .chat import conversation_for, mark_read
+        from .models import Message
+        conversation = conversation_for(self.student)
+        Message.objects.bulk_create([
+            Message(conversation=conversation, sender=self.student, content=f'm{i}') for i in range(40)
+        ])
+        conversation.staff_unread = 40
+        conversation.save()
+
+        # lock + cursor update + staff list + counter upsert and update
+        with self.assertNumQueries(5):
+            self.assertEqual(mark_read(conversation, self.warden), 40)
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.staff_read_id, conversation.messages.order_by('-id').first().pk)
+        self.assertEqual(conversation.staff_unread, 0)
+
+
+class AuditContextTest(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='auditor', password='p', is_staff=True)
+        self.students = [User.objects.create_user(username=f'actor{i}', password='p') for i in range(2)]
+
+    def test_actor_is_reset_after_request(self):
+        from .middleware import get_current_actor
+        from .models import AuditLog
+        self.client.force_login(self.students[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/chat/messages/', {'content': 'Hello'})
+
+        self.assertIsNone(get_current_actor())
+        self.assertTrue(AuditLog.objects.filter(model_name='Message', user=self.students[0]).exists())
+
+    def test_system_actor_for_background_jobs(self):
+        from .middleware import audit_actor, get_current_user
+        from .models import AuditLog, Announcement
+        with audit_actor('nightly-import') as actor, self.captureOnCommitCallbacks(execute=True):
+            self.assertIsNone(get_current_user())
+            Announcement.objects.create(title='Water outage', content='Tomorrow 9-11am', created_by=self.staff)
+        self.assertEqual(str(actor), 'nightly-import')
+
+        entry = AuditLog.objects.get(model_name='Announcement')
+        self.assertIsNone(entry.user)
+        self.assertEqual(entry.actor, 'nightly-import')
+
+    async def test_async_middleware_isolates_interleaved_requests(self):
+        """Each request sees its own user even when their handlers interleave on one event loop"""
+        import asyncio
+        from types import SimpleNamespace
+        from .middleware import AuditMiddleware, get_current_user
+
+        seen = {}
+
+        async def view(request):
+            await asyncio.sleep(0.01)
+            seen[request.name] = get_current_user()
+            return request.name
+
+        middleware = AuditMiddleware(view)
+        requests = [SimpleNamespace(name=user.username, user=user) for user in self.students]
+        await asyncio.gather(*(middleware(request) for request in requests))
+
+        self.assertEqual(seen, {user.username: user for user in self.students})
+        self.assertIsNone(get_current_user())
+
+
+class AuditConcurrencyTest(TransactionTestCase):
+    """Real commits, so buffered audit entries are written as in production"""
+
+    def setUp(self):
+        self.students = [User.objects.create_user(username=f'actor{i}', password='p') for i in range(2)]
+
+    async def test_concurrent_asgi_requests_audit_their_own_users(self):
+        import asyncio
+        from django.test import AsyncClient
+        from .models import AuditLog
+
+        clients = []
+        for user in self.students:
+            client = AsyncClient()
+            await client.aforce_login(user)
+            clients.append(client)
+
+        responses = await asyncio.gather(*(
+            client.post('/chat/messages/', {'content': f'from {user.username}'})
+            for client, user in zip(clients, self.students)
+        ))
+        self.assertEqual([r.status_code for r in responses], [201, 201])
+
+        authors = {
+            entry.object_repr: entry.user_id
+            async for entry in AuditLog.objects.filter(model_name='Message')
+        }
+        self.assertEqual(sorted(authors.values()), sorted(user.pk for user in self.students))
+
+
+class AuditBufferTest(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='registrar', password='p', is_staff=True)
+        self.student = self.staff.student_profile
+
+    def audit_inserts(self, queries):
+        return [q for q in queries if q['sql'].startswith('INSERT INTO "hms_auditlog"')]
+
+    def test_buffer_writes_one_batch_after_commit(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .audit import audit_buffer
+        from .middleware import audit_actor
+        from .models import Announcement, AuditLog
+
+        with audit_actor(self.staff), CaptureQueriesContext(connection) as queries:
+            with audit_buffer(), self.captureOnCommitCallbacks(execute=True):
+                for i in range(3):
+                    Announcement.objects.create(title=f'A{i}', content='c', created_by=self.staff)
+                self.assertFalse(AuditLog.objects.exists())
+
+        self.assertEqual(len(self.audit_inserts(queries)), 1)
+        self.assertEqual(AuditLog.objects.filter(user=self.staff, action='CREATE').count(), 3)
+
+    def test_rolled_back_changes_are_not_audited(self):
+        from django.db import IntegrityError, transaction
+        from .audit import audit_buffer
+        from .middleware import audit_actor
+        from .models import Announcement, AuditLog, Room
+
+        with audit_actor(self.staff), audit_buffer(), self.captureOnCommitCallbacks(execute=True):
+            Announcement.objects.create(title='Kept', content='c', created_by=self.staff)
+            try:
+                with transaction.atomic():
+                    Room.objects.create(room_number='R1', floor=1)
+                    Room.objects.create(room_number='R1', floor=1)
+            except IntegrityError:
+                pass
+
+        self.assertEqual(list(AuditLog.objects.values_list('model_name', flat=True)), ['Announcement'])
+
+    def test_allowlist_skips_high_volume_models(self):
+        from .middleware import audit_actor
+        from .models import AuditLog, Notification, Announcement
+        with self.settings(AUDIT_LOG_MODELS=['hms.Meal']), audit_actor(self.staff), \
+                self.captureOnCommitCallbacks(execute=True):
+            Meal.objects.create(student=self.student, date=date.today())
+            Notification.objects.create(user=self.staff, title='t', message='m')
+            Announcement.objects.create(title='A', content='c', created_by=self.staff)
+
+        self.assertEqual(list(AuditLog.objects.values_list('model_name', flat=True)), ['Meal'])
+
+
+class AuditDiffTest(TestCase):
+    def setUp(self):
+        from .models import Room
+        self.staff = User.objects.create_user(username='registrar', password='p', is_staff=True)
+        self.room = Room.objects.create(room_number='D1', floor=1, capacity=2)
+
+    def test_update_diff_is_computed_without_reloading(self):
+        from .middleware import audit_actor
+        from .models import AuditLog, Room
+
+        room = Room.objects.get(pk=self.room.pk)
+        room.capacity = 3
+        room.block = 'East'
+        with audit_actor(self.staff), self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertNumQueries(1):  # the UPDATE only
+                room.save()
+        self.assertEqual(len(callbacks), 1)
+
+        entry = AuditLog.objects.get(action='UPDATE')
+        self.assertEqual(entry.diff, {'capacity': [2, 3], 'block': ['', 'East']})
+        self.assertEqual(entry.changes, 'UPDATE on Room: block, capacity')
+
+        # The snapshot follows the save, so the next diff starts from 3
+        room.capacity = 4
+        with audit_actor(self.staff), self.captureOnCommitCallbacks(execute=True):
+            room.save()
+        self.assertEqual(AuditLog.objects.filter(action='UPDATE').first().diff, {'capacity': [3, 4]})
+
+    def test_unchanged_save_is_not_audited(self):
+        from .middleware import audit_actor
+        from .models import AuditLog, Room
+
+        room = Room.objects.get(pk=self.room.pk)
+        with audit_actor(self.staff), self.captureOnCommitCallbacks(execute=True):
+            room.save()
+            room.amenities = 'AC'
+            room.capacity = 5
+            room.save(update_fields=['amenities'])
+
+        entry = AuditLog.objects.get()
+        self.assertEqual(entry.diff, {'amenities': ['', 'AC']})
+
+    def test_create_and_delete_record_full_values(self):
+        from .middleware import audit_actor
+        from .models import AuditLog, Room
+
+        with audit_actor('housekeeping'), self.captureOnCommitCallbacks(execute=True):
+            room = Room.objects.create(room_number='D2', floor=2)
+            room.delete()
+
+        created = AuditLog.objects.get(action='CREATE')
+        deleted = AuditLog.objects.get(action='DELETE')
+        self.assertEqual(created.diff['room_number'], [None, 'D2'])
+        self.assertEqual(deleted.diff['floor'], [2, None])
+        self.assertNotIn('updated_at', created.diff)
+
+    def test_query_api(self):
+        from .middleware import audit_actor
+        from .models import AuditLog, Room
+
+        with audit_actor(self.staff), self.captureOnCommitCallbacks(execute=True):
+            self.room.capacity = 3
+            self.room.save()
+        with audit_actor('housekeeping'), self.captureOnCommitCallbacks(execute=True):
+            Room.objects.create(room_number='D2', floor=2)
+
+        self.assertEqual(AuditLog.objects.for_object(self.room).count(), 1)
+        self.assertEqual(AuditLog.objects.for_model(Room).count(), 2)
+        self.assertEqual(AuditLog.objects.by_actor(self.staff).get().action, 'UPDATE')
+        self.assertEqual(AuditLog.objects.by_actor('housekeeping').get().action, 'CREATE')
+        now = timezone.now()
+        self.assertEqual(AuditLog.objects.between(now - timedelta(minutes=1), now + timedelta(minutes=1)).count(), 2)
+        self.assertFalse(AuditLog.objects.between(start=now + timedelta(minutes=1)).exists())
+
+    def test_prune_deletes_only_expired_entries(self):
+        from django.core.management import call_command
+        from .models import AuditLog
+
+        now = timezone.now()
+        AuditLog.objects.bulk_create([
+            AuditLog(actor='x', model_name='Room', action='CREATE', timestamp=now - timedelta(days=days))
+            for days in (1, 400, 500, 600)
+        ])
+        out = StringIO()
+        call_command('prune_audit_log', '--dry-run', stdout=out)
+        self.assertIn('3 audit log entries', out.getvalue())
+        self.assertEqual(AuditLog.objects.count(), 4)
+
+        call_command('prune_audit_log', '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(AuditLog.objects.count(), 1)
+
+    def test_prune_warns_before_deleting_unarchived_months(self):
+        from django.core.management import call_command
+        err = StringIO()
+        call_command('prune_audit_log', '--days', '30', '--dry-run', stdout=StringIO(), stderr=err)
+        self.assertIn('not archived yet by archive_logs', err.getvalue())
+
+        err = StringIO()
+        call_command('prune_audit_log', '--days', '500', '--dry-run', stdout=StringIO(), stderr=err)
+        self.assertEqual(err.getvalue(), '')
+
+
+class LogArchiveTest(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from .models import AuditLog, LoginActivity
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        self.user = User.objects.create_user(username='auditor', password='p', is_staff=True, is_superuser=True)
+
+        now = timezone.now()
+        self.old = now - timedelta(days=120)
+        AuditLog.objects.bulk_create([
+            AuditLog(actor='x', model_name='Room', action='CREATE', timestamp=self.old, diff={'floor': [None, 1]}),
+            AuditLog(actor='x', model_name='Room', action='UPDATE', timestamp=self.old),
+            AuditLog(actor='x', model_name='Room', action='DELETE', timestamp=now),
+        ])
+        login = LoginActivity.objects.create(user=self.user, ip_address='10.0.0.1')
+        LoginActivity.objects.filter(pk=login.pk).update(timestamp=self.old)
+
+    def test_archive_moves_expired_months_to_jsonl(self):
+        import datetime
+        import gzip
+        import json
+        import os
+        from django.core.management import call_command
+        from django.db import connection
+        from . import partitions
+        from .models import AuditLog, LoginActivity
+
+        out = StringIO()
+        call_command('archive_logs', '--keep-months', '1', '--dry-run', stdout=out)
+        month = partitions.month_start(self.old.astimezone(datetime.timezone.utc).date())
+        self.assertIn(f'would archive {month:%Y-%m}', out.getvalue())
+        self.assertEqual(AuditLog.objects.count(), 3)
+
+        call_command('archive_logs', '--keep-months', '1', '--output-dir', self.archive_dir, stdout=StringIO())
+
+        self.assertEqual(list(AuditLog.objects.values_list('action', flat=True)), ['DELETE'])
+        self.assertFalse(LoginActivity.objects.exists())
+        table = partitions.month_table(AuditLog, month)
+        self.assertNotIn(table, connection.introspection.table_names())
+        with gzip.open(os.path.join(self.archive_dir, f'{table}.jsonl.gz'), 'rt') as archive:
+            rows = [json.loads(line) for line in archive]
+        self.assertEqual([row['action'] for row in rows], ['CREATE', 'UPDATE'])
+        self.assertEqual(json.loads(rows[0]['diff']), {'floor': [None, 1]})
+        self.assertTrue(os.path.exists(os.path.join(self.archive_dir, f'{partitions.month_table(LoginActivity, month)}.jsonl.gz')))
+
+    def test_partitions_only_archives_nothing(self):
+        from django.core.management import call_command
+        from .models import AuditLog, LoginActivity
+        out = StringIO()
+        call_command('archive_logs', '--keep-months', '1', '--partitions-only',
+                     '--output-dir', self.archive_dir, stdout=out)
+        self.assertIn('Created 0 new partitions', out.getvalue())
+        self.assertEqual((AuditLog.objects.count(), LoginActivity.objects.count()), (3, 1))
+
+    def test_table_is_kept_when_export_is_incomplete(self):
+        import datetime
+        from django.db import connection
+        from . import partitions
+        from .models import AuditLog
+        month = partitions.month_start(self.old.astimezone(datetime.timezone.utc).date())
+        table = partitions.detach_month(AuditLog, month)
+
+        with patch('hms.partitions.exported_rows', return_value=None):
+            self.assertEqual(partitions.archive_month_tables(AuditLog, self.archive_dir), [])
+        self.assertIn(table, connection.introspection.table_names())
+
+        self.assertEqual([rows for _, rows, _ in partitions.archive_month_tables(AuditLog, self.archive_dir)], [2])
+        self.assertNotIn(table, connection.introspection.table_names())
+
+    def test_detach_month_keeps_rows_outside_its_bounds(self):
+        import datetime
+        from . import partitions
+        from .models import AuditLog
+        month = datetime.date(2020, 3, 1)
+        start, end = partitions.month_bounds(month)
+        AuditLog.objects.bulk_create([
+            AuditLog(actor='edge', model_name='Room', action=action, timestamp=timestamp)
+            for action, timestamp in (('FIRST', start), ('LAST', end - timedelta(microseconds=1)),
+                                      ('NEXT', end), ('BEFORE', start - timedelta(microseconds=1)))
+        ])
+
+        partitions.detach_month(AuditLog, month)
+        self.assertEqual(sorted(AuditLog.objects.filter(actor='edge').values_list('action', flat=True)), ['BEFORE', 'NEXT'])
+
+    def test_admin_shows_current_month_by_default(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/admin/hms/auditlog/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry.action for entry in response.context['cl'].result_list], ['DELETE'])
+
+        response = self.client.get('/admin/hms/auditlog/', {'month': 'all'})
+        self.assertEqual(len(response.context['cl'].result_list), 3)
+
+        response = self.client.get('/admin/hms/loginactivity/', {'month': f'{timezone.localtime(self.old):%Y-%m}'})
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+
+
+class LoginRecorderTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from .logins import reset_recorder
+        cache.clear()  # login rate-limit counters
+        reset_recorder()
+        self.addCleanup(reset_recorder)
+        self.user = User.objects.create_user(username='fresher', password='secret123')
+
+    def test_logins_and_failures_are_recorded(self):
+        from django.urls import reverse
+        from .logins import login_summary
+        from .models import LoginActivity
+
+        self.client.post(reverse('hms:login'), {'username': 'fresher', 'password': 'wrong'}, REMOTE_ADDR='10.0.0.9')
+        self.client.post(reverse('hms:login'), {'username': 'fresher', 'password': 'secret123'}, REMOTE_ADDR='10.0.0.9')
+
+        failed = LoginActivity.objects.get(status=LoginActivity.FAILED)
+        self.assertEqual((failed.user, failed.username, failed.ip_address), (None, 'fresher', '10.0.0.9'))
+        self.assertEqual(LoginActivity.objects.get(status=LoginActivity.SUCCESS).user, self.user)
+
+        # Rows written by another worker count too, within the window
+        LoginActivity.objects.bulk_create([
+            LoginActivity(username='ghost', ip_address='10.0.0.7', status=LoginActivity.FAILED, timestamp=timestamp)
+            for timestamp in (timezone.now(), timezone.now() - timedelta(hours=1))
+        ])
+
+        summary = login_summary(15)
+        self.assertEqual((summary['success'], summary['failed']), (1, 2))
+        self.assertEqual(summary['top_failed_ips'], [('10.0.0.7', 1), ('10.0.0.9', 1)])
+
+        self.client.force_login(User.objects.create_user(username='warden', password='p', is_staff=True))
+        self.assertEqual(self.client.get(reverse('hms:login_activity_stats')).json()['failed'], 2)
+
+    def test_client_ip_trusts_only_configured_proxies(self):
+        from django.test import RequestFactory
+        from .logins import client_ip
+
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='6.6.6.6, 41.90.1.2')
+        with self.settings(TRUSTED_PROXY_COUNT=0):
+            self.assertEqual(client_ip(request), '10.0.0.1')
+        with self.settings(TRUSTED_PROXY_COUNT=1):
+            self.assertEqual(client_ip(request), '41.90.1.2')
+        request.META['HTTP_X_FORWARDED_FOR'] = 'not-an-ip'
+        with self.settings(TRUSTED_PROXY_COUNT=1):
+            self.assertIsNone(client_ip(request))
+
+    def test_recorder_flushes_by_size_and_drains_on_stop(self):
+        from .logins import LoginRecorder
+        from .models import LoginActivity
+
+        with patch.object(LoginActivity.objects, 'bulk_create') as bulk_create:
+            recorder = LoginRecorder(batch_size=2, flush_interval=60)
+            for i in range(3):
+                recorder.record(LoginActivity(username=f'u{i}', timestamp=timezone.now()))
+            recorder.stop()
+
+        self.assertEqual([len(c.args[0]) for c in bulk_create.call_args_list], [2, 1])
+
+    def test_recorder_flushes_after_interval(self):
+        import time
+        from .logins import LoginRecorder
+        from .models import LoginActivity
+
+        with patch.object(LoginActivity.objects, 'bulk_create') as bulk_create:
+            recorder = LoginRecorder(batch_size=100, flush_interval=0.05)
+            recorder.record(LoginActivity(username='u', timestamp=timezone.now()))
+            for _ in range(100):
+                if bulk_create.called:
+                    break
+                time.sleep(0.01)
+            self.assertTrue(bulk_create.called)
+            recorder.stop()
+
+
+class LoginRateLimitTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='fresher', password='secret123')
+
+    def test_sliding_window_weights_previous_window(self):
+        from django.core.cache.backends.locmem import LocMemCache
+        from .ratelimit import CacheCounters, SlidingWindow
+
+        window = SlidingWindow('t', limit=10, window=60, store=CacheCounters(LocMemCache('ratelimit-test', {})))
+        for _ in range(10):
+            window.hit('k', now=59)
+        self.assertEqual(window.retry_after('k', now=59), 1)
+        # Halfway through the next window half of the previous one still counts
+        self.assertEqual(window.usage('k', now=90), 5)
+        self.assertEqual(window.retry_after('k', now=90), 0)
+        self.assertEqual(window.usage('k', now=125), 0)
+
+    def test_database_counters_are_shared_and_expire(self):
+        from .models import RateLimitCounter
+        from .ratelimit import DatabaseCounters
+
+        counters = DatabaseCounters()
+        for _ in range(3):
+            counters.incr('k', timeout=60)
+        # A second store, as another worker would have, sees the same count
+        self.assertEqual(DatabaseCounters().get_many(['k', 'other']), {'k': 3})
+
+        RateLimitCounter.objects.filter(key='k').update(expires_at=timezone.now())
+        self.assertEqual(counters.get_many(['k']), {})
+        counters.incr('next', timeout=60)
+        self.assertEqual(list(RateLimitCounter.objects.values_list('key', flat=True)), ['next'])
+
+    def test_username_is_locked_before_password_hashing(self):
+        from django.urls import reverse
+
+        with self.settings(LOGIN_RATE_LIMITS={'ip': (100, 300), 'username': (3, 900)}):
+            for _ in range(3):
+                response = self.client.post(reverse('hms:login'), {'username': 'fresher', 'password': 'wrong'})
+                self.assertEqual(response.status_code, 200)
+
+            with patch('django.contrib.auth.backends.ModelBackend.authenticate') as authenticate:
+                response = self.client.post(reverse('hms:login'), {'username': 'fresher', 'password': 'secret123'})
+            self.assertEqual(response.status_code, 429)
+            self.assertGreater(int(response['Retry-After']), 0)
+            authenticate.assert_not_called()
+
+            # Other accounts from the same address are unaffected
+            User.objects.create_user(username='other', password='secret123')
+            response = self.client.post(reverse('hms:login'), {'username': 'other', 'password': 'secret123'})
+            self.assertEqual(response.status_code, 302)
+
+    def test_ip_limit_covers_allauth_logins(self):
+        from allauth.account.adapter import get_adapter
+        from django.contrib.auth import authenticate
+        from django.core.exceptions import ValidationError
+        from django.test import RequestFactory
+
+        request = RequestFactory().post('/accounts/login/', REMOTE_ADDR='10.1.1.1')
+        with self.settings(LOGIN_RATE_LIMITS={'ip': (2, 300), 'username': (100, 900)}):
+            adapter = get_adapter(request)
+            for email in ('a@example.com', 'b@example.com'):
+                adapter.pre_authenticate(request, email=email, password='x')
+                self.assertIsNone(authenticate(request, email=email, password='x'))
+            with self.assertRaises(ValidationError):
+                adapter.pre_authenticate(request, email='c@example.com', password='x')
+
+    def test_successful_logins_do_not_count_against_the_ip(self):
+        from django.urls import reverse
+
+        with self.settings(LOGIN_RATE_LIMITS={'ip': (2, 300), 'username': (100, 900)}):
+            # Many students signing in from one NAT address
+            for _ in range(4):
+                response = self.client.post(reverse('hms:login'), {'username': 'fresher', 'password': 'secret123'})
+                self.assertEqual(response.status_code, 302)
+                self.client.logout()
+
+            for _ in range(2):
+                self.client.post(reverse('hms:login'), {'username': 'fresher', 'password': 'wrong'})
+            response = self.client.post(reverse('hms:login'), {'username': 'fresher', 'password': 'secret123'})
+            self.assertEqual(response.status_code, 429)
+
+
+class ReadCacheTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from .caching import stats
+        cache.clear()
+        stats.reset()
+        self.addCleanup(cache.clear)
+        self.staff = User.objects.create_user(username='warden', password='p', is_staff=True)
+        self.student = User.objects.create_user(username='reader', password='p')
+        self.client.force_login(self.student)
+
+    def test_lists_are_cached_until_a_change_commits(self):
+        from django.urls import reverse
+        from .models import Announcement
+
+        Announcement.objects.create(title='Water outage', content='c', created_by=self.staff)
+        first = self.client.get(reverse('hms:announcements'))
+        self.assertContains(first, 'Water outage')
+
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('hms:announcements'))
+        self.assertFalse([q for q in queries if 'hms_announcement' in q['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Announcement.objects.create(title='Fire drill', content='c', created_by=self.staff)
+        self.assertContains(self.client.get(reverse('hms:announcements')), 'Fire drill')
+
+        self.assertEqual(self.caching_stats()['announcements'], {'hits': 1, 'misses': 2, 'hit_rate': 0.333})
+
+    def test_dashboard_and_events_use_the_cache(self):
+        from django.urls import reverse
+        from .models import Event
+
+        Event.objects.create(title='Games night', description='d', event_date=date.today() + timedelta(days=1),
+                             start_time=time(19, 0), location='Common room', created_by=self.staff, is_published=True)
+        for _ in range(2):
+            self.client.get(reverse('hms:student_dashboard'))
+            response = self.client.get(reverse('hms:events_list'))
+        self.assertContains(response, 'Games night')
+        summary = self.caching_stats()
+        for namespace in ('announcements', 'activities', 'documents', 'events'):
+            self.assertEqual((summary[namespace]['hits'], summary[namespace]['misses']), (1, 1))
+
+    def test_dashboard_reads_its_lists_with_one_get_many(self):
+        from django.core.cache import cache
+        from django.urls import reverse
+        self.client.get(reverse('hms:student_dashboard'))
+
+        with patch('hms.caching.cache', wraps=cache) as wrapped:
+            self.client.get(reverse('hms:student_dashboard'))
+        # One read for the namespace versions, one for the three lists
+        self.assertEqual([name for name, _, _ in wrapped.method_calls], ['get_many', 'get_many'])
+        self.assertEqual(self.caching_stats()['documents'], {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_stats_endpoint_is_staff_only(self):
+        import os
+        from django.urls import reverse
+        self.assertEqual(self.client.get(reverse('hms:cache_stats')).status_code, 403)
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('hms:cache_stats'))
+        self.assertEqual(response.json()['backend'], 'django.core.cache.backends.locmem.LocMemCache')
+        self.assertEqual(response.json()['pid'], os.getpid())
+
+    def caching_stats(self):
+        from .caching import stats
+        return stats.summary()
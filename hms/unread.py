@@ -0,0 +1,121 @@
+"""
+Unread Counters for HMS
+Denormalized per-user unread message and notification counts
+
+Counters change by F() deltas in the same transaction as the messages or
+notifications they count, so reading a badge is a single primary key
+lookup. `manage.py reconcile_unread_counters` repairs any drift.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+COUNTERS = ('messages', 'notifications')
+
+
+def adjust(user_id, **deltas):
+    """Add signed deltas to one user's counters, e.g. adjust(5, messages=1)"""
+    adjust_many({user_id: 1}, **deltas)
+
+
+def adjust_many(user_counts, **deltas):
+    """Apply deltas to many users in a few queries
+
+    Args:
+        user_counts: dict user_id -> multiplier (how many times to apply the deltas)
+        **deltas: counter -> signed change per multiplier
+
+    Users with the same multiplier share one UPDATE.
+    """
+    from .models import UnreadCounter
+
+    user_counts = {user_id: times for user_id, times in user_counts.items() if times}
+    deltas = {counter: value for counter, value in deltas.items() if value}
+    if not user_counts or not deltas:
+        return
+
+    groups = {}
+    for user_id, times in user_counts.items():
+        groups.setdefault(times, []).append(user_id)
+
+    with transaction.atomic(savepoint=False):
+        UnreadCounter.objects.bulk_create(
+            [UnreadCounter(user_id=user_id) for user_id in user_counts],
+            ignore_conflicts=True,
+        )
+        for times, user_ids in groups.items():
+            UnreadCounter.objects.filter(pk__in=user_ids).update(
+                **{counter: F(counter) + value * times for counter, value in deltas.items()}
+            )
+
+
+def counts_for(user):
+    """Unread counts for a user with one primary key lookup
+
+    Returns:
+        dict: {'messages': int, 'notifications': int}
+    """
+    from .models import UnreadCounter
+
+    user_id = getattr(user, 'pk', user)
+    row = UnreadCounter.objects.filter(pk=user_id).values(*COUNTERS).first()
+    return row or {counter: 0 for counter in COUNTERS}
+
+
+def mark_notifications_read(user, ids=None):
+    """Mark a user's unread notifications (optionally only the given ids) as read
+
+    Returns:
+        int: Number of notifications marked read
+    """
+    from .models import Notification
+
+    with transaction.atomic(savepoint=False):
+        unread = Notification.objects.filter(user=user, is_read=False)
+        if ids is not None:
+            unread = unread.filter(pk__in=ids)
+        marked = unread.update(is_read=True)
+        adjust(user.pk, notifications=-marked)
+    return marked
+
+
+def reconcile(batch_size=500):
+    """Recount every counter from the source tables and fix the ones that drifted
+
+    Conversation unread counts are first recomputed from their read
+    cursors; message badges are then taken from the conversations.
+
+    Returns:
+        int: Number of users whose counters were corrected
+    """
+    from .chat import recount_conversations
+    from .models import Conversation, Notification, UnreadCounter
+
+    recount_conversations()
+
+    actual = {}
+    for student_id, total in Conversation.objects.filter(student_unread__gt=0).values_list('student_id', 'student_unread'):
+        actual.setdefault(student_id, {'messages': 0, 'notifications': 0})['messages'] = total
+    inbox_total = Conversation.objects.aggregate(total=Sum('staff_unread'))['total'] or 0
+    if inbox_total:
+        for staff_id in User.objects.filter(is_staff=True).values_list('pk', flat=True):
+            actual.setdefault(staff_id, {'messages': 0, 'notifications': 0})['messages'] += inbox_total
+    for row in Notification.objects.filter(is_read=False).order_by().values('user_id').annotate(total=Count('id')):
+        actual.setdefault(row['user_id'], {'messages': 0, 'notifications': 0})['notifications'] = row['total']
+
+    stored = {row.pop('user_id'): row for row in UnreadCounter.objects.values('user_id', *COUNTERS)}
+    zero = {counter: 0 for counter in COUNTERS}
+
+    fixes = [
+        UnreadCounter(user_id=user_id, **actual.get(user_id, zero))
+        for user_id in set(actual) | set(stored)
+        if actual.get(user_id, zero) != stored.get(user_id, zero)
+    ]
+    UnreadCounter.objects.bulk_create(
+        fixes,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=list(COUNTERS) + ['updated_at'],
+        batch_size=batch_size,
+    )
+    return len(fixes)
@@ -21,6 +21,7 @@ urlpatterns = [
     # Kitchen / Admin
     path('kitchen/dashboard/', views.dashboard_admin, name='admin_dashboard'),
     path('kitchen/export-csv/', views.export_meals_csv, name='export_meals_csv'),
+    path('kitchen/export-xlsx/', views.export_meals_xlsx, name='export_meals_xlsx'),
     path('kitchen/send-notifications/', views.send_meal_notifications, name='send_notifications'),
     
     # Student Management
@@ -51,6 +52,8 @@ urlpatterns = [
     path('student/select-room/', views.select_room, name='select_room'),
     path('chat/', views.chat_view, name='chat'),
     path('chat/<int:recipient_id>/', views.chat_view, name='chat_with'),
+    path('chat/messages/', views.chat_messages, name='chat_messages'),
+    path('chat/<int:recipient_id>/messages/', views.chat_messages, name='chat_messages_with'),
 
     # Maintenance
     path('student/maintenance/', views.student_maintenance_list, name='student_maintenance_list'),
@@ -80,6 +83,8 @@ urlpatterns = [
 
     # Analytics Dashboard
     path('manage/analytics/', views.analytics_dashboard, name='analytics_dashboard'),
+    path('manage/analytics/logins/', views.login_activity_stats, name='login_activity_stats'),
+    path('manage/analytics/cache/', views.cache_stats, name='cache_stats'),
 
     # Visitor Management
     path('manage/visitors/', views.visitor_management, name='visitor_management'),
@@ -131,4 +136,8 @@ urlpatterns = [
     path('student/payment-history/', views.payment_history, name='payment_history'),
     path('payment/callback/', views.mpesa_callback, name='mpesa_callback'),
     path('payment/check/<int:payment_id>/', views.check_payment_status, name='check_payment_status'),
+
+    # Real-time notifications (Server-Sent Events, served over ASGI)
+    path('notifications/stream/', views.notification_stream, name='notification_stream'),
+    path('notifications/read/', views.mark_notifications_read, name='mark_notifications_read'),
 ]
\ No newline at end of file
@@ -6,7 +6,8 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
 from .models import (Student, Meal, Activity, AwayPeriod, Announcement, Document, Message, MaintenanceRequest,
-                     Room, RoomAssignment, RoomChangeRequest, LeaveRequest, Visitor, Event, EventRSVP, Payment, Notification)
+                     Room, RoomAssignment, RoomChangeRequest, LeaveRequest, Visitor, Event, EventRSVP, Payment, Notification,
+                     UnreadCounter)
 from .forms import (
     StudentRegistrationForm, AwayModeForm, ActivityForm, DocumentForm, 
     TimetableForm, RoomSelectionForm, MessageForm, MaintenanceRequestForm,
@@ -17,11 +18,16 @@ from datetime import date, datetime, time, timedelta
 from django.db import transaction, models
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import AuthenticationForm
-from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.urls import reverse
+import asyncio
 import json
+import math
+import os
 from .mpesa import MpesaClient
+from . import analytics, caching, chat, exports, logins, meal_stats, ratelimit, realtime, unread
+from .meals import create_away_period, resolve_meal_states
 
 # ==================== Authentication ====================
 
@@ -53,6 +59,14 @@ def user_login(request):
         return redirect('hms:student_dashboard')
 
     if request.method == 'POST':
+        try:
+            # Before the form is validated, so refused attempts never reach password hashing
+            ratelimit.check_login(request, request.POST.get('username', ''))
+        except ratelimit.RateLimited as e:
+            messages.error(request, f'Too many login attempts. Try again in {math.ceil(e.retry_after / 60)} minute(s).')
+            response = render(request, 'hms/login.html', {'form': AuthenticationForm(request)}, status=429)
+            response['Retry-After'] = str(e.retry_after)
+            return response
         form = AuthenticationForm(request, data=request.POST)
         if form.is_valid():
             user = form.get_user()
@@ -90,27 +104,13 @@ def student_dashboard(request):
     today = date.today()
     tomorrow = today + timedelta(days=1)
     
-    # Check if currently away
-    is_away_today = AwayPeriod.objects.filter(student=student, start_date__lte=today, end_date__gte=today).exists()
-    is_away_tomorrow = AwayPeriod.objects.filter(student=student, start_date__lte=tomorrow, end_date__gte=tomorrow).exists()
-
-    # Get meal status for today and tomorrow
-    meal_today, _ = Meal.objects.get_or_create(student=student, date=today)
-    if is_away_today and not meal_today.away:
-         # Auto-correct to away if valid period exists
-         meal_today.away = True
-         meal_today.breakfast = False
-         meal_today.early = False
-         meal_today.supper = False
-         meal_today.save()
-
-    meal_tomorrow, _ = Meal.objects.get_or_create(student=student, date=tomorrow)
-    if is_away_tomorrow and not meal_tomorrow.away:
-         meal_tomorrow.away = True
-         meal_tomorrow.breakfast = False
-         meal_tomorrow.early = False
-         meal_tomorrow.supper = False
-         meal_tomorrow.save()
+    # Resolve meal status and away coverage for today and tomorrow (read-only;
+    # rows are only written when the student submits)
+    meals, away_dates = resolve_meal_states(student, [today, tomorrow])
+    meal_today = meals[today]
+    meal_tomorrow = meals[tomorrow]
+    is_away_today = today in away_dates
+    is_away_tomorrow = tomorrow in away_dates
     
     # Check lock time for UI display
     now = timezone.now()
@@ -120,6 +120,16 @@ def student_dashboard(request):
     # Away Mode Form
     away_form = AwayModeForm()
 
+    # Shared lists come from the read cache (invalidated on save/delete)
+    cached = caching.get_or_build_many({
+        ('announcements', 'latest'):
+            lambda: list(Announcement.objects.filter(is_active=True).order_by('-created_at')[:5]),
+        ('activities', 'active'):
+            lambda: list(Activity.objects.filter(active=True).order_by('weekday', 'time')),
+        ('documents', 'all'):
+            lambda: list(Document.objects.all().order_by('-uploaded_at')),
+    })
+
     context = {
         'student': student,
         'meal_today': meal_today,
@@ -139,10 +149,9 @@ def student_dashboard(request):
         'tomorrow_early_attr': 'checked' if meal_tomorrow.early else '',
         'tomorrow_supper_attr': 'checked' if meal_tomorrow.supper else '',
         'tomorrow_disabled_attr': 'disabled' if is_away_tomorrow else '',
-        'announcements': Announcement.objects.filter(is_active=True).order_by('-created_at')[:5],
-        'activities': Activity.objects.filter(active=True).order_by('weekday', 'time'),
-        'documents': Document.objects.all().order_by('-uploaded_at'),
-        'unread_messages': Message.objects.filter(recipient=request.user, is_read=False).count(),
+        'announcements': cached[('announcements', 'latest')],
+        'activities': cached[('activities', 'active')],
+        'documents': cached[('documents', 'all')],
     }
     return render(request, 'hms/student/dashboard.html', context)
 
@@ -195,7 +204,7 @@ def confirm_meals(request):
         meal_date = datetime.strptime(meal_date_str, '%Y-%m-%d').date()
 
         # Check away status first
-        if AwayPeriod.objects.filter(student=student, start_date__lte=meal_date, end_date__gte=meal_date).exists():
+        if AwayPeriod.objects.filter(student=student).covering(meal_date).exists():
             messages.error(request, "You are marked as away for this date. Change your 'Away Mode' settings first.")
             return redirect('hms:student_dashboard')
         
@@ -211,9 +220,9 @@ def confirm_meals(request):
         
         if is_today and current_time > lock_time:
             # Cannot change breakfast/early settings after lock time
-            existing, _ = Meal.objects.get_or_create(student=student, date=meal_date)
-            breakfast = existing.breakfast
-            early = existing.early 
+            existing = Meal.objects.filter(student=student, date=meal_date).first()
+            breakfast = existing.breakfast if existing else False
+            early = existing.early if existing else False
             messages.warning(request, "Breakfast options are locked for today after 08:00 AM.")
             
         Meal.objects.update_or_create(
@@ -240,19 +249,13 @@ def toggle_away_mode(request):
         if form.is_valid():
             try:
                 student = request.user.student_profile
-                away_period = form.save(commit=False)
-                away_period.student = student
-                away_period.save()
                 
-                # Auto-update meals in this range to Away=True, Others=False
-                cur_date = away_period.start_date
-                while cur_date <= away_period.end_date:
-                    Meal.objects.update_or_create(
-                        student=student,
-                        date=cur_date,
-                        defaults={'away': True, 'breakfast': False, 'early': False, 'supper': False}
-                    )
-                    cur_date += timedelta(days=1)
+                # Save the period and mark meals in this range Away=True, Others=False in bulk
+                away_period = create_away_period(
+                    student,
+                    form.cleaned_data['start_date'],
+                    form.cleaned_data['end_date']
+                )
                     
                 messages.success(request, f"Away mode set from {away_period.start_date} to {away_period.end_date}")
             except Exception as e:
@@ -276,21 +279,16 @@ def dashboard_admin(request):
     
     today = date.today()
     tomorrow = today + timedelta(days=1)
+    week_start = today - timedelta(days=6)
+    
+    # Per-day counters for the whole window (last 7 days + tomorrow) in one query
+    window_stats = meal_stats.daily_meal_stats(week_start, tomorrow)
     
     # Counts for Today
-    today_stats = {
-        'breakfast': Meal.objects.filter(date=today, breakfast=True).count(),
-        'early': Meal.objects.filter(date=today, early=True).count(),
-        'supper': Meal.objects.filter(date=today, supper=True).count(),
-        'away': Meal.objects.filter(date=today, away=True).count(),
-    }
+    today_stats = window_stats[today]
     
     # Counts for Tomorrow
-    tomorrow_stats = {
-        'breakfast': Meal.objects.filter(date=tomorrow, breakfast=True).count(),
-        'early': Meal.objects.filter(date=tomorrow, early=True).count(),
-        'supper': Meal.objects.filter(date=tomorrow, supper=True).count(),
-    }
+    tomorrow_stats = window_stats[tomorrow]
     
     total_students = Student.objects.count()
     
@@ -347,27 +345,18 @@ def dashboard_admin(request):
     # 3. Notifications / "Unconfirmed" 
     # Logic: Students who have a profile but NO meal record for tomorrow
     # This might differ based on business logic, here assuming "No Record" = Unconfirmed
-    all_student_ids = Student.objects.values_list('id', flat=True)
-    confirmed_student_ids_tomorrow = Meal.objects.filter(date=tomorrow).values_list('student_id', flat=True)
-    unconfirmed_count = len(all_student_ids) - len(confirmed_student_ids_tomorrow)
+    unconfirmed_count = meal_stats.unconfirmed_count(tomorrow)
 
     # 4. Chart Data: Weekly Trends (Last 7 Days)
-    week_start = today - timedelta(days=6)
     weekly_labels = []
     weekly_breakfast = []
     weekly_supper = []
     
-    for i in range(7):
-        d = week_start + timedelta(days=i)
+    for d in meal_stats.date_range(week_start, today):
         weekly_labels.append(d.strftime('%a')) # Mon, Tue...
-        stats = Meal.objects.filter(date=d).aggregate(
-            b_count=models.Count('id', filter=models.Q(breakfast=True)),
-            s_count=models.Count('id', filter=models.Q(supper=True))
-        )
-        weekly_breakfast.append(stats['b_count'])
-        weekly_supper.append(stats['s_count'])
+        weekly_breakfast.append(window_stats[d]['breakfast'])
+        weekly_supper.append(window_stats[d]['supper'])
 
-    import json
     chart_data = {
         'weekly_labels': weekly_labels,
         'weekly_breakfast': weekly_breakfast,
@@ -386,39 +375,44 @@ def dashboard_admin(request):
 
     return render(request, 'hms/admin/dashboard.html', context)
 
+def _export_range(request):
+    """Date range for meal exports; the legacy ?date= parameter exports a single day"""
+    params = request.GET
+    if params.get('date') and not (params.get('start') or params.get('end')):
+        params = {'start': params['date'], 'end': params['date']}
+    return analytics.parse_date_range(params, default_days=1)
+
 @login_required
 def export_meals_csv(request):
-    """Export confirmed meals to CSV"""
+    """Stream confirmed meals for a date range to CSV, with per-student totals"""
     if not request.user.is_staff:
         return HttpResponseForbidden("Access denied")
-    
-    import csv
-    
-    date_str = request.GET.get('date', str(date.today()))
-    try:
-        query_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-    except ValueError:
-        query_date = date.today()
-        
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="meals_{query_date}.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow(['Name', 'University ID', 'Breakfast', 'Early', 'Supper', 'Away', 'Phone'])
-    
-    meals = Meal.objects.filter(date=query_date).select_related('student__user')
-    
-    for meal in meals:
-        writer.writerow([
-            meal.student.user.get_full_name(),
-            meal.student.university_id,
-            'Yes' if meal.breakfast else 'No',
-            'Yes' if meal.early else 'No',
-            'Yes' if meal.supper else 'No',
-            'Yes' if meal.away else 'No',
-            meal.student.phone
-        ])
-        
+
+    start_date, end_date = _export_range(request)
+
+    response = StreamingHttpResponse(
+        exports.streaming_content(request, exports.stream_csv(exports.csv_rows(start_date, end_date))),
+        content_type='text/csv'
+    )
+    response['Content-Disposition'] = f'attachment; filename="{exports.export_filename(start_date, end_date, "csv")}"'
+    return response
+
+@login_required
+def export_meals_xlsx(request):
+    """Export confirmed meals for a date range to an Excel workbook"""
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Access denied")
+
+    start_date, end_date = _export_range(request)
+
+    workbook = exports.build_xlsx(start_date, end_date)
+    size = os.fstat(workbook.fileno()).st_size
+    response = StreamingHttpResponse(
+        exports.streaming_content(request, exports.file_chunks(workbook), batch_size=1),
+        content_type=exports.XLSX_CONTENT_TYPE
+    )
+    response['Content-Length'] = str(size)
+    response['Content-Disposition'] = f'attachment; filename="{exports.export_filename(start_date, end_date, "xlsx")}"'
     return response
 
 @login_required
@@ -428,32 +422,24 @@ def send_meal_notifications(request):
         messages.error(request, "Access denied. Admin only.")
         return redirect('hms:student_dashboard')
     
-    from django.core.mail import send_mail
-    from django.conf import settings
+    from .notifications import NotificationService
     
     tomorrow = date.today() + timedelta(days=1)
     
-    # Get all students
-    all_students = Student.objects.all()
-    
-    # Get students who have confirmed meals for tomorrow
-    confirmed_student_ids = Meal.objects.filter(
-        date=tomorrow
-    ).values_list('student_id', flat=True)
-    
-    # Find unconfirmed students
-    unconfirmed_students = all_students.exclude(id__in=confirmed_student_ids)
+    # Unconfirmed students (not away or on leave), streamed with only the contact columns
+    contacts = Student.objects.unconfirmed_for(tomorrow).contacts()
+    student_lines = [
+        f"  • {f'{contact.first_name} {contact.last_name}'.strip()} ({contact.university_id}) - {contact.email}"
+        for contact in contacts.iterator(chunk_size=2000)
+    ]
     
-    if not unconfirmed_students.exists():
+    if not student_lines:
         messages.success(request, '✅ All students have confirmed their meals for tomorrow!')
         return redirect('hms:admin_dashboard')
     
     # Prepare email content
-    unconfirmed_count = unconfirmed_students.count()
-    student_list = '\n'.join([
-        f"  • {student.user.get_full_name()} ({student.university_id}) - {student.user.email}"
-        for student in unconfirmed_students
-    ])
+    unconfirmed_count = len(student_lines)
+    student_list = '\n'.join(student_lines)
     
     subject = f'⚠️ Meal Confirmation Alert - {unconfirmed_count} Students Unconfirmed for {tomorrow.strftime("%B %d, %Y")}'
     
@@ -463,7 +449,7 @@ Hello Admin,
 This is an automated notification from the Hostel Management System.
 
 📅 Date: {tomorrow.strftime("%A, %B %d, %Y")}
-⚠️ Unconfirmed Students: {unconfirmed_count} out of {all_students.count()}
+⚠️ Unconfirmed Students: {unconfirmed_count} out of {Student.objects.count()}
 
 The following students have NOT confirmed their meals for tomorrow:
 
@@ -478,23 +464,16 @@ This is an automated message from Hostel Management System.
 Do not reply to this email.
     """
     
-    try:
-        send_mail(
-            subject=subject,
-            message=message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[settings.ADMIN_EMAIL],
-            fail_silently=False,
-        )
-        
+    [(recipient, sent)] = NotificationService.send_bulk_email([(settings.ADMIN_EMAIL, subject, message, None)])
+    
+    if sent:
         messages.success(
             request, 
-            f'✅ Email notification sent successfully to {settings.ADMIN_EMAIL}! '
+            f'✅ Email notification sent successfully to {recipient}! '
             f'{unconfirmed_count} unconfirmed students for {tomorrow.strftime("%B %d")}'
         )
-        
-    except Exception as e:
-        messages.error(request, f'❌ Failed to send email: {str(e)}')
+    else:
+        messages.error(request, f'❌ Failed to send email to {recipient}. Check the server log for details.')
     
     return redirect('hms:admin_dashboard')
 
@@ -614,16 +593,18 @@ def away_list(request):
         return redirect('hms:student_dashboard')
         
     today = date.today()
-    away_periods = AwayPeriod.objects.filter(start_date__lte=today, end_date__gte=today).select_related('student__user')
+    students = AwayPeriod.objects.students_away_on(today).select_related('user')
     
-    return render(request, 'hms/admin/students.html', {'students': [ap.student for ap in away_periods]})
+    return render(request, 'hms/admin/students.html', {'students': students})
 
 # ==================== Announcements ====================
 
 @login_required
 def announcements_list(request):
     """View all announcements"""
-    announcements = Announcement.objects.filter(is_active=True).order_by('-created_at')
+    announcements = caching.get_or_build(
+        'announcements', 'active',
+        lambda: list(Announcement.objects.filter(is_active=True).select_related('created_by').order_by('-created_at')))
     context = {
         'announcements': announcements
     }
@@ -728,7 +709,7 @@ def create_announcement(request):
             try:
                 from .notifications import notify_new_announcement
                 notify_new_announcement(announcement)
-                messages.success(request, 'Announcement created successfully and notifications sent!')
+                messages.success(request, 'Announcement created successfully and notifications queued!')
             except Exception as e:
                 messages.warning(request, f'Announcement created but notifications failed: {str(e)}')
         else:
@@ -925,50 +906,94 @@ def select_room(request):
             
     return redirect('hms:student_profile')
 
+CHAT_INBOX_PAGE_SIZE = 25
+CHAT_PAGE_SIZE = 50
+
+def _chat_student(request, recipient_id):
+    """The student whose conversation the current user is viewing
+
+    Staff open a student's conversation by user id, and only students
+    (non-staff users with a student profile) can be opened; students
+    always see their own, which is shared with every staff member.
+    """
+    if request.user.is_staff:
+        if not recipient_id:
+            return None
+        return get_object_or_404(User, id=recipient_id, is_staff=False, student_profile__isnull=False)
+    return request.user
+
+def _send_message(request, student, conversation, form):
+    if conversation is None:
+        # Created by the first message, never by viewing
+        conversation = chat.conversation_for(student)
+    msg = form.save(commit=False)
+    msg.conversation = conversation
+    msg.sender = request.user
+    # Student messages go to the shared staff inbox
+    msg.recipient = conversation.student if chat.side_of(conversation, request.user) == 'staff' else None
+    # Conversation metadata and unread counters change in the same transaction
+    with transaction.atomic():
+        msg.save()
+    return msg
+
+def _message_page(thread, after=None, before=None, limit=CHAT_PAGE_SIZE):
+    """One page of a conversation, oldest first, using message ids as cursors
+
+    With `after`, returns the messages newer than that id (for polling);
+    otherwise the latest messages, or those older than `before`.
+
+    Returns:
+        tuple: (messages, has_more) where has_more means more messages lie
+        beyond the page in the direction requested
+    """
+    if after is not None:
+        page = list(thread.filter(id__gt=after).order_by('id')[:limit + 1])
+        return page[:limit], len(page) > limit
+    if before is not None:
+        thread = thread.filter(id__lt=before)
+    page = list(thread.order_by('-id')[:limit + 1])
+    return page[:limit][::-1], len(page) > limit
+
+def _message_json(message, user):
+    return {
+        'id': message.pk,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+        'time': timezone.localtime(message.timestamp).strftime('%H:%M'),
+        'mine': message.sender_id == user.pk,
+    }
+
 @login_required
 def chat_view(request, recipient_id=None):
     """Chat interface"""
     if request.user.is_staff:
-        # Admin view: List students
-        students = Student.objects.all().select_related('user')
-        
-        # Calculate unread counts
-        for s in students:
-            s.unread_count = Message.objects.filter(sender=s.user, recipient=request.user, is_read=False).count()
-
-        if recipient_id:
-             other_user = get_object_or_404(User, id=recipient_id)
-        else:
-             other_user = None
+        # Admin view: the shared inbox, most recent conversation first.
+        # Unread count, last activity and preview come from one query per page.
+        paginator = Paginator(Student.objects.inbox(), CHAT_INBOX_PAGE_SIZE)
+        students = paginator.get_page(request.GET.get('page'))
     else:
-        # Student view: Chat with Admin 
-        admin_user = User.objects.filter(is_staff=True).first()
-        if not admin_user:
-            messages.error(request, "No admin available to chat.")
-            return redirect('hms:student_dashboard')
-        other_user = admin_user
         students = None
+
+    student = _chat_student(request, recipient_id)
+    conversation = chat.find_conversation(student) if student else None
         
-    messages_qs = []
-    if other_user:
-        messages_qs = Message.objects.filter(
-            (models.Q(sender=request.user) & models.Q(recipient=other_user)) |
-            (models.Q(sender=other_user) & models.Q(recipient=request.user))
-        ).order_by('timestamp')
+    messages_qs, has_older = [], False
+    if conversation:
+        # Only the latest page; the page fetches older ones from chat_messages
+        messages_qs, has_older = _message_page(conversation.messages.all())
         
         # Mark as read
-        Message.objects.filter(recipient=request.user, sender=other_user).update(is_read=True)
+        chat.mark_read(conversation, request.user)
 
     if request.method == 'POST':
         form = MessageForm(request.POST)
-        if form.is_valid() and other_user:
-            msg = form.save(commit=False)
-            msg.sender = request.user
-            msg.recipient = other_user
-            msg.save()
+        if form.is_valid() and student:
+            _send_message(request, student, conversation, form)
             # Redirect to avoid form resubmission
             if request.user.is_staff:
-                 return redirect('hms:chat_with', recipient_id=other_user.id)
+                 url = reverse('hms:chat_with', kwargs={'recipient_id': student.pk})
+                 page = request.GET.get('page')
+                 return redirect(f'{url}?page={page}' if page else url)
             else:
                  return redirect('hms:chat')
             
@@ -976,13 +1001,54 @@ def chat_view(request, recipient_id=None):
         form = MessageForm()
         
     context = {
-        'other_user': other_user,
+        'conversation': conversation,
+        'chat_open': student is not None,
+        'other_user': student if request.user.is_staff else None,
         'messages': messages_qs,
+        'has_older': has_older,
         'form': form,
         'students': students
     }
     return render(request, 'hms/chat.html', context)
 
+@login_required
+def chat_messages(request, recipient_id=None):
+    """JSON message API for the chat page
+
+    GET ?after=<id> returns newer messages (polling), ?before=<id> older
+    ones (scrollback); with neither, the latest page. POST sends a message
+    and returns it.
+    """
+    student = _chat_student(request, recipient_id)
+    if not student:
+        return JsonResponse({'error': 'No conversation selected'}, status=404)
+    conversation = chat.find_conversation(student)
+
+    if request.method == 'POST':
+        form = MessageForm(request.POST)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        msg = _send_message(request, student, conversation, form)
+        return JsonResponse({'message': _message_json(msg, request.user)}, status=201)
+
+    if conversation is None:
+        return JsonResponse({'messages': [], 'has_more': False})
+
+    try:
+        after = int(request.GET['after']) if request.GET.get('after') else None
+        before = int(request.GET['before']) if request.GET.get('before') else None
+    except ValueError:
+        return JsonResponse({'error': 'Cursors must be message ids'}, status=400)
+
+    page, has_more = _message_page(conversation.messages.all(), after, before)
+    if getattr(conversation, f'{chat.side_of(conversation, request.user)}_unread'):
+        chat.mark_read(conversation, request.user)
+
+    return JsonResponse({
+        'messages': [_message_json(message, request.user) for message in page],
+        'has_more': has_more,
+    })
+
 # ==================== Maintenance Requests ====================
 
 @login_required
@@ -1473,13 +1539,9 @@ def approve_leave_request(request, pk):
             leave_req.reviewed_at = timezone.now()
             leave_req.save()
             
-            # If approved, create AwayPeriod automatically
+            # If approved, create AwayPeriod and flag the covered meals automatically
             if leave_req.status == 'approved':
-                AwayPeriod.objects.create(
-                    student=leave_req.student,
-                    start_date=leave_req.start_date,
-                    end_date=leave_req.end_date
-                )
+                create_away_period(leave_req.student, leave_req.start_date, leave_req.end_date)
                 messages.success(request, f'Leave request approved for {leave_req.student.user.get_full_name()}. Away period created.')
             else:
                 messages.info(request, f'Leave request updated to {leave_req.get_status_display()}.')
@@ -1504,25 +1566,28 @@ def analytics_dashboard(request):
         messages.error(request, "Access denied. Admin only.")
         return redirect('hms:student_dashboard')
     
-    import json
-    from django.db.models import Count, Q
-    from django.db.models.functions import TruncDate
-    
     today = date.today()
     week_start = today - timedelta(days=6)
-    month_start = today - timedelta(days=29)
+    range_start, range_end = analytics.parse_date_range(request.GET)
+    
+    # One grouped meal query per window; the weekly one is reused when the
+    # selected range covers it, and never widened to span both
+    range_stats = meal_stats.daily_meal_stats(range_start, range_end)
+    if range_start <= week_start and today <= range_end:
+        week_stats = range_stats
+    else:
+        week_stats = meal_stats.daily_meal_stats(week_start, today)
     
     # ==================== SUMMARY STATS ====================
     total_students = Student.objects.count()
-    total_rooms = Room.objects.count()
-    available_rooms = Room.objects.filter(is_available=True).count()
+    rooms = analytics.room_breakdown()
+    room_stats = rooms['occupancy']
     
     # Today's meal stats
-    today_meals = Meal.objects.filter(date=today)
-    today_breakfast = today_meals.filter(breakfast=True).count()
-    today_supper = today_meals.filter(supper=True).count()
-    today_away = today_meals.filter(away=True).count()
-    today_confirmed = today_meals.count()
+    today_breakfast = week_stats[today]['breakfast']
+    today_supper = week_stats[today]['supper']
+    today_away = week_stats[today]['away']
+    today_confirmed = week_stats[today]['confirmed']
     
     # Active leave requests
     active_leaves = LeaveRequest.objects.filter(
@@ -1531,84 +1596,33 @@ def analytics_dashboard(request):
         end_date__gte=today
     ).count()
     
-    # Pending items
-    pending_maintenance = MaintenanceRequest.objects.filter(status='pending').count()
-    pending_leaves = LeaveRequest.objects.filter(status='pending').count()
-    
-    # ==================== WEEKLY MEAL TRENDS ====================
-    weekly_labels = []
-    weekly_breakfast = []
-    weekly_supper = []
-    weekly_early = []
-    weekly_away = []
-    
-    for i in range(7):
-        d = week_start + timedelta(days=i)
-        weekly_labels.append(d.strftime('%a'))
-        stats = Meal.objects.filter(date=d).aggregate(
-            breakfast=Count('id', filter=Q(breakfast=True)),
-            supper=Count('id', filter=Q(supper=True)),
-            early=Count('id', filter=Q(early=True)),
-            away=Count('id', filter=Q(away=True)),
-        )
-        weekly_breakfast.append(stats['breakfast'] or 0)
-        weekly_supper.append(stats['supper'] or 0)
-        weekly_early.append(stats['early'] or 0)
-        weekly_away.append(stats['away'] or 0)
-    
-    # ==================== MONTHLY TRENDS ====================
-    monthly_labels = []
-    monthly_breakfast = []
-    monthly_supper = []
-    
-    for i in range(30):
-        d = month_start + timedelta(days=i)
-        monthly_labels.append(d.strftime('%m/%d'))
-        stats = Meal.objects.filter(date=d).aggregate(
-            breakfast=Count('id', filter=Q(breakfast=True)),
-            supper=Count('id', filter=Q(supper=True)),
-        )
-        monthly_breakfast.append(stats['breakfast'] or 0)
-        monthly_supper.append(stats['supper'] or 0)
+    # ==================== MEAL TRENDS ====================
+    weekly = analytics.meal_series(week_start, today, label_format='%a', stats=week_stats)
+    monthly = analytics.meal_series(range_start, range_end, stats=range_stats)
     
     # ==================== MAINTENANCE STATS ====================
-    maintenance_by_status = {
-        'pending': MaintenanceRequest.objects.filter(status='pending').count(),
-        'in_progress': MaintenanceRequest.objects.filter(status='in_progress').count(),
-        'resolved': MaintenanceRequest.objects.filter(status='resolved').count(),
-    }
-    
-    maintenance_by_priority = {
-        'low': MaintenanceRequest.objects.filter(priority='low').count(),
-        'medium': MaintenanceRequest.objects.filter(priority='medium').count(),
-        'high': MaintenanceRequest.objects.filter(priority='high').count(),
-        'critical': MaintenanceRequest.objects.filter(priority='critical').count(),
-    }
+    maintenance = analytics.maintenance_breakdown()
+    maintenance_by_status = maintenance['status']
+    maintenance_by_priority = maintenance['priority']
     
     # ==================== LEAVE REQUEST STATS ====================
-    leave_by_status = {
-        'pending': LeaveRequest.objects.filter(status='pending').count(),
-        'approved': LeaveRequest.objects.filter(status='approved').count(),
-        'rejected': LeaveRequest.objects.filter(status='rejected').count(),
+    leaves = analytics.leave_breakdown()
+    leave_by_status = leaves['status']
+    leave_by_type = {
+        leave_type_name: leaves['type'][leave_type_code]
+        for leave_type_code, leave_type_name in LeaveRequest.LEAVE_TYPES
     }
     
-    leave_by_type = {}
-    for leave_type_code, leave_type_name in LeaveRequest.LEAVE_TYPES:
-        leave_by_type[leave_type_name] = LeaveRequest.objects.filter(leave_type=leave_type_code).count()
+    # Pending items
+    pending_maintenance = maintenance_by_status['pending']
+    pending_leaves = leave_by_status['pending']
     
     # ==================== ROOM OCCUPANCY ====================
-    room_stats = {
-        'total': total_rooms,
-        'available': available_rooms,
-        'occupied': total_rooms - available_rooms,
-        'occupancy_rate': round((total_rooms - available_rooms) / total_rooms * 100, 1) if total_rooms > 0 else 0
+    room_by_type = {
+        room_type_name: rooms['type'][room_type_code]
+        for room_type_code, room_type_name in Room.ROOM_TYPES
     }
     
-    # Room by type
-    room_by_type = {}
-    for room_type_code, room_type_name in Room.ROOM_TYPES:
-        room_by_type[room_type_name] = Room.objects.filter(room_type=room_type_code).count()
-    
     # ==================== RECENT ACTIVITY ====================
     recent_maintenance = MaintenanceRequest.objects.select_related('student__user').order_by('-created_at')[:5]
     recent_leaves = LeaveRequest.objects.select_related('student__user').order_by('-created_at')[:5]
@@ -1616,18 +1630,8 @@ def analytics_dashboard(request):
     
     # ==================== CHART DATA JSON ====================
     chart_data = {
-        'weekly': {
-            'labels': weekly_labels,
-            'breakfast': weekly_breakfast,
-            'supper': weekly_supper,
-            'early': weekly_early,
-            'away': weekly_away,
-        },
-        'monthly': {
-            'labels': monthly_labels,
-            'breakfast': monthly_breakfast,
-            'supper': monthly_supper,
-        },
+        'weekly': weekly,
+        'monthly': monthly,
         'maintenance_status': maintenance_by_status,
         'maintenance_priority': maintenance_by_priority,
         'leave_status': leave_by_status,
@@ -1636,6 +1640,9 @@ def analytics_dashboard(request):
     
     context = {
         'today': today,
+        'range_start': range_start,
+        'range_end': range_end,
+        'range_days': (range_end - range_start).days + 1,
         # Summary stats
         'total_students': total_students,
         'today_breakfast': today_breakfast,
@@ -1660,6 +1667,34 @@ def analytics_dashboard(request):
     return render(request, 'hms/admin/analytics_dashboard.html', context)
 
 
+@login_required
+def cache_stats(request):
+    """Read cache hits and misses per namespace, as JSON
+
+    The counts are kept in memory by each worker, so they cover only the
+    worker answering this request (identified by 'pid').
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Access denied")
+    return JsonResponse({
+        'backend': settings.CACHES['default']['BACKEND'],
+        'pid': os.getpid(),
+        'namespaces': caching.stats.summary(),
+    })
+
+
+@login_required
+def login_activity_stats(request):
+    """Recent login rates, failures and countries across all workers, as JSON"""
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Access denied")
+    try:
+        minutes = min(max(int(request.GET.get('minutes', 15)), 1), 60)
+    except ValueError:
+        return JsonResponse({'error': 'minutes must be a number'}, status=400)
+    return JsonResponse(logins.login_summary(minutes))
+
+
 @login_required
 def visitor_management(request):
     """View to list active visitors and check them in/out"""
@@ -1719,23 +1754,22 @@ def events_list(request):
     """List all published events for students"""
     today = date.today()
     
-    # Get all published events
-    upcoming_events = Event.objects.filter(
-        is_published=True,
-        event_date__gte=today
-    ).order_by('event_date', 'start_time')
-    
-    past_events = Event.objects.filter(
-        is_published=True,
-        event_date__lt=today
-    ).order_by('-event_date', '-start_time')[:10]
+    # Get all published events (cached per day; each get returns fresh
+    # copies, so attaching RSVPs below never touches the cached lists)
+    upcoming_events, past_events = caching.get_or_build('events', f'published:{today.isoformat()}', lambda: (
+        list(Event.objects.filter(
+            is_published=True,
+            event_date__gte=today
+        ).order_by('event_date', 'start_time')),
+        list(Event.objects.filter(
+            is_published=True,
+            event_date__lt=today
+        ).order_by('-event_date', '-start_time')[:10]),
+    ))
     
     # Get student's RSVPs if user is a student
     my_rsvps = {}
     
-    # Convert queryset to list so we can attach attributes
-    upcoming_events = list(upcoming_events)
-    
     if hasattr(request.user, 'student_profile'):
         student = request.user.student_profile
         rsvps = EventRSVP.objects.filter(student=student).select_related('event')
@@ -2146,3 +2180,63 @@ def check_payment_status(request, payment_id):
         messages.error(request, f"Query failed: {response.get('ResponseDescription', response.get('errorMessage'))}")
         
     return redirect('hms:payment_history')
+
+
+# ==================== REAL-TIME NOTIFICATIONS ====================
+
+SSE_KEEPALIVE_SECONDS = 25
+
+def _sse(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@login_required
+async def notification_stream(request):
+    """Server-Sent Events stream of the user's new notifications and unread count
+
+    Idle streams only hold an asyncio queue, so one ASGI worker can keep
+    thousands open. Under WSGI every stream would pin a worker thread, so
+    the endpoint answers 204 instead, which tells EventSource not to reconnect.
+    """
+    from django.core.handlers.asgi import ASGIRequest
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    user = await request.auser()
+    broker = realtime.get_broker()
+
+    async def events():
+        subscription = broker.subscribe(realtime.user_channel(user.pk))
+        try:
+            counts = await UnreadCounter.objects.filter(pk=user.pk).values('notifications').afirst()
+            yield _sse('unread', {'unread': counts['notifications'] if counts else 0})
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield _sse(event['type'], event)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+def mark_notifications_read(request):
+    """Mark the user's notifications as read (all, or the ids posted)"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+
+    ids = request.POST.getlist('id') or None
+    if ids is not None:
+        try:
+            ids = [int(pk) for pk in ids]
+        except ValueError:
+            return JsonResponse({'error': 'Invalid notification id'}, status=400)
+
+    marked = unread.mark_notifications_read(request.user, ids)
+    return JsonResponse({'marked': marked, 'unread': unread.counts_for(request.user)['notifications']})